@@ -4,15 +4,18 @@
 動画に左上キャプション（見出し）を追加するスクリプト
 """
 
-import sys
-import subprocess
 import argparse
 
+from compose_video import compose, DEFAULT_ENCODE
+
 def add_header_caption(input_video, output_video, caption_text, subtitle_file=None,
-                       bg_color='#ff0000', text_color='#ffffff', font_size=24):
+                       bg_color='#ff0000', text_color='#ffffff', font_size=24, encode=None,
+                       start=None, end=None, smart=False):
     """
     動画に左上キャプション（見出し）を追加
 
+    compose_video.compose で字幕と見出しを1回のエンコードで合成する。
+
     Args:
         input_video: 入力動画パス
         output_video: 出力動画パス
@@ -21,69 +24,33 @@ def add_header_caption(input_video, output_video, caption_text, subtitle_file=No
         bg_color: 背景色（例：#ff0000）
         text_color: 文字色（例：#ffffff）
         font_size: フォントサイズ
+        encode: エンコード設定（preset / crf / threads、compose_video.DEFAULT_ENCODE を参照）
+        start: 見出しの表示開始（秒、None なら先頭から）
+        end: 見出しの表示終了（秒、None なら最後まで）
+        smart: True ならレイヤーが表示されるGOPだけを再エンコード（compose_video.compose を参照）
     """
+    layers = []
 
-    # 色をffmpeg形式に変換（#rrggbb -> 0xRRGGBB）
-    def hex_to_ffmpeg_color(hex_color):
-        # #rrggbb -> rrggbb
-        hex_color = hex_color.lstrip('#')
-        # RGB形式のまま（drawtextはRGB形式）
-        return f"0x{hex_color}"
-
-    bg_ffmpeg = hex_to_ffmpeg_color(bg_color)
-    text_ffmpeg = hex_to_ffmpeg_color(text_color)
-
-    # エスケープ処理
-    caption_escaped = caption_text.replace(':', '\\:').replace("'", "\\'")
-
-    # drawtextフィルター（左上のキャプション）
-    # 太字効果: 黒い縁取りを追加して文字を太く見せる
-    drawtext_filter = (
-        f"drawtext=text='{caption_escaped}':"
-        f"fontfile=/home/lasuone/.fonts/NotoSansJP.ttf:"
-        f"fontsize={font_size}:"
-        f"fontcolor={text_ffmpeg}:"
-        f"borderw=3:"
-        f"bordercolor=black:"
-        f"box=1:"
-        f"boxcolor={bg_ffmpeg}@1.0:"
-        f"boxborderw=15:"
-        f"x=50:"
-        f"y=50"
-    )
-
-    # 字幕ファイルがある場合は組み合わせる
+    # 字幕ファイルがある場合は組み合わせる（見出しは字幕の上に重ねる）
     if subtitle_file:
-        subtitle_filter = (
-            f"subtitles={subtitle_file}:"
-            f"force_style='FontName=Noto Sans CJK JP,FontSize=24,"
-            f"PrimaryColour=&HFFFFFF,OutlineColour=&H000000,"
-            f"BackColour=&H00000000,BorderStyle=1,Outline=2,Shadow=0,"
-            f"Alignment=2,MarginV=50'"
-        )
-        vf = f"{subtitle_filter},{drawtext_filter}"
-    else:
-        vf = drawtext_filter
+        layers.append({'type': 'subtitles', 'file': subtitle_file})
+        print(f"With subtitles from: {subtitle_file}")
 
-    # ffmpegコマンド
-    cmd = [
-        'ffmpeg',
-        '-i', input_video,
-        '-vf', vf,
-        '-c:a', 'copy',
-        '-y',
-        output_video
-    ]
+    # drawtextフィルター（左上のキャプション）
+    layers.append({
+        'type': 'drawtext',
+        'text': caption_text,
+        'bg_color': bg_color,
+        'text_color': text_color,
+        'font_size': font_size,
+        'x': 50,
+        'y': 50,
+        'start': start,
+        'end': end
+    })
 
     print(f"Adding header caption: '{caption_text}'")
-    if subtitle_file:
-        print(f"With subtitles from: {subtitle_file}")
-    print(f"Output: {output_video}")
-    print()
-
-    # 実行
-    subprocess.run(cmd, check=True)
-    print("Done!")
+    compose(input_video, output_video, layers, encode, smart=smart)
 
 def main():
     parser = argparse.ArgumentParser(description='動画に左上キャプション（見出し）を追加')
@@ -94,6 +61,13 @@ def main():
     parser.add_argument('--bg-color', default='#ff0000', help='背景色（デフォルト：#ff0000）')
     parser.add_argument('--text-color', default='#ffffff', help='文字色（デフォルト：#ffffff）')
     parser.add_argument('--font-size', type=int, default=24, help='フォントサイズ（デフォルト：24）')
+    parser.add_argument('--preset', default=DEFAULT_ENCODE['preset'], help=f"x264のプリセット（デフォルト：{DEFAULT_ENCODE['preset']}）")
+    parser.add_argument('--crf', type=int, default=DEFAULT_ENCODE['crf'], help=f"画質（デフォルト：{DEFAULT_ENCODE['crf']}）")
+    parser.add_argument('--threads', type=int, default=DEFAULT_ENCODE['threads'], help=f"エンコードのスレッド数（デフォルト：{DEFAULT_ENCODE['threads']}＝自動）")
+    parser.add_argument('--start', type=float, help='見出しの表示開始（秒、省略すると先頭から）')
+    parser.add_argument('--end', type=float, help='見出しの表示終了（秒、省略すると最後まで）')
+    parser.add_argument('--smart', action='store_true',
+                        help='見出し・字幕が表示されるGOPだけを再エンコードし、それ以外はストリームコピー')
 
     args = parser.parse_args()
 
@@ -104,7 +78,11 @@ def main():
         args.subtitles,
         args.bg_color,
         args.text_color,
-        args.font_size
+        args.font_size,
+        {'preset': args.preset, 'crf': args.crf, 'threads': args.threads},
+        args.start,
+        args.end,
+        args.smart
     )
 
 if __name__ == '__main__':
@@ -5,141 +5,43 @@
 """
 
 import sys
-import subprocess
 import argparse
-from PIL import Image, ImageDraw, ImageFont
-import tempfile
-import os
+from pathlib import Path
 
-def create_rounded_rectangle_with_text(text, width, height, bg_color, text_color,
-                                       corner_radius=20, font_size=84, padding=15):
-    """
-    角丸の背景に文字を描画した画像を生成
-    """
-    # 画像を作成（透明背景）
-    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
-
-    # 角丸の矩形を描画
-    draw.rounded_rectangle(
-        [(0, 0), (width, height)],
-        radius=corner_radius,
-        fill=bg_color
-    )
-
-    # フォントを読み込む
-    try:
-        font = ImageFont.truetype('/home/lasuone/.fonts/NotoSansJP.ttf', font_size)
-    except:
-        font = ImageFont.load_default()
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'src' / 'scripts'))
 
-    # テキストのバウンディングボックスを取得
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-
-    # テキストを中央に配置
-    text_x = (width - text_width) // 2
-    text_y = (height - text_height) // 2 - bbox[1]
-
-    # テキストを描画（太字効果のため複数回描画）
-    for offset_x in [-2, -1, 0, 1, 2]:
-        for offset_y in [-2, -1, 0, 1, 2]:
-            if offset_x != 0 or offset_y != 0:
-                draw.text((text_x + offset_x, text_y + offset_y), text,
-                         font=font, fill=(0, 0, 0, 255))  # 黒い縁取り
-
-    # メインのテキストを描画
-    draw.text((text_x, text_y), text, font=font, fill=text_color)
-
-    return img
+from compose_video import compose, DEFAULT_ENCODE
 
 def add_header_with_rounded_bg(input_video, output_video, caption_text, subtitle_file=None,
                                 bg_color='#ff0000', text_color='#ffffff', font_size=84,
-                                x=50, y=50):
+                                x=50, y=50, encode=None, start=None, end=None, smart=False):
     """
     角丸背景付きの見出しを追加
-    """
 
-    # 色をRGBAタプルに変換
-    def hex_to_rgba(hex_color):
-        hex_color = hex_color.lstrip('#')
-        r = int(hex_color[0:2], 16)
-        g = int(hex_color[2:4], 16)
-        b = int(hex_color[4:6], 16)
-        return (r, g, b, 255)
-
-    bg_rgba = hex_to_rgba(bg_color)
-    text_rgba = hex_to_rgba(text_color)
-
-    # テキストの幅と高さを推定（文字数 * フォントサイズ + パディング）
-    text_length = len(caption_text)
-    estimated_width = text_length * font_size + 60
-    estimated_height = font_size + 60
-
-    # 角丸背景付きの画像を生成
-    img = create_rounded_rectangle_with_text(
-        caption_text,
-        estimated_width,
-        estimated_height,
-        bg_rgba,
-        text_rgba,
-        corner_radius=25,
-        font_size=font_size,
-        padding=30
-    )
-
-    # 一時ファイルに保存
-    temp_img = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-    img.save(temp_img.name, 'PNG')
-    temp_img.close()
-
-    try:
-        # 字幕フィルターとオーバーレイフィルターを組み合わせる
-        if subtitle_file:
-            subtitle_filter = (
-                f"subtitles={subtitle_file}:"
-                f"force_style='FontName=Noto Sans CJK JP,FontSize=24,"
-                f"PrimaryColour=&HFFFFFF,OutlineColour=&H000000,"
-                f"BackColour=&H00000000,BorderStyle=1,Outline=2,Shadow=0,"
-                f"Alignment=2,MarginV=50'"
-            )
-            # ffmpegコマンド（字幕あり）
-            cmd = [
-                'ffmpeg',
-                '-i', input_video,
-                '-i', temp_img.name,
-                '-filter_complex', f'[0:v]{subtitle_filter}[v];[v][1:v]overlay={x}:{y}',
-                '-c:a', 'copy',
-                '-y',
-                output_video
-            ]
-        else:
-            # ffmpegコマンド（字幕なし）
-            cmd = [
-                'ffmpeg',
-                '-i', input_video,
-                '-i', temp_img.name,
-                '-filter_complex', f'[0:v][1:v]overlay={x}:{y}',
-                '-c:a', 'copy',
-                '-y',
-                output_video
-            ]
-
-        print(f"Adding rounded header caption: '{caption_text}'")
-        if subtitle_file:
-            print(f"With subtitles from: {subtitle_file}")
-        print(f"Output: {output_video}")
-        print()
-
-        # 実行
-        subprocess.run(cmd, check=True)
-        print("Done!")
-
-    finally:
-        # 一時ファイルを削除
-        if os.path.exists(temp_img.name):
-            os.unlink(temp_img.name)
+    compose_video.compose で字幕と見出し画像を1回のエンコードで合成する。
+    start / end で見出しの表示区間を指定すると、smart=True のときその区間のGOPだけを再エンコードする。
+    """
+    layers = []
+
+    # 字幕フィルターとオーバーレイフィルターを組み合わせる
+    if subtitle_file:
+        layers.append({'type': 'subtitles', 'file': subtitle_file})
+        print(f"With subtitles from: {subtitle_file}")
+
+    layers.append({
+        'type': 'rounded',
+        'text': caption_text,
+        'bg_color': bg_color,
+        'text_color': text_color,
+        'font_size': font_size,
+        'x': x,
+        'y': y,
+        'start': start,
+        'end': end
+    })
+
+    print(f"Adding rounded header caption: '{caption_text}'")
+    compose(input_video, output_video, layers, encode, smart=smart)
 
 def main():
     parser = argparse.ArgumentParser(description='角丸背景付きの見出しを追加')
@@ -152,6 +54,13 @@ def main():
     parser.add_argument('--font-size', type=int, default=84, help='フォントサイズ（デフォルト：84）')
     parser.add_argument('--x', type=int, default=50, help='X座標（デフォルト：50）')
     parser.add_argument('--y', type=int, default=50, help='Y座標（デフォルト：50）')
+    parser.add_argument('--preset', default=DEFAULT_ENCODE['preset'], help=f"x264のプリセット（デフォルト：{DEFAULT_ENCODE['preset']}）")
+    parser.add_argument('--crf', type=int, default=DEFAULT_ENCODE['crf'], help=f"画質（デフォルト：{DEFAULT_ENCODE['crf']}）")
+    parser.add_argument('--threads', type=int, default=DEFAULT_ENCODE['threads'], help=f"エンコードのスレッド数（デフォルト：{DEFAULT_ENCODE['threads']}＝自動）")
+    parser.add_argument('--start', type=float, help='見出しの表示開始（秒、省略すると先頭から）')
+    parser.add_argument('--end', type=float, help='見出しの表示終了（秒、省略すると最後まで）')
+    parser.add_argument('--smart', action='store_true',
+                        help='見出し・字幕が表示されるGOPだけを再エンコードし、それ以外はストリームコピー')
 
     args = parser.parse_args()
 
@@ -164,7 +73,11 @@ def main():
         args.text_color,
         args.font_size,
         args.x,
-        args.y
+        args.y,
+        {'preset': args.preset, 'crf': args.crf, 'threads': args.threads},
+        args.start,
+        args.end,
+        args.smart
     )
 
 if __name__ == '__main__':
@@ -3,14 +3,35 @@
 
 set -e
 
+# オプション（ステージキャッシュの制御）
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --force)
+            export TELOP_FORCE=1
+            shift
+            ;;
+        --from-stage)
+            export TELOP_FROM_STAGE="$2"
+            shift 2
+            ;;
+        *)
+            break
+            ;;
+    esac
+done
+
 # 使い方
 if [ $# -lt 1 ]; then
-    echo "使い方: ./apply-telop.sh <動画ファイル> [字幕SRTファイル] [速報バナーテキスト]"
+    echo "使い方: ./apply-telop.sh [--force] [--from-stage STAGE] <動画ファイル> [字幕SRTファイル] [速報バナーテキスト]"
     echo ""
     echo "例:"
     echo "  ./apply-telop.sh video.mp4                                    # 字幕自動生成"
     echo "  ./apply-telop.sh video.mp4 subtitles.srt                      # 既存字幕を使用"
     echo "  ./apply-telop.sh video.mp4 subtitles.srt '速報：重大発表'     # バナー付き"
+    echo "  ./apply-telop.sh --from-stage transcript video.mp4            # 文字起こしからやり直す"
+    echo ""
+    echo "入力とパラメータが変わっていないステージ（audio, analysis, transcript, merge）は"
+    echo "キャッシュから復元されます。--force で全ステージを再実行します。"
     exit 1
 fi
 
@@ -31,15 +52,38 @@ echo "動画: $VIDEO_PATH"
 echo "速報バナー: $NEWS_TEXT"
 echo ""
 
+# ステージキャッシュ（入力のハッシュとパラメータが同じなら実行せずに出力を復元）
+STAGE_CACHE="python3 src/scripts/stage_cache.py"
+ANALYSIS_PARAMS=(--param percentile=75 --param engine=pcm)
+TRANSCRIPT_PARAMS=(--param backend=whisper-api --param model=whisper-1 --param language=ja --param max_chars_per_line=20)
+
 # 音声解析
+# 字幕を自動生成する場合は音声を一度だけ抽出して共有する
+# （既存字幕を使う場合は解析キャッシュが効けばデコード自体を省略できる）
 echo "[1/4] 音声解析中..."
-python3 src/scripts/analyze-audio.py "$VIDEO_PATH" 75 2>/dev/null > audio-analysis.json
+if [ -n "$SRT_FILE" ] && [ -f "$SRT_FILE" ]; then
+    $STAGE_CACHE run analysis --input "$VIDEO_PATH" "${ANALYSIS_PARAMS[@]}" --output audio-analysis.json --capture --quiet \
+        -- python3 src/scripts/analyze-audio.py "$VIDEO_PATH" 75
+else
+    WORK_DIR="$(mktemp -d)"
+    trap 'rm -rf "$WORK_DIR"' EXIT
+    AUDIO_PATH="$WORK_DIR/audio.wav"
+    # 音量解析と文字起こしの両方がキャッシュにあれば音声の抽出も省略
+    if ! $STAGE_CACHE check analysis --input "$VIDEO_PATH" "${ANALYSIS_PARAMS[@]}" \
+        || ! $STAGE_CACHE check transcript --input "$VIDEO_PATH" "${TRANSCRIPT_PARAMS[@]}"; then
+        $STAGE_CACHE run audio --input "$VIDEO_PATH" --param sample_rate=16000 --output "$AUDIO_PATH" --quiet \
+            -- python3 src/scripts/audio_source.py "$VIDEO_PATH" "$AUDIO_PATH"
+    fi
+    $STAGE_CACHE run analysis --input "$VIDEO_PATH" "${ANALYSIS_PARAMS[@]}" --output audio-analysis.json --capture --quiet \
+        -- python3 src/scripts/analyze-audio.py "$VIDEO_PATH" 75 --audio "$AUDIO_PATH"
+fi
 echo "✓ 音声解析完了"
 
 # 字幕処理
 if [ -n "$SRT_FILE" ] && [ -f "$SRT_FILE" ]; then
     echo "[2/4] 既存字幕を使用: $SRT_FILE"
-    python3 merge-data.py "$SRT_FILE" audio-analysis.json > video-telop-data.json
+    $STAGE_CACHE run merge --input "$SRT_FILE" --input audio-analysis.json --output video-telop-data.json --capture --quiet \
+        -- python3 merge-data.py "$SRT_FILE" audio-analysis.json
 else
     echo "[2/4] 字幕を自動生成中..."
     if [ -z "$OPENAI_API_KEY" ]; then
@@ -47,8 +91,10 @@ else
         echo "export OPENAI_API_KEY='your-key' を実行してください"
         exit 1
     fi
-    python3 src/scripts/generate-subtitles.py "$VIDEO_PATH" --api-key "$OPENAI_API_KEY" --output subtitles.json 2>&1 | grep -v "^Extracting\|^Transcribing\|^Creating\|^Generated\|^Subtitles\|^SRT"
-    python3 merge-data.py subtitles.srt audio-analysis.json > video-telop-data.json
+    $STAGE_CACHE run transcript --input "$VIDEO_PATH" "${TRANSCRIPT_PARAMS[@]}" --output subtitles.json --output subtitles.srt \
+        -- python3 src/scripts/generate-subtitles.py "$VIDEO_PATH" --api-key "$OPENAI_API_KEY" --audio "$AUDIO_PATH" --output subtitles.json
+    $STAGE_CACHE run merge --input subtitles.srt --input audio-analysis.json --output video-telop-data.json --capture --quiet \
+        -- python3 merge-data.py subtitles.srt audio-analysis.json
 fi
 echo "✓ 字幕処理完了"
 
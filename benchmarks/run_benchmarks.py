@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Pythonパイプラインのベンチマーク
+ffmpegのlavfiソースで合成した動画（1分・10分・2時間）と合成SRT（100〜20000件）を
+ローカルに生成し、各ステージの実行時間とピークメモリ（RSS）を計測します。
+結果はJSONで保存し、ベースラインと比較して劣化を検出できます。
+--verify-shards では同じ合成動画を時間分割と単一プロセスで解析し、結果が一致するかを確認します。
+--verify-rolling では astats エンジンのローリング閾値が指定した秒数の窓を使っているかを確認します。
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import importlib.util
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCRIPTS_DIR = REPO_ROOT / 'src' / 'scripts'
+DEFAULT_DATA_DIR = Path(__file__).resolve().parent / '.data'
+
+# 合成メディアの長さ（秒）
+MEDIA_DURATIONS = {'1m': 60, '10m': 600, '2h': 7200}
+# 合成SRTの件数
+SRT_SIZES = (100, 1000, 5000, 20000)
+
+QUICK_MEDIA = ('1m',)
+QUICK_SRT_SIZES = (100, 1000)
+
+# 合成字幕に使う語彙（句読点・助詞を含めて分割処理が働くようにする）
+VOCABULARY = [
+    '今日は', 'とても', '良い', '天気', 'ですね', '、', 'みなさん', 'こんにちは', '。',
+    '動画', 'を', '見て', 'くれて', 'ありがとう', 'ございます', 'が', 'に', 'で', 'と',
+    'やばい', '！', '本当に', 'すごい', 'ことに', 'なりました', '？', 'それでは', '始めます'
+]
+
+
+def generate_media(data_dir: Path, name: str, duration: int) -> Path:
+    """
+    lavfiソースで合成動画を生成（既にあれば再利用）
+
+    ピンクノイズの上に10秒ごと2秒間のサイン波バーストを重ねるので、
+    大音量区間が周期的に現れる。
+    """
+    path = data_dir / f'media-{name}.mp4'
+    if path.exists():
+        return path
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp.mp4')
+
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'color=c=black:s=320x180:r=10:d={duration}',
+        '-f', 'lavfi', '-i', f'anoisesrc=d={duration}:c=pink:a=0.05:r=48000',
+        '-f', 'lavfi', '-i', f'sine=f=440:d={duration}:r=48000',
+        '-filter_complex',
+        "[2:a]volume='if(lt(mod(t,10),2),0.8,0)':eval=frame[burst];"
+        "[1:a][burst]amix=inputs=2:normalize=0[a]",
+        '-map', '0:v', '-map', '[a]',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'stillimage',
+        '-c:a', 'aac', '-b:a', '96k',
+        '-shortest',
+        str(tmp_path)
+    ]
+
+    print(f"Generating synthetic media: {path.name} ({duration}s)", file=sys.stderr)
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg error: {result.stderr}")
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def format_timestamp_srt(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+
+def generate_srt(data_dir: Path, count: int, seed: int = 0) -> Path:
+    """
+    決定的な乱数で合成SRTを生成（既にあれば再利用）
+    """
+    path = data_dir / f'subtitles-{count}.srt'
+    if path.exists():
+        return path
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed + count)
+    current = 0.0
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(1, count + 1):
+            text = ''.join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 14)))
+            duration = rng.uniform(0.8, 4.0)
+            f.write(f"{i}\n")
+            f.write(f"{format_timestamp_srt(current)} --> {format_timestamp_srt(current + duration)}\n")
+            f.write(f"{text}\n\n")
+            current += duration + rng.uniform(0.0, 0.5)
+
+    return path
+
+
+def run_measured(cmd: list) -> dict:
+    """
+    子プロセスを実行し、経過時間とピークRSSを計測
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=REPO_ROOT)
+    stderr = proc.stderr.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    if proc.returncode != 0:
+        raise Exception(f"Command failed: {' '.join(cmd)}\n{stderr.decode('utf-8', errors='replace')}")
+
+    # Linux の ru_maxrss はKB単位
+    return {'wall_s': elapsed, 'peak_rss_mb': usage.ru_maxrss / 1024}
+
+
+def load_script(name: str):
+    """
+    ハイフンを含むスクリプトをモジュールとして読み込む
+    """
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), SCRIPTS_DIR / f'{name}.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def stage_split(srt_path: str) -> None:
+    """
+    generate-subtitles.py の字幕分割（create_subtitle_entries）を実行（子プロセス用）
+    """
+    sys.path.insert(0, str(REPO_ROOT))
+    generate = load_script('generate-subtitles')
+    merge_spec = importlib.util.spec_from_file_location('merge_data', REPO_ROOT / 'merge-data.py')
+    merge_data = importlib.util.module_from_spec(merge_spec)
+    merge_spec.loader.exec_module(merge_data)
+
+    subtitles = merge_data.parse_srt(srt_path)
+    transcript = {'segments': [
+        {'start': sub['startTime'], 'end': sub['endTime'], 'text': sub['text']}
+        for sub in subtitles
+    ]}
+    entries = generate.create_subtitle_entries(transcript)
+    print(len(entries), file=sys.stderr)
+
+
+def verify_shards(data_dir: Path, media_names, workers: int) -> bool:
+    """
+    合成動画（AAC）を時間分割と単一プロセスで解析し、結果が一致するかを確認
+
+    分割解析は ffmpeg の入力シーク（-ss）と SHARD_PRE_ROLL_SECONDS の読み捨てに依存するので、
+    AACのエンコーダー遅延（priming）でサンプル位置がずれていないかをここで確かめる。
+    サンプル数が同じで、RMS の差が analyze-audio.py の SHARD_TOLERANCE_DB 以下、
+    75パーセンタイルでの大音量判定がすべて同じなら一致とする（ビット単位で同じかも表示する）。
+    """
+    import numpy as np
+
+    analyze = load_script('analyze-audio')
+    ok = True
+    for name in media_names:
+        media = str(generate_media(data_dir, name, MEDIA_DURATIONS[name]))
+        _, single, _ = analyze.analyze_audio_rms_pcm(media)
+        _, sharded, _ = analyze.analyze_audio_rms_sharded(media, workers=workers)
+
+        if len(single) != len(sharded):
+            print(f"{name}: MISMATCH {len(sharded)} samples with {workers} workers, {len(single)} in one process",
+                  file=sys.stderr)
+            ok = False
+            continue
+
+        max_diff = float(np.max(np.abs(single - sharded))) if len(single) else 0.0
+        threshold = np.percentile(single, 75)
+        flipped = int(np.count_nonzero((single >= threshold) != (sharded >= threshold)))
+        matched = max_diff <= analyze.SHARD_TOLERANCE_DB and flipped == 0
+        exact = 'identical' if np.array_equal(single, sharded) else 'not bit-identical'
+        ok = ok and matched
+        print(f"{name}: {'OK' if matched else 'MISMATCH'} {len(single)} samples, "
+              f"max diff {max_diff:.6f}dB, {flipped} loud decisions differ ({workers} workers, {exact})", file=sys.stderr)
+
+    return ok
+
+
+def verify_rolling_window(data_dir: Path, media_names, window: float = 30.0) -> bool:
+    """
+    astats エンジンのローリング閾値の窓が window 秒を覆っているかを確認
+
+    astats のサンプルはオーディオフレーム（約21ms）ごとなので、窓のサンプル数は
+    interval ではなくサンプル間隔の中央値から決まる。その窓で計算し直した閾値と
+    大音量判定がすべて同じなら一致とする。
+    """
+    import numpy as np
+    from loudness_threshold import rolling_thresholds
+
+    analyze = load_script('analyze-audio')
+    ok = True
+    for name in media_names:
+        media = str(generate_media(data_dir, name, MEDIA_DURATIONS[name]))
+        result = analyze.analyze_audio(media, 75, engine='astats', use_cache=False,
+                                       threshold_mode='rolling', window=window)
+        rms_linear = result['rms_linear']
+        step = float(np.median(np.diff(result['timestamps'])))
+        window_samples = max(1, int(round(window / step)))
+        expected = np.maximum(rolling_thresholds(rms_linear, window_samples, 75), np.finfo(np.float64).tiny)
+
+        covered = window_samples * step
+        matched = abs(covered - window) <= step and np.array_equal(result['is_loud'], rms_linear >= expected)
+        ok = ok and matched
+        print(f"{name}: {'OK' if matched else 'MISMATCH'} astats step {step * 1000:.1f}ms, "
+              f"window {window_samples} samples = {covered:.2f}s", file=sys.stderr)
+
+    return ok
+
+
+def build_cases(data_dir: Path, media_names, srt_sizes, workers: int) -> list:
+    """
+    計測ケースを組み立てる（入力の生成を含む）
+    """
+    python = sys.executable
+    cases = []
+    has_ffmpeg = shutil.which('ffmpeg') is not None
+
+    if not has_ffmpeg:
+        print("Warning: ffmpeg not found, skipping audio analysis benchmarks", file=sys.stderr)
+
+    analyses = {}
+    for name in media_names if has_ffmpeg else ():
+        media = generate_media(data_dir, name, MEDIA_DURATIONS[name])
+        analysis = data_dir / f'analysis-{name}.json'
+        analyses[name] = analysis
+
+        base = [python, str(SCRIPTS_DIR / 'analyze-audio.py'), str(media), '75', '--no-cache']
+
+        # マージの入力になる解析データを用意
+        if not analysis.exists():
+            run_measured(base + ['--output', str(analysis)])
+
+        cases.append({'name': 'analyze-audio', 'params': {'media': name, 'engine': 'pcm'},
+                      'cmd': base})
+        cases.append({'name': 'analyze-audio', 'params': {'media': name, 'engine': 'pcm', 'format': 'columnar'},
+                      'cmd': base + ['--format', 'columnar']})
+        if workers > 1:
+            cases.append({'name': 'analyze-audio', 'params': {'media': name, 'engine': 'pcm', 'workers': workers},
+                          'cmd': base + ['--workers', str(workers)]})
+        cases.append({'name': 'analyze-audio', 'params': {'media': name, 'engine': 'astats'},
+                      'cmd': base + ['--engine', 'astats']})
+
+    for count in srt_sizes:
+        srt = generate_srt(data_dir, count)
+
+        # 字幕件数に最も近い長さの解析データとマージ
+        if analyses:
+            media_name = max(analyses, key=lambda n: min(MEDIA_DURATIONS[n], count * 3))
+            cases.append({'name': 'merge-data', 'params': {'subtitles': count, 'media': media_name},
+                          'cmd': [python, str(REPO_ROOT / 'merge-data.py'), str(srt), str(analyses[media_name])]})
+
+        cases.append({'name': 'generate-subtitles-split', 'params': {'subtitles': count},
+                      'cmd': [python, str(Path(__file__).resolve()), '_stage', 'split', str(srt)]})
+
+        cases.append({'name': 'optimize-vertical', 'params': {'subtitles': count},
+                      'cmd': [python, str(REPO_ROOT / 'optimize_subtitles_for_vertical.py'), str(srt),
+                              str(data_dir / f'vertical-{count}.srt'), '10']})
+
+    return cases
+
+
+def run_benchmarks(args) -> dict:
+    data_dir = Path(args.data_dir)
+    media_names = QUICK_MEDIA if args.quick else tuple(MEDIA_DURATIONS)
+    srt_sizes = QUICK_SRT_SIZES if args.quick else SRT_SIZES
+
+    cases = build_cases(data_dir, media_names, srt_sizes, args.workers)
+    if args.filter:
+        cases = [case for case in cases if args.filter in case['name']]
+
+    results = []
+    for case in cases:
+        runs = [run_measured(case['cmd']) for _ in range(args.repeat)]
+
+        result = {
+            'name': case['name'],
+            'params': case['params'],
+            'repeat': args.repeat,
+            'wall_s': statistics.median(r['wall_s'] for r in runs),
+            'wall_s_min': min(r['wall_s'] for r in runs),
+            'peak_rss_mb': max(r['peak_rss_mb'] for r in runs)
+        }
+        results.append(result)
+        print(f"{case_label(result):<60} {result['wall_s']:9.3f}s {result['peak_rss_mb']:9.1f}MB", file=sys.stderr)
+
+    return {'meta': collect_meta(), 'results': results}
+
+
+def collect_meta() -> dict:
+    meta = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+    try:
+        import numpy
+        meta['numpy'] = numpy.__version__
+    except ImportError:
+        pass
+
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=REPO_ROOT)
+    if result.returncode == 0:
+        meta['git_commit'] = result.stdout.strip()
+
+    return meta
+
+
+def case_label(result: dict) -> str:
+    params = ','.join(f"{k}={v}" for k, v in sorted(result['params'].items()))
+    return f"{result['name']}[{params}]"
+
+
+def compare_results(current: dict, baseline: dict, tolerance: float, rss_tolerance: float) -> list:
+    """
+    ベースラインと比較して劣化したケースのリストを返す
+    """
+    baseline_by_label = {case_label(r): r for r in baseline['results']}
+    regressions = []
+
+    print(f"\n{'case':<60} {'baseline':>10} {'current':>10} {'change':>8}", file=sys.stderr)
+    for result in current['results']:
+        label = case_label(result)
+        base = baseline_by_label.get(label)
+        if base is None:
+            print(f"{label:<60} {'-':>10} {result['wall_s']:9.3f}s {'new':>8}", file=sys.stderr)
+            continue
+
+        change = result['wall_s'] / base['wall_s'] - 1 if base['wall_s'] > 0 else 0.0
+        rss_change = result['peak_rss_mb'] / base['peak_rss_mb'] - 1 if base['peak_rss_mb'] > 0 else 0.0
+
+        flags = []
+        if change > tolerance:
+            flags.append('time')
+        if rss_change > rss_tolerance:
+            flags.append('rss')
+
+        marker = f"  REGRESSION ({', '.join(flags)})" if flags else ''
+        print(f"{label:<60} {base['wall_s']:9.3f}s {result['wall_s']:9.3f}s {change * 100:+7.1f}%{marker}",
+              file=sys.stderr)
+
+        if flags:
+            regressions.append({'case': label, 'wall_change': change, 'rss_change': rss_change, 'flags': flags})
+
+    return regressions
+
+
+def main():
+    # 子プロセスとして個別ステージを実行する内部モード
+    if len(sys.argv) > 2 and sys.argv[1] == '_stage':
+        if sys.argv[2] == 'split':
+            stage_split(sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description='Pythonパイプラインのベンチマーク')
+    parser.add_argument('--output', '-o', default='benchmark-results.json', help='結果の出力先（デフォルト：benchmark-results.json）')
+    parser.add_argument('--compare', help='比較するベースライン結果JSON')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='許容する実行時間の増加率（デフォルト：0.15）')
+    parser.add_argument('--rss-tolerance', type=float, default=0.25, help='許容するピークRSSの増加率（デフォルト：0.25）')
+    parser.add_argument('--repeat', type=int, default=3, help='各ケースの繰り返し回数（デフォルト：3）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='分割解析ケースのワーカー数')
+    parser.add_argument('--quick', action='store_true', help='1分の動画と小さいSRTのみで計測')
+    parser.add_argument('--filter', help='名前にこの文字列を含むケースのみ実行')
+    parser.add_argument('--data-dir', default=str(DEFAULT_DATA_DIR), help='合成データの保存先')
+    parser.add_argument('--verify-shards', action='store_true',
+                        help='計測せずに、分割解析と単一プロセスの解析結果が一致するかを確認')
+    parser.add_argument('--verify-rolling', action='store_true',
+                        help='計測せずに、astats エンジンのローリング閾値の窓が30秒を覆っているかを確認')
+
+    args = parser.parse_args()
+
+    if args.verify_shards or args.verify_rolling:
+        if shutil.which('ffmpeg') is None:
+            print("Error: ffmpeg not found", file=sys.stderr)
+            sys.exit(1)
+        media_names = QUICK_MEDIA if args.quick else tuple(MEDIA_DURATIONS)
+        ok = True
+        if args.verify_shards:
+            ok = verify_shards(Path(args.data_dir), media_names, max(2, args.workers)) and ok
+        if args.verify_rolling:
+            ok = verify_rolling_window(Path(args.data_dir), media_names) and ok
+        sys.exit(0 if ok else 1)
+
+    results = run_benchmarks(args)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to: {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance, args.rss_tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) found", file=sys.stderr)
+            sys.exit(1)
+        print("\nNo regressions", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+テロップデータ（video-telop-data.json）の字幕を Remotion を使わずに動画へ焼き込むスクリプト
+
+TelopSystem の Normal / Loud スタイル（src/types/telop.ts の defaultTelopConfig）を Pillow で近似した
+スプライトとして描画します。同じテキスト・スタイルのテロップは1回だけ、プロセスプールで並列に描画し、
+caption_sprite のキャッシュに保存します。スプライトはアトラス画像にまとめて compose_video の sprite レイヤーとして
+重ね、各テロップは overlay の enable='gte(t,start)*lt(t,end)' で表示区間にだけ表示するので、
+ヘッドレスブラウザを使わずに動画を1回のエンコードで書き出せます。
+
+速報バナー（スライドイン・色のパルスのアニメーション）は含まれません。
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'src' / 'scripts'))
+
+import cache_store
+from compose_video import compose, DEFAULT_ENCODE, FONT_FILE
+
+# src/types/telop.ts の defaultTelopConfig の normalStyle / loudStyle
+TELOP_STYLES = {
+    'normal': {
+        'font_size': 128,
+        'text_color': '#000000',
+        'bg_color': '#FFFF00',
+        'bg_opacity': 0.5,
+        'outline_color': '#FFFFFF',
+        'outline_width': 2,
+        'bottom_margin': 30,
+        'horizontal_padding': 20,
+        'vertical_padding': 10
+    },
+    'loud': {
+        'font_size': 160,
+        'text_color': '#FF0000',
+        'bg_color': '#FFFF00',
+        'bg_opacity': 0.5,
+        'outline_color': '#FFFFFF',
+        'outline_width': 2,
+        'bottom_margin': 30,
+        'horizontal_padding': 20,
+        'vertical_padding': 10
+    }
+}
+LOUD_VOLUME_PERCENTILE = 75  # defaultTelopConfig.loudVolumePercentile
+BORDER_RADIUS = 8
+LINE_HEIGHT = 1.3
+
+ATLAS_SIZE = 4096  # アトラスの1ページの最大の幅・高さ
+
+
+def telop_style(subtitle, percentile=LOUD_VOLUME_PERCENTILE):
+    """
+    字幕のスタイル（TelopSystem の getSubtitleStyle と同じ判定）
+    """
+    extra = subtitle.extra or {}
+    if extra.get('style') in ('normal', 'loud'):
+        return extra['style']
+    if extra.get('volumeLevel') is not None:
+        return 'loud' if extra['volumeLevel'] >= percentile / 100 else 'normal'
+    return 'normal'
+
+
+def sprite_options(style_name, font_path=FONT_FILE):
+    """
+    スタイルの caption_sprite の描画オプション
+    """
+    style = TELOP_STYLES[style_name]
+    # 背景の透明度は NormalSubtitle と同じく #rrggbbaa にする（0 なら背景なし）
+    alpha = round(style['bg_opacity'] * 255)
+    return {
+        'font_size': style['font_size'],
+        'text_color': style['text_color'],
+        'bg_color': f"{style['bg_color']}{alpha:02x}" if alpha > 0 else None,
+        'stroke_width': style['outline_width'],
+        'stroke_color': style['outline_color'],
+        'padding': (style['horizontal_padding'], style['vertical_padding']),
+        'corner_radius': BORDER_RADIUS,
+        'font_path': font_path,
+        'line_height': LINE_HEIGHT
+    }
+
+
+def _render_sprite(text, options):
+    """プロセスプールで1つのスプライトを描画（キャッシュのパスを返す）"""
+    from caption_sprite import sprite_path
+    return str(sprite_path(text, **options))
+
+
+def render_sprites(keys, font_path=FONT_FILE, workers=1):
+    """
+    (テキスト, スタイル) ごとにスプライトを描画し、{(テキスト, スタイル): PNGのパス} を返す
+
+    キャッシュにあるスプライトは描画しない。workers が2以上ならプロセスプールで並列に描画する。
+    描画し終えたら、このバッチのスプライトを残して全キャッシュの上限を超えた分を1回だけ削除する。
+    """
+    keys = list(keys)
+    texts = [text for text, _ in keys]
+    options = [sprite_options(style_name, font_path) for _, style_name in keys]
+
+    if workers > 1 and len(keys) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(keys))) as executor:
+            paths = list(executor.map(_render_sprite, texts, options, chunksize=8))
+    else:
+        paths = list(map(_render_sprite, texts, options))
+
+    cache_store.evict(keep=paths)
+    return dict(zip(keys, paths))
+
+
+def pack_atlas(sizes, max_size=ATLAS_SIZE):
+    """
+    スプライトの大きさ {key: (w, h)} を棚詰め（高い順に左から並べ、幅を超えたら次の段）でアトラスのページに配置
+
+    Returns:
+        [(ページの幅, ページの高さ, {key: (x, y)}), ...]
+    """
+    pages = []
+    positions = None
+    x = y = shelf_height = width = 0
+
+    for key in sorted(sizes, key=lambda k: (-sizes[k][1], -sizes[k][0])):
+        w, h = sizes[key]
+        if positions is not None and x > 0 and x + w > max_size:
+            # 次の段
+            x, y, shelf_height = 0, y + shelf_height, 0
+        if positions is None or (positions and y + h > max_size):
+            # 次のページ
+            if positions:
+                pages.append((width, y + shelf_height, positions))
+            positions = {}
+            x = y = shelf_height = width = 0
+
+        positions[key] = (x, y)
+        x += w
+        width = max(width, x)
+        shelf_height = max(shelf_height, h)
+
+    if positions:
+        pages.append((width, y + shelf_height, positions))
+    return pages
+
+
+def _build_atlas_page(page_path, width, height, placements):
+    """プロセスプールで1ページのアトラスを作成（placements は [(スプライトのパス, x, y), ...]）"""
+    from PIL import Image
+
+    page = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    for sprite, x, y in placements:
+        with Image.open(sprite) as img:
+            page.paste(img, (x, y))
+    page.save(page_path, 'PNG', compress_level=1)
+    return page_path
+
+
+def build_atlas(sprite_paths, work_dir, workers=1):
+    """
+    スプライトをアトラスのPNGにまとめ、({key: (ページのパス, x, y, w, h)}, ページ数) を返す
+
+    workers が2以上ならページごとにプロセスプールで並列に作成する。
+    """
+    from PIL import Image
+
+    sizes = {}
+    for key, path in sprite_paths.items():
+        with Image.open(path) as img:  # ヘッダーだけを読む
+            sizes[key] = img.size
+    pages = pack_atlas(sizes)
+
+    atlas = {}
+    jobs = []
+    for page_index, (width, height, positions) in enumerate(pages):
+        page_path = str(Path(work_dir) / f"atlas-{page_index:03d}.png")
+        for key, (x, y) in positions.items():
+            atlas[key] = (page_path, x, y) + sizes[key]
+        jobs.append((page_path, width, height, [(sprite_paths[key], x, y) for key, (x, y) in positions.items()]))
+
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            list(executor.map(_build_atlas_page, *zip(*jobs)))
+    else:
+        for job in jobs:
+            _build_atlas_page(*job)
+
+    return atlas, len(pages)
+
+
+def build_telop_layers(subtitles, percentile=LOUD_VOLUME_PERCENTILE, font_path=FONT_FILE,
+                       workers=1, work_dir=None):
+    """
+    字幕から compose_video の sprite レイヤーのリストを作成（同じテロップは表示区間をまとめて1レイヤー）
+    """
+    intervals = {}
+    for sub in subtitles:
+        if not sub.text.strip() or sub.end <= sub.start:
+            continue
+        key = (sub.text, telop_style(sub, percentile))
+        intervals.setdefault(key, []).append([sub.start, sub.end])
+
+    started = time.time()
+    sprite_paths = render_sprites(intervals, font_path, workers)
+    atlas, page_count = build_atlas(sprite_paths, work_dir, workers)
+    print(f"Rendered {len(sprite_paths)} telop sprites into {page_count} atlas pages "
+          f"in {time.time() - started:.2f}s")
+
+    layers = []
+    for key, spans in sorted(intervals.items(), key=lambda item: item[1][0][0]):
+        page_path, x, y, w, h = atlas[key]
+        layers.append({
+            'type': 'sprite',
+            'file': page_path,
+            'crop': [x, y, w, h],
+            'x': '(W-w)/2',
+            'y': f"H-h-{TELOP_STYLES[key[1]]['bottom_margin']}",
+            'intervals': spans
+        })
+    return layers
+
+
+def burn_telops(input_video, telop_data, output_video, percentile=LOUD_VOLUME_PERCENTILE,
+                font_path=FONT_FILE, workers=None, encode=None, dry_run=False, smart=False):
+    """
+    テロップデータの字幕を動画に焼き込む
+
+    Args:
+        input_video: 入力動画パス
+        telop_data: テロップデータ（video-telop-data.json）または SRT / WebVTT の字幕ファイル
+        output_video: 出力動画パス
+        percentile: style のない字幕を volumeLevel で Loud にする閾値（パーセンタイル）
+        font_path: フォントファイル
+        workers: スプライトを描画するプロセス数（デフォルト：CPU数）
+        encode: エンコード設定（codec / preset / crf / threads）
+        dry_run: True なら実行せずにコマンドを表示
+        smart: True ならテロップが表示されるGOPだけを再エンコード
+    """
+    import subtitle_io
+
+    subtitles = list(subtitle_io.read_subtitles(telop_data))
+    print(f"Burning {len(subtitles)} telops from: {telop_data}")
+
+    with tempfile.TemporaryDirectory(prefix='telop-atlas-') as work_dir:
+        layers = build_telop_layers(subtitles, percentile, font_path, workers or os.cpu_count() or 1, work_dir)
+        return compose(input_video, output_video, layers, encode, dry_run, smart)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='テロップデータの字幕を Remotion を使わずに動画へ焼き込む')
+    parser.add_argument('input', help='入力動画ファイル')
+    parser.add_argument('output', help='出力動画ファイル')
+    parser.add_argument('--data', '-d', default='video-telop-data.json',
+                        help='テロップデータ（JSON）または字幕ファイル（デフォルト：video-telop-data.json）')
+    parser.add_argument('--percentile', type=float, default=LOUD_VOLUME_PERCENTILE,
+                        help=f'style のない字幕を volumeLevel で Loud にする閾値（デフォルト：{LOUD_VOLUME_PERCENTILE}）')
+    parser.add_argument('--font', default=FONT_FILE, help=f'フォントファイル（デフォルト：{FONT_FILE}）')
+    parser.add_argument('--workers', type=int, help='スプライトを描画するプロセス数（デフォルト：CPU数）')
+    parser.add_argument('--preset', default=DEFAULT_ENCODE['preset'], help=f"x264のプリセット（デフォルト：{DEFAULT_ENCODE['preset']}）")
+    parser.add_argument('--crf', type=int, default=DEFAULT_ENCODE['crf'], help=f"画質（デフォルト：{DEFAULT_ENCODE['crf']}）")
+    parser.add_argument('--threads', type=int, default=DEFAULT_ENCODE['threads'], help='エンコードのスレッド数（デフォルト：0＝自動）')
+    parser.add_argument('--smart', action='store_true', help='テロップが表示されるGOPだけを再エンコード')
+    parser.add_argument('--dry-run', action='store_true', help='実行せずに ffmpeg コマンドを表示')
+
+    args = parser.parse_args()
+
+    for path in (args.input, args.data):
+        if not os.path.exists(path):
+            parser.error(f"File not found: {path}")
+
+    burn_telops(
+        args.input,
+        args.data,
+        args.output,
+        args.percentile,
+        args.font,
+        args.workers,
+        {'preset': args.preset, 'crf': args.crf, 'threads': args.threads},
+        args.dry_run,
+        args.smart
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,617 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+見出し・字幕・オーバーレイを1回のエンコードで合成するスクリプト
+
+レイヤー（下から順に重ねる）を1つの filter_complex にまとめ、デコード・エンコードを1回だけ行います。
+add_header_caption.py・add_header_with_rounded_bg.py を続けて実行すると動画を何度もエンコードし直すため、
+処理時間と画質の劣化がその回数分かかりますが、このスクリプトではそれが1回で済みます。
+
+レイヤーの種類:
+    drawtext   ボックス付きの見出し（add_header_caption.py と同じ）
+    rounded    角丸背景付きの見出し画像（add_header_with_rounded_bg.py と同じ）
+    subtitles  SRT / ASS の字幕の焼き込み
+    overlay    画像・動画の重ね合わせ（start / end で表示区間を指定可能）
+    sprite     アトラス画像の一部（crop: [x, y, w, h]）の重ね合わせ。同じ画像のレイヤーは入力を共有する
+
+start / end の代わりに intervals: [[start, end], ...] で複数の表示区間を指定できます。
+
+レイヤーはJSONファイルでも指定できます:
+    {
+      "layers": [
+        {"type": "subtitles", "file": "subtitles.srt"},
+        {"type": "rounded", "text": "見出し", "x": 50, "y": 50},
+        {"type": "overlay", "file": "logo.png", "x": "W-w-40", "y": 40, "start": 2.0, "end": 8.0}
+      ],
+      "encode": {"preset": "medium", "crf": 20, "threads": 0}
+    }
+"""
+
+import os
+import sys
+import json
+import bisect
+import shlex
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'src' / 'scripts'))
+
+import cache_store
+
+FONT_FILE = '/home/lasuone/.fonts/NotoSansJP.ttf'
+
+# SRT字幕の焼き込みスタイル（ASSはファイル内のスタイルを使う）
+SUBTITLE_STYLE = (
+    "FontName=Noto Sans CJK JP,FontSize=24,"
+    "PrimaryColour=&HFFFFFF,OutlineColour=&H000000,"
+    "BackColour=&H00000000,BorderStyle=1,Outline=2,Shadow=0,"
+    "Alignment=2,MarginV=50"
+)
+
+LAYER_TYPES = ('drawtext', 'rounded', 'subtitles', 'overlay', 'sprite')
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+# これより長い filter_complex はファイルで渡す（コマンドライン引数1つの長さの上限は128KB）
+FILTER_SCRIPT_MIN_LENGTH = 32 * 1024
+
+# ffmpeg の libx264 の既定値（従来の各スクリプトの出力と同じ画質）
+DEFAULT_ENCODE = {'codec': 'libx264', 'preset': 'medium', 'crf': 23, 'threads': 0}
+
+# スマートレンダー（表示区間のGOPだけを再エンコード）
+SMART_ENCODERS = {'h264': 'libx264', 'hevc': 'libx265'}
+SMART_PROFILES = {
+    'Constrained Baseline': 'baseline', 'Baseline': 'baseline', 'Main': 'main', 'High': 'high',
+    'High 10': 'high10', 'High 4:2:2': 'high422', 'High 4:4:4 Predictive': 'high444',
+    'Main 10': 'main10'
+}
+SMART_MAX_COVERAGE = 0.5  # 再エンコードする範囲が動画の長さのこの割合を超える場合は全体をエンコード
+SMART_BOUNDARY_MARGIN = 0.001  # キーフレームの時刻の丸め誤差を吸収する余裕（1フレームより短いこと）
+
+
+def hex_to_ffmpeg_color(hex_color):
+    """#rrggbb -> 0xrrggbb（drawtextはRGB形式）"""
+    return f"0x{hex_color.lstrip('#')}"
+
+
+def quote_filter_value(value):
+    """
+    filter_complex のオプション値をシングルクォートで囲む
+
+    クォート内ではカンマ・コロンなどがそのまま使える（シングルクォート自体は含められない）。
+    数値はそのまま返す。
+    """
+    if isinstance(value, (int, float)):
+        return str(value)
+    value = str(value)
+    if "'" in value:
+        raise ValueError(f"Single quotes are not supported in filter values: {value}")
+    return f"'{value}'"
+
+
+def enable_expression(layer):
+    """
+    表示区間（start / end 秒、または intervals）の enable 式（指定がなければ None）
+
+    区間は TelopSystem と frame_compositor と同じく [start, end)（終了時刻のフレームには表示しない）。
+    between は両端を含むため、連続するテロップが境界のフレームで重なってしまう。
+    """
+    if layer.get('intervals'):
+        return '+'.join(f"gte(t,{float(start)})*lt(t,{float(end)})" for start, end in layer['intervals'])
+
+    start = layer.get('start')
+    end = layer.get('end')
+    if start is None and end is None:
+        return None
+    if end is None:
+        return f"gte(t,{float(start)})"
+    return f"gte(t,{float(start or 0.0)})*lt(t,{float(end)})"
+
+
+def drawtext_filter(layer, work_dir):
+    """
+    ボックス付き見出しの drawtext フィルター
+
+    テキストはファイル経由で渡すので、コロンやクォートを含む見出しでもエスケープが要らない。
+    """
+    text_path = Path(work_dir) / f"drawtext-{id(layer)}.txt"
+    text_path.write_text(layer['text'], encoding='utf-8')
+
+    # 太字効果: 黒い縁取りを追加して文字を太く見せる
+    options = [
+        f"textfile={quote_filter_value(text_path)}",
+        "expansion=none",
+        f"fontfile={quote_filter_value(layer.get('font', FONT_FILE))}",
+        f"fontsize={layer.get('font_size', 24)}",
+        f"fontcolor={hex_to_ffmpeg_color(layer.get('text_color', '#ffffff'))}",
+        "borderw=3",
+        "bordercolor=black",
+        "box=1",
+        f"boxcolor={hex_to_ffmpeg_color(layer.get('bg_color', '#ff0000'))}@1.0",
+        "boxborderw=15",
+        f"x={quote_filter_value(layer.get('x', 50))}",
+        f"y={quote_filter_value(layer.get('y', 50))}"
+    ]
+    enable = enable_expression(layer)
+    if enable:
+        options.append(f"enable={quote_filter_value(enable)}")
+    return "drawtext=" + ":".join(options)
+
+
+def subtitles_filter(layer):
+    """
+    SRT / ASS 字幕の焼き込みフィルター
+    """
+    path = layer['file']
+    if Path(path).suffix.lower() == '.ass':
+        return f"ass={quote_filter_value(path)}"
+    style = layer.get('style', SUBTITLE_STYLE)
+    return f"subtitles={quote_filter_value(path)}:force_style={quote_filter_value(style)}"
+
+
+def rounded_header_image(layer):
+    """
+    角丸背景付き見出しのPNGのパス（Pillow が必要）
+
+    caption_sprite のキャッシュにあればそれを使い、なければ描画して保存する。
+    """
+    from caption_sprite import sprite_path
+
+    return str(sprite_path(layer['text'], font_size=layer.get('font_size', 84),
+                           text_color=layer.get('text_color', '#ffffff'),
+                           bg_color=layer.get('bg_color', '#ff0000'),
+                           font_path=layer.get('font', FONT_FILE)))
+
+
+def build_filter_graph(layers, work_dir, time_offset=0.0):
+    """
+    レイヤーのリストから (追加の入力引数, filter_complex, 出力ラベル) を作成
+
+    入力0が元の動画。画像・動画のレイヤーは入力1以降として追加する。
+    time_offset は入力0の先頭の元の動画での時刻（区間だけをエンコードする場合）で、
+    レイヤーの時刻を元の動画の時刻のまま使えるようにタイムスタンプをずらす。
+    """
+    input_args = []
+    chains = []
+    current = '0:v'
+    if time_offset:
+        chains.append(f"[0:v]setpts=PTS+{time_offset}/TB[src]")
+        current = 'src'
+    next_input = 1
+    pending = []  # 続けて適用する単一入力のフィルター（drawtext / subtitles）
+
+    # 同じアトラス画像を使う sprite レイヤーは入力を1つにし、split で分ける
+    sprite_uses = {}
+    for layer in layers:
+        if layer.get('type') == 'sprite':
+            sprite_uses[layer['file']] = sprite_uses.get(layer['file'], 0) + 1
+    sprite_sources = {}  # 画像のパス -> まだ使っていないラベル
+
+    def sprite_source(path):
+        nonlocal next_input
+        if path not in sprite_sources:
+            input_args.extend(['-i', path])
+            count = sprite_uses[path]
+            if count == 1:
+                sprite_sources[path] = [f"{next_input}:v"]
+            else:
+                labels = [f"a{next_input}_{k}" for k in range(count)]
+                chains.append(f"[{next_input}:v]split={count}" + ''.join(f"[{label}]" for label in labels))
+                sprite_sources[path] = labels
+            next_input += 1
+        return sprite_sources[path].pop(0)
+
+    def flush():
+        nonlocal current
+        if pending:
+            label = f"v{len(chains)}"
+            chains.append(f"[{current}]{','.join(pending)}[{label}]")
+            pending.clear()
+            current = label
+
+    for layer in layers:
+        layer_type = layer.get('type')
+        if layer_type not in LAYER_TYPES:
+            raise ValueError(f"Unknown layer type: {layer_type} (choose from {', '.join(LAYER_TYPES)})")
+
+        if layer_type == 'drawtext':
+            pending.append(drawtext_filter(layer, work_dir))
+        elif layer_type == 'subtitles':
+            pending.append(subtitles_filter(layer))
+        else:
+            flush()
+            if layer_type == 'sprite':
+                x, y, w, h = layer['crop']
+                source = f"c{len(chains)}"
+                chains.append(f"[{sprite_source(layer['file'])}]crop={w}:{h}:{x}:{y}[{source}]")
+                is_image = True
+            else:
+                if layer_type == 'rounded':
+                    path = rounded_header_image(layer)
+                else:
+                    path = layer['file']
+                input_args += ['-i', path]
+
+                source = f"{next_input}:v"
+                is_image = Path(path).suffix.lower() in IMAGE_SUFFIXES
+                if not is_image and layer.get('start') is not None:
+                    # 動画のオーバーレイは表示開始時刻から再生する
+                    shifted = f"ov{next_input}"
+                    chains.append(f"[{source}]setpts=PTS-STARTPTS+{float(layer['start'])}/TB[{shifted}]")
+                    source = shifted
+                next_input += 1
+
+            # 画像は最後のフレームを表示し続け、動画は再生が終わったら消す
+            options = [f"x={quote_filter_value(layer.get('x', 50))}", f"y={quote_filter_value(layer.get('y', 50))}",
+                       f"eof_action={'repeat' if is_image else 'pass'}"]
+            enable = enable_expression(layer)
+            if enable:
+                options.append(f"enable={quote_filter_value(enable)}")
+            label = f"v{len(chains)}"
+            chains.append(f"[{current}][{source}]overlay={':'.join(options)}[{label}]")
+            current = label
+
+    flush()
+    if time_offset:
+        chains.append(f"[{current}]setpts=PTS-STARTPTS[out]")
+        current = 'out'
+    return input_args, ';'.join(chains), current
+
+
+def filter_complex_args(graph, work_dir):
+    """
+    -filter_complex の引数（長いグラフは work_dir のファイルに書いて -filter_complex_script で渡す）
+    """
+    if len(graph) < FILTER_SCRIPT_MIN_LENGTH:
+        return ['-filter_complex', graph]
+    fd, script_path = tempfile.mkstemp(prefix='filter-', suffix='.txt', dir=work_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(graph)
+    return ['-filter_complex_script', script_path]
+
+
+def build_command(input_video, output_video, layers, work_dir, encode=None):
+    """
+    合成用の ffmpeg コマンドを作成
+    """
+    encode = {**DEFAULT_ENCODE, **(encode or {})}
+    input_args, graph, output_label = build_filter_graph(layers, work_dir)
+
+    cmd = ['ffmpeg', '-i', input_video] + input_args
+    if graph:
+        cmd += filter_complex_args(graph, work_dir) + ['-map', f'[{output_label}]']
+    else:
+        cmd += ['-map', '0:v']
+    cmd += [
+        '-map', '0:a?',
+        '-c:v', encode['codec'],
+        '-preset', str(encode['preset']),
+        '-crf', str(encode['crf']),
+        '-threads', str(encode['threads']),
+        '-c:a', 'copy',
+        '-y',
+        output_video
+    ]
+    return cmd
+
+
+def probe_video(input_video):
+    """
+    ffprobe で映像のコーデック情報・長さ・全フレームとキーフレームの時刻を取得
+
+    パケットを読むだけでデコードしないので、長い動画でも数秒で終わる。
+    時刻はファイルの開始時刻（format=start_time）を引いた、レイヤーや -ss と同じ0始まりの値にする。
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,profile,pix_fmt,level:format=duration,start_time:packet=pts_time,flags',
+        '-of', 'json',
+        input_video
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"ffprobe error: {result.stderr}")
+
+    data = json.loads(result.stdout)
+    start_time = data['format'].get('start_time')
+    start_time = float(start_time) if start_time not in (None, 'N/A') else 0.0
+
+    frames = []
+    keyframes = []
+    for packet in data.get('packets', []):
+        if packet.get('pts_time') in (None, 'N/A'):
+            continue
+        pts = float(packet['pts_time']) - start_time
+        frames.append(pts)
+        if 'K' in packet.get('flags', ''):
+            keyframes.append(pts)
+
+    return {
+        **data['streams'][0],
+        'duration': float(data['format']['duration']),
+        'start_time': start_time,
+        'frames': sorted(frames),
+        'keyframes': sorted(keyframes)
+    }
+
+
+def layer_intervals(layer, duration):
+    """
+    レイヤーが表示される区間 [(start, end), ...]（動画全体に表示される場合や分からない場合は None）
+
+    SRT / WebVTT / JSON の字幕はキューの時刻から求める。
+    """
+    if layer.get('intervals'):
+        return [(float(start), float(end)) for start, end in layer['intervals']]
+    if layer['type'] == 'subtitles':
+        if Path(layer['file']).suffix.lower() == '.ass':
+            return None
+        import subtitle_io
+        return [(entry.start, entry.end) for entry in subtitle_io.read_subtitles(layer['file'])]
+
+    start = layer.get('start')
+    end = layer.get('end')
+    if start is None and end is None:
+        return None
+    return [(float(start or 0.0), float(end) if end is not None else duration)]
+
+
+def plan_segments(keyframes, duration, intervals):
+    """
+    動画をキーフレームで区切った [(start, end, 再エンコードするか), ...] に分割
+
+    レイヤーが表示される区間を含むGOP（キーフレームから次のキーフレームまで）だけを再エンコードする。
+    """
+    dirty = []
+    for start, end in sorted(intervals):
+        start, end = max(start, 0.0), min(end, duration)
+        if end < start:
+            continue
+        # 表示開始以前の最後のキーフレームから、表示終了より後の最初のキーフレームまで
+        i = bisect.bisect_right(keyframes, start) - 1
+        j = bisect.bisect_right(keyframes, end)
+        gop_start = keyframes[i] if i >= 0 else 0.0
+        gop_end = keyframes[j] if j < len(keyframes) else duration
+
+        if dirty and gop_start <= dirty[-1][1]:
+            dirty[-1][1] = max(dirty[-1][1], gop_end)
+        else:
+            dirty.append([gop_start, gop_end])
+
+    segments = []
+    position = 0.0
+    for start, end in dirty:
+        if start > position:
+            segments.append((position, start, False))
+        segments.append((start, end, True))
+        position = end
+    if position < duration:
+        segments.append((position, duration, False))
+    return segments
+
+
+def matching_encode_args(info, encode):
+    """
+    元の動画と同じコーデック・プロファイル・レベル・ピクセル形式で再エンコードする引数（対応外なら None）
+    """
+    encoder = SMART_ENCODERS.get(info.get('codec_name'))
+    if encoder is None:
+        return None
+
+    args = ['-c:v', encoder, '-preset', str(encode['preset']), '-crf', str(encode['crf']),
+            '-threads', str(encode['threads'])]
+    if info.get('pix_fmt'):
+        args += ['-pix_fmt', info['pix_fmt']]
+
+    profile = SMART_PROFILES.get(info.get('profile'))
+    if profile:
+        args += ['-profile:v', profile]
+
+    level = info.get('level')
+    if isinstance(level, int) and level > 0:
+        # H.264 は 40 = 4.0、HEVC は 120 = 4（30倍）
+        args += ['-level', f"{level / 10:.1f}" if encoder == 'libx264' else f"{level / 30:g}"]
+
+    return args
+
+
+def build_smart_commands(input_video, output_video, layers, work_dir, encode=None):
+    """
+    レイヤーが表示されるGOPだけを再エンコードし、それ以外をストリームコピーするコマンド列
+
+    1. 映像をキーフレームで区切ってストリームコピー（segment muxer、1回の読み込み）
+    2. レイヤーが表示される区間だけを元と同じコーデック設定で再エンコード
+    3. concat demuxer で順につなぎ、元の音声と一緒に書き出す
+
+    スマートレンダーできない場合（時刻のないレイヤー・対応外のコーデック・再エンコードの範囲が広い）は
+    (None, 理由) を返す。
+    """
+    encode = {**DEFAULT_ENCODE, **(encode or {})}
+    info = probe_video(input_video)
+    duration = info['duration']
+
+    intervals = []
+    for layer in layers:
+        layer_spans = layer_intervals(layer, duration)
+        if layer_spans is None:
+            return None, f"{layer['type']} layer is shown for the whole video"
+        intervals += layer_spans
+
+    encode_args = matching_encode_args(info, encode)
+    if encode_args is None:
+        return None, f"codec {info.get('codec_name')} is not supported"
+    if not info['keyframes']:
+        return None, "no keyframes found"
+
+    segments = plan_segments(info['keyframes'], duration, intervals)
+    dirty_seconds = sum(end - start for start, end, dirty in segments if dirty)
+    if dirty_seconds > duration * SMART_MAX_COVERAGE:
+        return None, f"captions cover {dirty_seconds:.1f}s of {duration:.1f}s"
+
+    work = Path(work_dir)
+    commands = []
+
+    # 1. キーフレームの位置でストリームコピーの断片に分ける
+    # （時刻の丸めで次のキーフレームにずれないよう、境界は少し手前を指定する）
+    boundaries = [start for start, _, _ in segments[1:]]
+    copy_cmd = ['ffmpeg', '-i', input_video, '-map', '0:v:0', '-c', 'copy', '-an',
+                '-f', 'segment', '-reset_timestamps', '1']
+    if boundaries:
+        copy_cmd += ['-segment_times', ','.join(f"{max(t - SMART_BOUNDARY_MARGIN, 0.0):.6f}" for t in boundaries)]
+    copy_cmd += ['-y', str(work / 'copy-%05d.ts')]
+    commands.append(copy_cmd)
+
+    # 2. レイヤーが表示されるGOPを再エンコード（フレーム数はパケット数から正確に求める）
+    pieces = []
+    frames = info['frames']
+    for index, (start, end, dirty) in enumerate(segments):
+        if not dirty:
+            pieces.append(work / f"copy-{index:05d}.ts")
+            continue
+
+        frame_count = bisect.bisect_left(frames, end - SMART_BOUNDARY_MARGIN) - \
+            bisect.bisect_left(frames, start - SMART_BOUNDARY_MARGIN)
+        input_args, graph, output_label = build_filter_graph(layers, work_dir, time_offset=start)
+        piece = work / f"encode-{index:05d}.ts"
+        commands.append(
+            ['ffmpeg', '-ss', f"{max(start - SMART_BOUNDARY_MARGIN, 0.0):.6f}", '-i', input_video] + input_args +
+            filter_complex_args(graph, work_dir) + ['-map', f'[{output_label}]', '-frames:v', str(frame_count),
+             '-fps_mode', 'passthrough', '-an'] + encode_args + ['-y', str(piece)]
+        )
+        pieces.append(piece)
+
+    # 3. 断片をつないで元の音声と一緒に書き出す
+    list_path = work / 'concat.txt'
+    list_path.write_text(''.join(f"file '{piece}'\n" for piece in pieces), encoding='utf-8')
+    commands.append([
+        'ffmpeg', '-f', 'concat', '-safe', '0', '-i', str(list_path), '-i', input_video,
+        '-map', '0:v', '-map', '1:a?', '-c', 'copy', '-y', output_video
+    ])
+
+    print(f"Smart render: re-encoding {dirty_seconds:.1f}s of {duration:.1f}s "
+          f"in {sum(1 for *_, dirty in segments if dirty)} ranges, stream-copying the rest")
+    return commands, None
+
+
+def compose(input_video, output_video, layers, encode=None, dry_run=False, smart=False):
+    """
+    レイヤーを合成して1回のエンコードで書き出す
+
+    Args:
+        input_video: 入力動画パス
+        output_video: 出力動画パス
+        layers: レイヤーの辞書のリスト（下から順に重ねる）
+        encode: エンコード設定（codec / preset / crf / threads）
+        dry_run: True なら実行せずにコマンドを表示
+        smart: True ならレイヤーが表示されるGOPだけを再エンコード（できない場合は全体をエンコード）
+    """
+    work_dir = tempfile.mkdtemp(prefix='compose-')
+    try:
+        layer_counts = {}
+        for layer in layers:
+            layer_counts[layer['type']] = layer_counts.get(layer['type'], 0) + 1
+        print(f"Composing {len(layers)} layers in one encode: "
+              f"{', '.join(t if n == 1 else f'{t} x{n}' for t, n in layer_counts.items()) or 'none'}")
+        print(f"Output: {output_video}")
+        print()
+
+        commands = None
+        if smart:
+            commands, reason = build_smart_commands(input_video, output_video, layers, work_dir, encode)
+            if commands is None:
+                print(f"Smart render not possible ({reason}), encoding the whole video")
+        if commands is None:
+            commands = [build_command(input_video, output_video, layers, work_dir, encode)]
+
+        if dry_run:
+            for cmd in commands:
+                print(shlex.join(cmd))
+            return commands
+
+        # 実行
+        for cmd in commands:
+            subprocess.run(cmd, check=True)
+        print("Done!")
+        return commands
+
+    finally:
+        # 一時ファイル（見出しのテキスト・スマートレンダーの断片）を削除
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+        # 見出しのスプライトを保存した場合は、全キャッシュの上限を超えた分を最後に1回だけ削除
+        if any(layer['type'] == 'rounded' for layer in layers):
+            cache_store.evict()
+
+
+def parse_overlay(value):
+    """--overlay FILE[:X:Y[:START:END]]"""
+    parts = value.split(':')
+    layer = {'type': 'overlay', 'file': parts[0]}
+    if len(parts) >= 3:
+        layer['x'], layer['y'] = parts[1], parts[2]
+    if len(parts) >= 5:
+        layer['start'], layer['end'] = float(parts[3]), float(parts[4])
+    return layer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='見出し・字幕・オーバーレイを1回のエンコードで合成')
+    parser.add_argument('input', help='入力動画ファイル')
+    parser.add_argument('output', help='出力動画ファイル')
+    parser.add_argument('--layers', '-l', help='レイヤーとエンコード設定のJSONファイル')
+    parser.add_argument('--subtitles', '-s', help='字幕ファイル（SRT / ASS）')
+    parser.add_argument('--caption', '-c', help='ボックス付きの見出しテキスト')
+    parser.add_argument('--rounded-caption', help='角丸背景付きの見出しテキスト')
+    parser.add_argument('--overlay', action='append', default=[],
+                        help='重ねる画像・動画 FILE[:X:Y[:START:END]]（複数指定可）')
+    parser.add_argument('--bg-color', default='#ff0000', help='見出しの背景色（デフォルト：#ff0000）')
+    parser.add_argument('--text-color', default='#ffffff', help='見出しの文字色（デフォルト：#ffffff）')
+    parser.add_argument('--font-size', type=int, help='見出しのフォントサイズ（デフォルト：ボックス24、角丸84）')
+    parser.add_argument('--x', type=int, default=50, help='見出しのX座標（デフォルト：50）')
+    parser.add_argument('--y', type=int, default=50, help='見出しのY座標（デフォルト：50）')
+    parser.add_argument('--preset', help=f"x264のプリセット（デフォルト：{DEFAULT_ENCODE['preset']}）")
+    parser.add_argument('--crf', type=int, help=f"画質（小さいほど高画質、デフォルト：{DEFAULT_ENCODE['crf']}）")
+    parser.add_argument('--threads', type=int, help='エンコードのスレッド数（デフォルト：0＝自動）')
+    parser.add_argument('--smart', action='store_true',
+                        help='見出し・字幕が表示されるGOPだけを再エンコードし、それ以外はストリームコピー')
+    parser.add_argument('--dry-run', action='store_true', help='実行せずに ffmpeg コマンドを表示')
+
+    args = parser.parse_args()
+
+    layers = []
+    encode = {}
+    if args.layers:
+        with open(args.layers, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+        layers += spec.get('layers', [])
+        encode.update(spec.get('encode', {}))
+
+    # コマンドラインのレイヤーは 字幕 → 見出し → オーバーレイ の順に重ねる
+    if args.subtitles:
+        layers.append({'type': 'subtitles', 'file': args.subtitles})
+    for layer_type, text in (('drawtext', args.caption), ('rounded', args.rounded_caption)):
+        if text:
+            layer = {'type': layer_type, 'text': text, 'bg_color': args.bg_color,
+                     'text_color': args.text_color, 'x': args.x, 'y': args.y}
+            if args.font_size:
+                layer['font_size'] = args.font_size
+            layers.append(layer)
+    layers += [parse_overlay(value) for value in args.overlay]
+
+    for key in ('preset', 'crf', 'threads'):
+        if getattr(args, key) is not None:
+            encode[key] = getattr(args, key)
+
+    if not os.path.exists(args.input):
+        parser.error(f"File not found: {args.input}")
+
+    compose(args.input, args.output, layers, encode, args.dry_run, args.smart)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+テロップをフレームごとに NumPy で合成するスクリプト（アニメーションするテロップ用）
+
+burn_telops.py の overlay フィルターでは表示・非表示しか切り替えられないため、フレームごとに大きさが変わる
+テロップ（大音量テロップの拡大表示など）は、ffmpeg でデコードした rawvideo をパイプで受け取って合成します。
+
+    デコード（ffmpeg → パイプ）→ 合成（NumPy）→ エンコード（パイプ → ffmpeg）
+
+- フレームは事前に確保したバッファにパイプから直接読み込み（readinto）、合成もそのバッファの上で行い、
+  そのままエンコーダーに書き出します。フレーム全体のコピーは作りません。
+- アルファ合成はスプライトの範囲（バウンディングボックス）だけを整数演算で行います。
+- デコードとエンコードは別スレッドで動き、合成（メインスレッド）と重なって進みます
+  （パイプの読み書きと NumPy の演算は GIL を解放する）。
+- 処理速度（fps）を定期的に表示します。
+
+テロップのスプライトは burn_telops.py と同じもの（caption_sprite のキャッシュ）を使います。
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import queue
+import shlex
+import argparse
+import threading
+import subprocess
+from fractions import Fraction
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'src' / 'scripts'))
+
+from compose_video import DEFAULT_ENCODE, FONT_FILE
+from burn_telops import LOUD_VOLUME_PERCENTILE, TELOP_STYLES, telop_style, render_sprites
+
+QUEUE_FRAMES = 6  # デコード・合成・エンコードの間で使い回すフレームバッファの数
+POP_FRAMES = 6  # 大音量テロップの拡大アニメーションのフレーム数
+POP_SCALE = 1.25  # 表示開始時の倍率（POP_FRAMES かけて 1.0 に戻る）
+REPORT_INTERVAL = 2.0  # 処理速度を表示する間隔（秒）
+
+
+class Sprite:
+    """
+    合成用のスプライト
+
+    乗算済みの RGB（rgb * alpha）と 255 - alpha を uint16 で持ち、フレームごとの合成で変換しない。
+    """
+
+    __slots__ = ('premultiplied', 'inverse_alpha', 'width', 'height')
+
+    def __init__(self, rgba: np.ndarray):
+        rgba = rgba.astype(np.uint16)
+        alpha = rgba[..., 3:4]
+        self.premultiplied = rgba[..., :3] * alpha
+        self.inverse_alpha = 255 - alpha
+        self.height, self.width = rgba.shape[:2]
+
+    @classmethod
+    def from_image(cls, img, scale: float = 1.0) -> 'Sprite':
+        """
+        Pillow の画像から作成（scale 倍に拡大・縮小）
+        """
+        from PIL import Image
+
+        if scale != 1.0:
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                             Image.LANCZOS)
+        return cls(np.asarray(img.convert('RGBA')))
+
+
+class Telop:
+    """
+    表示区間（フレーム番号、end_frame は含まない）とスプライト
+
+    sprites はアニメーションのフレームごとのスプライトで、最後のスプライトをその後も表示し続ける。
+    """
+
+    __slots__ = ('start_frame', 'end_frame', 'sprites', 'bottom_margin')
+
+    def __init__(self, start_frame: int, end_frame: int, sprites, bottom_margin: int):
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.sprites = sprites
+        self.bottom_margin = bottom_margin
+
+    def sprite_at(self, frame_index: int) -> Sprite:
+        return self.sprites[min(frame_index - self.start_frame, len(self.sprites) - 1)]
+
+
+class TelopSchedule:
+    """
+    フレーム番号順に表示中のテロップを返す（開始順に並べたリストを1回だけ走査する）
+    """
+
+    def __init__(self, telops):
+        self.pending = sorted(telops, key=lambda telop: telop.start_frame)
+        self.next = 0
+        self.active = []
+
+    def at(self, frame_index: int):
+        while self.next < len(self.pending) and self.pending[self.next].start_frame <= frame_index:
+            self.active.append(self.pending[self.next])
+            self.next += 1
+        if any(telop.end_frame <= frame_index for telop in self.active):
+            self.active = [telop for telop in self.active if telop.end_frame > frame_index]
+        return self.active
+
+
+def blend(frame: np.ndarray, sprite: Sprite, x: int, y: int, scratch: np.ndarray, carry: np.ndarray):
+    """
+    frame の (x, y) にスプライトをアルファ合成（画面外にはみ出す部分は切り取る）
+
+    スプライトの範囲だけを frame の上で直接書き換える。scratch / carry はフレームと同じ大きさの
+    uint16 の作業用バッファで、その一部だけを使う（合成のたびに配列を確保しない）。
+    """
+    height, width = frame.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sprite.width, width), min(y + sprite.height, height)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    region = frame[y0:y1, x0:x1]
+    rows = slice(y0 - y, y1 - y)
+    cols = slice(x0 - x, x1 - x)
+    out = scratch[:y1 - y0, :x1 - x0]
+    tmp = carry[:y1 - y0, :x1 - x0]
+
+    # out = round((frame * (255 - alpha) + rgb * alpha) / 255)
+    # （255 での割り算は t = x + 128; (t + (t >> 8)) >> 8 で、0〜255*255 の範囲で正確）
+    np.multiply(region, sprite.inverse_alpha[rows, cols], out=out)
+    out += sprite.premultiplied[rows, cols]
+    out += 128
+    np.right_shift(out, 8, out=tmp)
+    out += tmp
+    np.right_shift(out, 8, out=out)
+    np.copyto(region, out, casting='unsafe')
+
+
+def pop_scale(frame_offset: int) -> float:
+    """拡大アニメーションの倍率（POP_SCALE から 1.0 へイーズアウト）"""
+    progress = frame_offset / POP_FRAMES
+    return 1.0 + (POP_SCALE - 1.0) * (1.0 - progress) ** 2
+
+
+def build_telops(subtitles, fps, percentile=LOUD_VOLUME_PERCENTILE, font_path=FONT_FILE,
+                 workers=1, animate_loud=True):
+    """
+    字幕から Telop のリストを作成
+
+    同じテキスト・スタイルのスプライトは1回だけ描画・変換する。animate_loud なら大音量テロップは
+    表示開始から POP_FRAMES フレームかけて POP_SCALE 倍から元の大きさに縮む。
+    """
+    from PIL import Image
+
+    subtitles = [sub for sub in subtitles if sub.text.strip() and sub.end > sub.start]
+    keys = {(sub.text, telop_style(sub, percentile)): None for sub in subtitles}
+    sprite_paths = render_sprites(keys, font_path, workers)
+
+    frames = {}
+    for key, path in sprite_paths.items():
+        with Image.open(path) as img:
+            img.load()
+            if animate_loud and key[1] == 'loud':
+                frames[key] = [Sprite.from_image(img, pop_scale(k)) for k in range(POP_FRAMES)] + \
+                    [Sprite.from_image(img)]
+            else:
+                frames[key] = [Sprite.from_image(img)]
+
+    # TelopSystem と同じく frame / fps が [start, end) の範囲のフレームに表示する
+    telops = []
+    for sub in subtitles:
+        key = (sub.text, telop_style(sub, percentile))
+        start_frame = math.ceil(sub.start * fps - 1e-9)
+        end_frame = math.ceil(sub.end * fps - 1e-9)
+        if end_frame > start_frame:
+            telops.append(Telop(start_frame, end_frame, frames[key], TELOP_STYLES[key[1]]['bottom_margin']))
+    return telops
+
+
+def probe_frame_format(input_video):
+    """
+    ffprobe で映像の幅・高さ・フレームレートを取得
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height,r_frame_rate',
+        '-of', 'json',
+        input_video
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"ffprobe error: {result.stderr}")
+
+    stream = json.loads(result.stdout)['streams'][0]
+    return int(stream['width']), int(stream['height']), Fraction(stream['r_frame_rate'])
+
+
+def build_pipe_commands(input_video, output_video, width, height, fps, encode=None):
+    """
+    デコード（rawvideo を標準出力へ）とエンコード（rawvideo を標準入力から）の ffmpeg コマンド
+    """
+    encode = {**DEFAULT_ENCODE, **(encode or {})}
+    decode_cmd = [
+        'ffmpeg', '-nostdin', '-v', 'error',
+        '-i', input_video,
+        '-map', '0:v:0',
+        '-r', str(fps),  # 可変フレームレートの動画も一定のフレームレートにする（フレーム番号 = 時刻 * fps）
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        '-'
+    ]
+    encode_cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(fps),
+        '-i', '-',
+        '-i', input_video,
+        '-map', '0:v', '-map', '1:a?',
+        '-c:v', encode['codec'],
+        '-preset', str(encode['preset']),
+        '-crf', str(encode['crf']),
+        '-threads', str(encode['threads']),
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'copy',
+        '-y',
+        output_video
+    ]
+    return decode_cmd, encode_cmd
+
+
+def read_frame(stream, view) -> bool:
+    """パイプから view がいっぱいになるまで読み込む（途中で終わった場合は False）"""
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            return False
+        filled += count
+    return True
+
+
+def write_frame(stream, view):
+    """view の全体をパイプに書き込む"""
+    written = 0
+    while written < len(view):
+        written += stream.write(view[written:])
+
+
+def composite_video(input_video, output_video, telops, width, height, fps, encode=None,
+                    queue_frames=QUEUE_FRAMES):
+    """
+    デコード・合成・エンコードを重ねて実行し、(フレーム数, 全体の fps) を返す
+    """
+    decode_cmd, encode_cmd = build_pipe_commands(input_video, output_video, width, height, fps, encode)
+
+    # フレームバッファはデコーダー → 合成 → エンコーダー → デコーダーの順に使い回す
+    buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(queue_frames)]
+    views = [memoryview(buffer).cast('B') for buffer in buffers]
+    scratch = np.empty((height, width, 3), dtype=np.uint16)
+    carry = np.empty((height, width, 3), dtype=np.uint16)
+
+    free = queue.Queue()
+    decoded = queue.Queue()
+    composited = queue.Queue()
+    for index in range(queue_frames):
+        free.put(index)
+    errors = []
+
+    decoder = subprocess.Popen(decode_cmd, stdout=subprocess.PIPE, bufsize=0)
+    encoder = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE, bufsize=0)
+
+    def decode():
+        try:
+            while True:
+                index = free.get()
+                if not read_frame(decoder.stdout, views[index]):
+                    break
+                decoded.put(index)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            decoded.put(None)
+
+    def encode_frames():
+        failed = False
+        while True:
+            index = composited.get()
+            if index is None:
+                break
+            if not failed:
+                try:
+                    write_frame(encoder.stdin, views[index])
+                except Exception as e:
+                    # エンコーダーが終了した場合はデコードも止め、残りのフレームは捨てる
+                    errors.append(e)
+                    failed = True
+                    decoder.kill()
+            free.put(index)
+        try:
+            encoder.stdin.close()
+        except OSError:
+            pass
+
+    threads = [threading.Thread(target=decode, name='decode', daemon=True),
+               threading.Thread(target=encode_frames, name='encode', daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    schedule = TelopSchedule(telops)
+    frame_count = 0
+    composite_seconds = 0.0
+    started = last_report = time.time()
+
+    while True:
+        index = decoded.get()
+        if index is None:
+            break
+
+        composite_started = time.perf_counter()
+        frame = buffers[index]
+        for telop in schedule.at(frame_count):
+            sprite = telop.sprite_at(frame_count)
+            blend(frame, sprite, (width - sprite.width) // 2, height - sprite.height - telop.bottom_margin,
+                  scratch, carry)
+        composite_seconds += time.perf_counter() - composite_started
+
+        composited.put(index)
+        frame_count += 1
+
+        now = time.time()
+        if now - last_report >= REPORT_INTERVAL:
+            print(f"  {frame_count} frames ({frame_count / float(fps):.1f}s), {frame_count / (now - started):.1f} fps")
+            last_report = now
+
+    composited.put(None)
+    for thread in threads:
+        thread.join()
+    decoder.wait()
+    encoder.wait()
+
+    # エンコーダーが先に終了した場合はデコーダーを止めているので、エンコーダーのエラーを優先して報告する
+    if encoder.returncode != 0:
+        raise Exception(f"ffmpeg encode error (exit code {encoder.returncode})")
+    if errors:
+        raise Exception(f"Frame pipe error: {errors[0]}")
+    if decoder.returncode != 0:
+        raise Exception(f"ffmpeg decode error (exit code {decoder.returncode})")
+
+    elapsed = max(time.time() - started, 1e-9)
+    overall_fps = frame_count / elapsed
+    print(f"Processed {frame_count} frames in {elapsed:.1f}s: {overall_fps:.1f} fps "
+          f"(compositing alone: {frame_count / max(composite_seconds, 1e-9):.1f} fps)")
+    return frame_count, overall_fps
+
+
+def composite_telops(input_video, telop_data, output_video, percentile=LOUD_VOLUME_PERCENTILE,
+                     font_path=FONT_FILE, workers=None, animate_loud=True, encode=None,
+                     queue_frames=QUEUE_FRAMES, dry_run=False):
+    """
+    テロップデータの字幕をフレームごとに合成して動画に焼き込む
+
+    Args:
+        input_video: 入力動画パス
+        telop_data: テロップデータ（video-telop-data.json）または SRT / WebVTT の字幕ファイル
+        output_video: 出力動画パス
+        percentile: style のない字幕を volumeLevel で Loud にする閾値（パーセンタイル）
+        font_path: フォントファイル
+        workers: スプライトを描画するプロセス数（デフォルト：CPU数）
+        animate_loud: 大音量テロップを拡大表示から縮めるアニメーションにする
+        encode: エンコード設定（codec / preset / crf / threads）
+        queue_frames: 使い回すフレームバッファの数
+        dry_run: True なら実行せずにコマンドを表示
+    """
+    import subtitle_io
+
+    width, height, fps = probe_frame_format(input_video)
+    print(f"Video: {width}x{height} @ {float(fps):.3f} fps")
+
+    if dry_run:
+        for cmd in build_pipe_commands(input_video, output_video, width, height, fps, encode):
+            print(shlex.join(cmd))
+        return None
+
+    subtitles = list(subtitle_io.read_subtitles(telop_data))
+    telops = build_telops(subtitles, fps, percentile, font_path, workers or os.cpu_count() or 1, animate_loud)
+    print(f"Compositing {len(telops)} telops from: {telop_data}")
+    print(f"Output: {output_video}")
+
+    return composite_video(input_video, output_video, telops, width, height, fps, encode, queue_frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='テロップをフレームごとに NumPy で合成して動画に焼き込む')
+    parser.add_argument('input', help='入力動画ファイル')
+    parser.add_argument('output', help='出力動画ファイル')
+    parser.add_argument('--data', '-d', default='video-telop-data.json',
+                        help='テロップデータ（JSON）または字幕ファイル（デフォルト：video-telop-data.json）')
+    parser.add_argument('--percentile', type=float, default=LOUD_VOLUME_PERCENTILE,
+                        help=f'style のない字幕を volumeLevel で Loud にする閾値（デフォルト：{LOUD_VOLUME_PERCENTILE}）')
+    parser.add_argument('--font', default=FONT_FILE, help=f'フォントファイル（デフォルト：{FONT_FILE}）')
+    parser.add_argument('--workers', type=int, help='スプライトを描画するプロセス数（デフォルト：CPU数）')
+    parser.add_argument('--no-animation', action='store_true', help='大音量テロップの拡大アニメーションを行わない')
+    parser.add_argument('--queue', type=int, default=QUEUE_FRAMES,
+                        help=f'使い回すフレームバッファの数（デフォルト：{QUEUE_FRAMES}）')
+    parser.add_argument('--preset', default=DEFAULT_ENCODE['preset'], help=f"x264のプリセット（デフォルト：{DEFAULT_ENCODE['preset']}）")
+    parser.add_argument('--crf', type=int, default=DEFAULT_ENCODE['crf'], help=f"画質（デフォルト：{DEFAULT_ENCODE['crf']}）")
+    parser.add_argument('--threads', type=int, default=DEFAULT_ENCODE['threads'], help='エンコードのスレッド数（デフォルト：0＝自動）')
+    parser.add_argument('--dry-run', action='store_true', help='実行せずに ffmpeg コマンドを表示')
+
+    args = parser.parse_args()
+
+    for path in (args.input, args.data):
+        if not os.path.exists(path):
+            parser.error(f"File not found: {path}")
+    if args.queue < 2:
+        parser.error("--queue must be at least 2")
+
+    composite_telops(
+        args.input,
+        args.data,
+        args.output,
+        args.percentile,
+        args.font,
+        args.workers,
+        not args.no_animation,
+        {'preset': args.preset, 'crf': args.crf, 'threads': args.threads},
+        args.queue,
+        args.dry_run
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+字幕と音声解析データの位置合わせ
+ソート済みのタイムスタンプ配列に対して searchsorted で字幕ごとの
+音量サンプルを求めます（字幕数 × サンプル数の総当たりをしない）。
+"""
+
+import numpy as np
+from typing import Dict, List, Tuple
+
+from loud_intervals import classify_spans, intervals_from_state
+
+# mid: 字幕の中央時刻に最も早く一致するサンプル（従来の挙動）
+# max / mean / percentile: [startTime, endTime] 内のサンプルを集計
+# intervals: 大音量区間（loud_intervals）と重なるかで判定
+AGGREGATIONS = ('mid', 'max', 'mean', 'percentile', 'intervals')
+
+DEFAULT_VOLUME_LEVEL = 0.5
+
+
+def _sorted_analysis(audio_data: Dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    タイムスタンプ順に並んだ (timestamps, rms_linear, is_loud) を返す
+    """
+    timestamps = np.asarray(audio_data['timestamps'], dtype=np.float64)
+    levels = np.asarray(audio_data['rms_linear'], dtype=np.float64)
+    flags = np.asarray(audio_data['is_loud'], dtype=bool)
+
+    if len(timestamps) > 1 and np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, levels, flags = timestamps[order], levels[order], flags[order]
+
+    return timestamps, levels, flags
+
+
+def _midpoint_indices(timestamps: np.ndarray, mid: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    各中央時刻について |timestamp - mid| < tolerance を満たす最初のサンプル位置（なければ -1）
+    """
+    idx = np.searchsorted(timestamps, mid - tolerance, side='right')
+    found = idx < len(timestamps)
+    found[found] = timestamps[idx[found]] < mid[found] + tolerance
+    return np.where(found, idx, -1)
+
+
+def _span_percentile(levels: np.ndarray, lo: np.ndarray, hi: np.ndarray, percentile: float) -> np.ndarray:
+    """
+    各区間 levels[lo:hi]（空でないこと）のパーセンタイルを一括計算（線形補間）
+    """
+    lengths = hi - lo
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    segment = np.repeat(np.arange(len(lo)), lengths)
+
+    # 全区間のサンプルを連結し、区間ごとに値でソート
+    # （区間番号 + 0〜0.5に正規化した値 をキーにした1回のソートで lexsort を避ける）
+    gathered = levels[np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(lo, lengths)]
+    low, high = gathered.min(), gathered.max()
+    scale = 0.5 / (high - low) if high > low else 0.0
+    gathered = gathered[np.argsort(segment + (gathered - low) * scale)]
+
+    position = (lengths - 1) * (percentile / 100.0)
+    below = np.floor(position).astype(np.int64)
+    above = np.minimum(below + 1, lengths - 1)
+    fraction = position - below
+
+    low_values = gathered[offsets + below]
+    high_values = gathered[offsets + above]
+    return low_values + (high_values - low_values) * fraction
+
+
+def _aggregate_spans(values: np.ndarray, lo: np.ndarray, hi: np.ndarray, mode: str,
+                    percentile: float) -> np.ndarray:
+    """
+    各区間 values[lo:hi]（空でないこと）を max / mean / percentile で集計
+    """
+    if mode == 'max':
+        # 末尾に番兵を追加して hi == len の区間も reduceat で扱えるようにする
+        padded = np.append(values, 0.0)
+        bounds = np.column_stack((lo, hi)).ravel()
+        return np.maximum.reduceat(padded, bounds)[::2]
+    if mode == 'mean':
+        cumulative = np.concatenate(([0.0], np.cumsum(values)))
+        return (cumulative[hi] - cumulative[lo]) / (hi - lo)
+    return _span_percentile(values, lo, hi, percentile) if len(lo) else np.empty(0)
+
+
+def align_loudness(audio_data: Dict, starts, ends, mode: str = 'mid',
+                   tolerance: float = 0.5, percentile: float = 90.0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    字幕の時間範囲ごとに音量レベルと大音量判定を求める
+
+    Args:
+        audio_data: analysis_io の配列形式（timestamps, rms_linear, is_loud, threshold, threshold_mode）
+        starts: 字幕の開始時刻の配列
+        ends: 字幕の終了時刻の配列
+        mode: AGGREGATIONS のいずれか
+        tolerance: mid モードで中央時刻と一致とみなす範囲（秒）
+        percentile: percentile モードで使うパーセンタイル
+
+    Returns:
+        (volume_levels, is_loud) の配列。該当サンプルがない字幕は
+        DEFAULT_VOLUME_LEVEL / False になる。threshold_mode が rolling の場合、
+        max / mean / percentile の大音量判定はサンプルごとの is_loud を集計して求める。
+    """
+    if mode not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {mode} (choose from {', '.join(AGGREGATIONS)})")
+
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    timestamps, levels, flags = _sorted_analysis(audio_data)
+
+    volume_levels = np.full(len(starts), DEFAULT_VOLUME_LEVEL)
+    is_loud = np.zeros(len(starts), dtype=bool)
+
+    # サンプルを持たない区間のみのデータは区間で判定する
+    if mode == 'intervals' or (len(timestamps) == 0 and audio_data.get('loud_intervals') is not None):
+        return _align_intervals(audio_data, timestamps, levels, flags, starts, ends, tolerance)
+
+    if len(timestamps) == 0 or len(starts) == 0:
+        return volume_levels, is_loud
+
+    # 中央時刻のサンプル（mid モード、および区間内にサンプルがない短い字幕に使う）
+    mid_idx = _midpoint_indices(timestamps, (starts + ends) / 2, tolerance)
+    has_mid = mid_idx >= 0
+    volume_levels[has_mid] = levels[mid_idx[has_mid]]
+    is_loud[has_mid] = flags[mid_idx[has_mid]]
+
+    if mode == 'mid':
+        return volume_levels, is_loud
+
+    lo = np.searchsorted(timestamps, starts, side='left')
+    hi = np.searchsorted(timestamps, ends, side='right')
+    span = hi > lo
+    lo, hi = lo[span], hi[span]
+
+    aggregated = _aggregate_spans(levels, lo, hi, mode, percentile)
+    volume_levels[span] = aggregated
+
+    if audio_data.get('threshold_mode') != 'rolling':
+        is_loud[span] = aggregated >= audio_data['threshold']
+    else:
+        # rolling の threshold は代表値で、閾値はサンプルごとに変わるため、各サンプルの is_loud（0/1）を同じ方法で集計して判定する
+        # （max はいずれか、mean は過半数、percentile は上位 100 - percentile% が大音量）
+        is_loud[span] = _aggregate_spans(flags.astype(np.float64), lo, hi, mode, percentile) >= 0.5
+
+    return volume_levels, is_loud
+
+
+def _align_intervals(audio_data: Dict, timestamps: np.ndarray, levels: np.ndarray, flags: np.ndarray,
+                     starts: np.ndarray, ends: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    大音量区間との重なりで判定（区間がないデータは is_loud の連続から区間を作る）
+
+    大音量の字幕は重なる区間のピーク、それ以外は中央時刻のサンプルを音量とする。
+    """
+    intervals = audio_data.get('loud_intervals')
+    if intervals is None:
+        intervals = intervals_from_state(timestamps, levels, flags)
+
+    volume_levels = np.full(len(starts), DEFAULT_VOLUME_LEVEL)
+    if len(timestamps) and len(starts):
+        mid_idx = _midpoint_indices(timestamps, (starts + ends) / 2, tolerance)
+        has_mid = mid_idx >= 0
+        volume_levels[has_mid] = levels[mid_idx[has_mid]]
+
+    peaks, is_loud = classify_spans(intervals, starts, ends)
+    volume_levels[is_loud] = peaks[is_loud]
+
+    return volume_levels, is_loud
+
+
+def align_subtitles(subtitles: List[Dict], audio_data: Dict, mode: str = 'mid',
+                    tolerance: float = 0.5, percentile: float = 90.0) -> Tuple[List[float], List[bool]]:
+    """
+    字幕エントリ（startTime / endTime を持つ辞書）のリストに対して align_loudness を実行
+    """
+    starts = np.fromiter((sub['startTime'] for sub in subtitles), dtype=np.float64, count=len(subtitles))
+    ends = np.fromiter((sub['endTime'] for sub in subtitles), dtype=np.float64, count=len(subtitles))
+    volume_levels, is_loud = align_loudness(audio_data, starts, ends, mode, tolerance, percentile)
+    return volume_levels.tolist(), is_loud.tolist()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+音声解析データの入出力
+analyze-audio.py の出力を従来のJSON（サンプルごとの辞書のリスト）、
+列指向のJSON（並列配列 + is_loud のランレングス符号化）、
+大音量区間のみのJSON、または .npz で読み書きします。
+"""
+
+import json
+import numpy as np
+from pathlib import Path
+from typing import Dict
+
+FORMATS = ('json', 'columnar', 'intervals', 'npz')
+
+
+def rms_db_to_linear(rms_db: np.ndarray) -> np.ndarray:
+    """
+    dBを線形スケール(0-1)に変換（-60dBを0、0dBを1とする）
+    """
+    return np.clip((np.asarray(rms_db, dtype=np.float64) + 60) / 60, 0, 1)
+
+
+def encode_rle(flags: np.ndarray) -> Dict:
+    """
+    真偽値の配列をランレングス符号化
+
+    runs は start の値から始まり、以降は値が交互に切り替わる。
+    """
+    flags = np.asarray(flags, dtype=bool)
+    if len(flags) == 0:
+        return {'encoding': 'rle', 'start': False, 'runs': []}
+
+    change = np.flatnonzero(flags[1:] != flags[:-1]) + 1
+    bounds = np.concatenate(([0], change, [len(flags)]))
+
+    return {
+        'encoding': 'rle',
+        'start': bool(flags[0]),
+        'runs': np.diff(bounds).tolist()
+    }
+
+
+def decode_rle(encoded: Dict) -> np.ndarray:
+    """
+    encode_rle の逆変換
+    """
+    runs = np.asarray(encoded['runs'], dtype=np.int64)
+    values = np.zeros(len(runs), dtype=bool)
+    values[0::2] = encoded['start']
+    values[1::2] = not encoded['start']
+    return np.repeat(values, runs)
+
+
+def build_output(video_path: str, percentile: float, threshold: float,
+                 timestamps: np.ndarray, rms_db: np.ndarray, is_loud: np.ndarray,
+                 fmt: str = 'json', loud_intervals: np.ndarray = None) -> Dict:
+    """
+    解析結果からJSON出力用の辞書を作成
+
+    fmt='json' は従来形式、fmt='columnar' は列指向形式、
+    fmt='intervals' はサンプルを含まず大音量区間のみ。
+    """
+    output = {
+        'video_path': video_path,
+        'percentile': percentile,
+        'threshold': threshold
+    }
+
+    if loud_intervals is not None:
+        output['loud_intervals'] = np.round(loud_intervals, 3).tolist()
+
+    if fmt == 'intervals':
+        output['format'] = 'intervals'
+        return output
+
+    if fmt == 'columnar':
+        output['format'] = 'columnar'
+        output['analysis_data'] = {
+            'timestamp': np.round(timestamps, 3).tolist(),
+            'rms_db': np.round(rms_db, 2).tolist(),
+            'is_loud': encode_rle(is_loud)
+        }
+        return output
+
+    rms_linear = rms_db_to_linear(rms_db)
+    output['analysis_data'] = [
+        {'timestamp': t, 'rms_db': db, 'rms_linear': lin, 'is_loud': loud}
+        for t, db, lin, loud in zip(np.asarray(timestamps).tolist(), np.asarray(rms_db).tolist(),
+                                    rms_linear.tolist(), np.asarray(is_loud).tolist())
+    ]
+    return output
+
+
+def save_npz(path: str, video_path: str, percentile: float, threshold: float,
+             timestamps: np.ndarray, rms_db: np.ndarray, is_loud: np.ndarray,
+             loud_intervals: np.ndarray = None, rms_dtype=np.float32,
+             threshold_mode: str = 'global') -> None:
+    """
+    解析結果を圧縮 .npz で保存
+
+    rms_db はデフォルトで float32 に丸める（rms_dtype=np.float64 で劣化なし）。
+    """
+    extra = {}
+    if loud_intervals is not None:
+        extra['loud_intervals'] = np.asarray(loud_intervals, dtype=np.float64).reshape(-1, 3)
+
+    np.savez_compressed(
+        path,
+        video_path=np.array(video_path),
+        percentile=np.array(percentile, dtype=np.float64),
+        threshold=np.array(threshold, dtype=np.float64),
+        threshold_mode=np.array(threshold_mode),
+        timestamp=np.asarray(timestamps, dtype=np.float64),
+        rms_db=np.asarray(rms_db, dtype=rms_dtype),
+        is_loud=np.packbits(np.asarray(is_loud, dtype=bool)),
+        num_samples=np.array(len(timestamps), dtype=np.int64),
+        **extra
+    )
+
+
+def normalize_audio_analysis(data: Dict) -> Dict:
+    """
+    読み込んだJSON（従来形式・列指向形式・区間のみの形式）を配列ベースの共通形式に変換
+
+    Returns:
+        video_path, percentile, threshold, threshold_mode と
+        timestamps, rms_db, rms_linear, is_loud の配列、
+        loud_intervals（ない場合は None）を持つ辞書
+    """
+    analysis = data.get('analysis_data', [])
+
+    if data.get('format') == 'intervals':
+        timestamps = rms_db = rms_linear = np.empty(0)
+        is_loud = np.empty(0, dtype=bool)
+    elif data.get('format') == 'columnar':
+        timestamps = np.asarray(analysis['timestamp'], dtype=np.float64)
+        rms_db = np.asarray(analysis['rms_db'], dtype=np.float64)
+        rms_linear = rms_db_to_linear(rms_db)
+        is_loud = decode_rle(analysis['is_loud'])
+    else:
+        timestamps = np.fromiter((item['timestamp'] for item in analysis), dtype=np.float64, count=len(analysis))
+        rms_db = np.fromiter((item['rms_db'] for item in analysis), dtype=np.float64, count=len(analysis))
+        rms_linear = np.fromiter((item['rms_linear'] for item in analysis), dtype=np.float64, count=len(analysis))
+        is_loud = np.fromiter((item['is_loud'] for item in analysis), dtype=bool, count=len(analysis))
+
+    loud_intervals = data.get('loud_intervals')
+    if loud_intervals is not None:
+        loud_intervals = np.asarray(loud_intervals, dtype=np.float64).reshape(-1, 3)
+
+    return {
+        'video_path': data['video_path'],
+        'percentile': data['percentile'],
+        'threshold': data['threshold'],
+        'threshold_mode': data.get('threshold_mode', 'global'),
+        'timestamps': timestamps,
+        'rms_db': rms_db,
+        'rms_linear': rms_linear,
+        'is_loud': is_loud,
+        'loud_intervals': loud_intervals
+    }
+
+
+def load_audio_analysis(path: str) -> Dict:
+    """
+    音声解析ファイル（.npz / 従来JSON / 列指向JSON / 区間のみのJSON）を読み込む
+
+    Returns:
+        normalize_audio_analysis と同じ形式の辞書
+    """
+    if Path(path).suffix == '.npz':
+        with np.load(path) as npz:
+            count = int(npz['num_samples'])
+            rms_db = npz['rms_db'].astype(np.float64)
+            return {
+                'video_path': str(npz['video_path']),
+                'percentile': float(npz['percentile']),
+                'threshold': float(npz['threshold']),
+                'threshold_mode': str(npz['threshold_mode']) if 'threshold_mode' in npz.files else 'global',
+                'timestamps': npz['timestamp'],
+                'rms_db': rms_db,
+                'rms_linear': rms_db_to_linear(rms_db),
+                'is_loud': np.unpackbits(npz['is_loud'], count=count).astype(bool),
+                'loud_intervals': npz['loud_intervals'] if 'loud_intervals' in npz.files else None
+            }
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return normalize_audio_analysis(json.load(f))
@@ -7,10 +7,31 @@
 
 import sys
 import json
+import math
 import subprocess
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import loudness_cache
+import tracing
+from analysis_io import FORMATS, build_output, rms_db_to_linear, save_npz
+from audio_source import iter_wav_blocks, wav_info
+from loud_intervals import (DEFAULT_HYSTERESIS_DB, DEFAULT_MERGE_GAP, DEFAULT_MIN_DURATION,
+                            detect_loud_intervals)
+from loudness_threshold import THRESHOLD_MODES, ThresholdTracker
+
+# PCMエンジンのデコード設定
+PCM_SAMPLE_RATE = 16000  # 16kHzモノラル（音量分析には十分）
+PCM_BLOCK_WINDOWS = 1024  # 1回の読み込みで処理する分析窓の数
+SILENCE_FLOOR_DB = -120.0  # 無音時のRMS下限（-infを避ける）
+SHARD_PRE_ROLL_SECONDS = 1  # 分割解析時にシーク位置より前から読み捨てる秒数
+# 分割解析と単一プロセスの RMS の差の許容値（dB）。シャードの境界は ffmpeg の入力シークの精度に依存し、
+# AAC などではサンプル単位で一致するとは限らない（benchmarks/run_benchmarks.py --verify-shards で確認する）
+SHARD_TOLERANCE_DB = 0.01
+
+ENGINES = ('pcm', 'astats')
+
 
 def extract_audio_info(video_path: str) -> dict:
     """
@@ -26,7 +47,7 @@ def extract_audio_info(video_path: str) -> dict:
         video_path
     ]
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = tracing.run(cmd, capture_output=True, text=True)
     if result.returncode != 0:
         raise Exception(f"ffprobe error: {result.stderr}")
 
@@ -46,17 +67,384 @@ def extract_audio_info(video_path: str) -> dict:
     }
 
 
-def analyze_audio_rms(video_path: str, interval: float = 0.1) -> list:
+def _read_exact(stream, buf: memoryview) -> int:
     """
-    音声のRMSレベルを分析
+    パイプから buf を満たすまで読み込み、読み込んだバイト数を返す
+    （EOFに達した場合は buf より短くなる）
+    """
+    total = 0
+    while total < len(buf):
+        n = stream.readinto(buf[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+def iter_pcm_blocks(video_path: str, block_samples: int,
+                    sample_rate: int = PCM_SAMPLE_RATE, seek: int = 0):
+    """
+    ffmpegでモノラルfloat32 PCMにデコードし、固定長ブロック単位で返す
+
+    返すブロックは内部バッファのビューなので、次のブロックを要求する前に
+    必要な値を取り出しておくこと。最後のブロックのみ短くなる場合がある。
+    seek（秒）を指定するとその位置からデコードする。
+    """
+    cmd = ['ffmpeg', '-v', 'error']
+    if seek:
+        cmd.extend(['-ss', str(seek)])
+    cmd += [
+        '-i', video_path,
+        '-vn',
+        '-map', '0:a:0',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-f', 'f32le',
+        '-'
+    ]
+
+    buffer = np.empty(block_samples, dtype=np.float32)
+    view = memoryview(buffer).cast('B')
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    finished = False
+    try:
+        while True:
+            nbytes = _read_exact(proc.stdout, view)
+            count = nbytes // buffer.itemsize
+            if count:
+                yield buffer[:count]
+            if nbytes < len(view):
+                break
+        finished = True
+    finally:
+        # 途中で読み込みをやめた場合はffmpegを止める
+        if not finished:
+            proc.kill()
+        proc.stdout.close()
+        stderr = proc.stderr.read().decode('utf-8', errors='replace')
+        proc.stderr.close()
+        returncode = proc.wait()
+
+    if returncode != 0:
+        raise Exception(f"ffmpeg decode error: {stderr}")
+
+
+def compute_window_levels(samples: np.ndarray, window: int) -> tuple:
+    """
+    サンプル列を window サンプルごとの窓に分けてRMSとピークを計算
+
+    末尾の端数は短い窓として扱う。
+
+    Returns:
+        (rms, peak) の線形値配列
+    """
+    full = len(samples) // window
+    body = samples[:full * window].reshape(full, window)
+
+    rms = np.sqrt(np.mean(np.square(body, dtype=np.float64), axis=1))
+    peak = np.max(np.abs(body), axis=1) if full else np.empty(0, dtype=np.float32)
+
+    tail = samples[full * window:]
+    if len(tail):
+        rms = np.append(rms, np.sqrt(np.mean(np.square(tail, dtype=np.float64))))
+        peak = np.append(peak, np.max(np.abs(tail)))
+
+    return rms, peak
+
+
+def levels_to_db(levels: np.ndarray) -> np.ndarray:
+    """
+    線形レベルをdBFSに変換（無音は SILENCE_FLOOR_DB で下限を設ける）
+    """
+    floor = 10 ** (SILENCE_FLOOR_DB / 20)
+    return 20 * np.log10(np.maximum(levels, floor))
+
+
+def build_rms_data(timestamps: np.ndarray, rms_db: np.ndarray) -> list:
+    """
+    タイムスタンプとRMS(dB)の配列から従来形式のサンプルリストを作成
+    """
+    rms_linear = rms_db_to_linear(rms_db)
+
+    return [
+        {'timestamp': t, 'rms_db': db, 'rms_linear': lin}
+        for t, db, lin in zip(timestamps.tolist(), rms_db.tolist(), rms_linear.tolist())
+    ]
+
+
+def analyze_audio_rms_pcm(video_path: str, interval: float = 0.1,
+                          sample_rate: int = PCM_SAMPLE_RATE,
+                          audio_path: str = None, on_levels=None) -> tuple:
+    """
+    生PCMをストリーミングで読み込み、interval 秒ごとのRMS/ピークを計算
+
+    audio_path に audio_source.py で抽出済みのWAVを渡すと、
+    動画を再デコードせずにそのPCMを読む。
+    on_levels を渡すと、デコードしたブロックごとに RMS(dB) の配列で呼び出す。
+
+    Returns:
+        (timestamps, rms_db, peak_db) の配列
+    """
+    if audio_path:
+        sample_rate = wav_info(audio_path)['sample_rate']
+
+    window = max(1, int(round(interval * sample_rate)))
+    block_samples = window * PCM_BLOCK_WINDOWS
+
+    if audio_path:
+        blocks = iter_wav_blocks(audio_path, block_samples)
+    else:
+        blocks = iter_pcm_blocks(video_path, block_samples, sample_rate)
+
+    rms_blocks = []
+    peak_blocks = []
+    with tracing.span('pcm-levels', cat='decode', source='wav' if audio_path else 'ffmpeg') as sp:
+        for block in blocks:
+            rms, peak = compute_window_levels(block, window)
+            rms_blocks.append(rms)
+            peak_blocks.append(peak)
+            if on_levels is not None:
+                on_levels(levels_to_db(rms))
+        sp.set(windows=sum(len(r) for r in rms_blocks))
+
+    if not rms_blocks:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty, empty
+
+    rms = np.concatenate(rms_blocks)
+    peak = np.concatenate(peak_blocks)
+    timestamps = np.arange(len(rms), dtype=np.float64) * (window / sample_rate)
+
+    return timestamps, levels_to_db(rms), levels_to_db(peak)
+
+
+def plan_shards(duration: float, interval: float, workers: int,
+                sample_rate: int = PCM_SAMPLE_RATE) -> list:
+    """
+    分割解析の範囲 (start_sample, end_sample) のリストを作成
+
+    境界は分析窓の倍数かつ整数秒に揃えるので、各シャードの窓が
+    単一プロセスの窓と一致し、重複・欠落が起きない。
+    最後のシャードの end_sample は None（ファイル末尾まで）。
+    """
+    window = max(1, int(round(interval * sample_rate)))
+    step = math.lcm(window, sample_rate)
+    units = math.ceil(duration * sample_rate / step)
+    count = min(workers, units)
+
+    if count <= 1:
+        return [(0, None)]
+
+    per_shard = math.ceil(units / count)
+    starts = [i * per_shard * step for i in range(count) if i * per_shard < units]
+    ends = starts[1:] + [None]
+    return list(zip(starts, ends))
+
+
+def _analyze_shard(video_path: str, interval: float, sample_rate: int,
+                   start_sample: int, end_sample: int = None) -> tuple:
+    """
+    [start_sample, end_sample) の範囲を解析し、線形の (rms, peak) を返す
+
+    デコーダとリサンプラの状態を単一プロセス時と揃えるため、
+    SHARD_PRE_ROLL_SECONDS だけ手前からデコードして読み捨てる。
+    """
+    with tracing.span('pcm-shard', cat='decode', start_sample=start_sample) as sp:
+        rms, peak = _analyze_shard_levels(video_path, interval, sample_rate, start_sample, end_sample)
+        sp.set(windows=len(rms))
+
+    # プロセスプールのワーカーは atexit が呼ばれないのでここで書き出す
+    tracing.flush()
+    return rms, peak
+
+
+def _analyze_shard_levels(video_path: str, interval: float, sample_rate: int,
+                          start_sample: int, end_sample: int = None) -> tuple:
+    """
+    _analyze_shard の本体
+    """
+    window = max(1, int(round(interval * sample_rate)))
+    start_second = start_sample // sample_rate
+    pre_roll = min(SHARD_PRE_ROLL_SECONDS, start_second)
+    skip = pre_roll * sample_rate
+    limit = None if end_sample is None else end_sample - start_sample
+
+    rms_blocks = []
+    peak_blocks = []
+    pending = np.empty(0, dtype=np.float32)
+    position = -skip  # シャード先頭からの相対位置
+
+    blocks = iter_pcm_blocks(video_path, window * PCM_BLOCK_WINDOWS, sample_rate,
+                             seek=start_second - pre_roll)
+    for block in blocks:
+        piece = block[max(0, -position):]
+        position += len(block)
+        if position <= 0:
+            continue
+        if limit is not None:
+            piece = piece[:max(0, limit - (position - len(piece)))]
+
+        # 端数は次のブロックに持ち越し、窓単位で処理する
+        samples = np.concatenate((pending, piece))
+        full = len(samples) // window * window
+        rms, peak = compute_window_levels(samples[:full], window)
+        rms_blocks.append(rms)
+        peak_blocks.append(peak)
+        pending = samples[full:]
+
+        if limit is not None and position >= limit:
+            break
+    blocks.close()
+
+    if len(pending):
+        rms, peak = compute_window_levels(pending, window)
+        rms_blocks.append(rms)
+        peak_blocks.append(peak)
+
+    if not rms_blocks:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(rms_blocks), np.concatenate(peak_blocks)
+
+
+def analyze_audio_rms_sharded(video_path: str, interval: float = 0.1, workers: int = 2,
+                              sample_rate: int = PCM_SAMPLE_RATE, on_levels=None) -> tuple:
+    """
+    動画を時間で分割し、プロセスプールで並列にRMS/ピークを計算
+
+    結果は analyze_audio_rms_pcm と同じ形式の (timestamps, rms_db, peak_db)。
+    値の一致は ffmpeg の入力シークがサンプル単位で正確かどうかに依存するので、
+    差は SHARD_TOLERANCE_DB まで許容する（benchmarks/run_benchmarks.py --verify-shards で確認する）。
+    on_levels はシャードが先頭から順に揃うたびに、そのシャードの RMS(dB) で呼び出す。
+    """
+    duration = extract_audio_info(video_path)['duration']
+    shards = plan_shards(duration, interval, workers, sample_rate)
+
+    print(f"Analyzing {len(shards)} shards with {workers} workers", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+        futures = [
+            executor.submit(_analyze_shard, video_path, interval, sample_rate, start, end)
+            for start, end in shards
+        ]
+        results = []
+        for future in futures:
+            results.append(future.result())
+            if on_levels is not None:
+                on_levels(levels_to_db(results[-1][0]))
+
+    rms = np.concatenate([r for r, _ in results])
+    peak = np.concatenate([p for _, p in results])
+    window = max(1, int(round(interval * sample_rate)))
+    timestamps = np.arange(len(rms), dtype=np.float64) * (window / sample_rate)
+
+    return timestamps, levels_to_db(rms), levels_to_db(peak)
+
+
+def analyze_audio_levels(video_path: str, interval: float = 0.1, audio_path: str = None,
+                         use_cache: bool = True, workers: int = 1, on_levels=None) -> tuple:
+    """
+    pcmエンジンで (timestamps, rms_db) 配列を取得（キャッシュがあればデコードしない）
+
+    キャッシュヒット時の配列は読み取り専用のメモリマップになる。
+    workers が2以上で audio_path がない場合は時間分割して並列に解析する。分割解析の結果は
+    単一プロセスの結果と SHARD_TOLERANCE_DB 以内の差がありうるので、別のキーでキャッシュする。
+    on_levels は RMS(dB) のブロックごとに呼び出す（キャッシュヒット時はメモリマップを区切って渡す）。
+    """
+    sample_rate = wav_info(audio_path)['sample_rate'] if audio_path else PCM_SAMPLE_RATE
+    sharded = workers > 1 and not audio_path
+    params = {'engine': 'pcm', 'interval': interval, 'sample_rate': sample_rate}
+    if sharded:
+        params['workers'] = workers
+
+    if use_cache:
+        with tracing.span('cache-load', cat='cache') as sp:
+            cached = loudness_cache.load(video_path, params)
+            sp.set(hit=cached is not None)
+        if cached is not None:
+            print(f"Loaded RMS data from cache ({len(cached[0])} samples)", file=sys.stderr)
+            if on_levels is not None:
+                for start in range(0, len(cached[1]), PCM_BLOCK_WINDOWS):
+                    on_levels(cached[1][start:start + PCM_BLOCK_WINDOWS])
+            return cached
+
+    if sharded:
+        timestamps, rms_db, _ = analyze_audio_rms_sharded(video_path, interval, workers, sample_rate, on_levels)
+    else:
+        timestamps, rms_db, _ = analyze_audio_rms_pcm(video_path, interval, sample_rate, audio_path, on_levels)
+
+    if use_cache and len(timestamps):
+        try:
+            with tracing.span('cache-store', cat='cache', samples=len(timestamps)):
+                loudness_cache.store(video_path, params, timestamps, rms_db)
+        except OSError as e:
+            print(f"Warning: Failed to write loudness cache: {e}", file=sys.stderr)
+
+    return timestamps, rms_db
+
+
+def rms_data_to_arrays(rms_data: list) -> tuple:
+    """
+    従来形式のサンプルリストを (timestamps, rms_db) 配列に変換
+    """
+    timestamps = np.array([item['timestamp'] for item in rms_data], dtype=np.float64)
+    rms_db = np.array([item['rms_db'] for item in rms_data], dtype=np.float64)
+    return timestamps, rms_db
+
+
+def analyze_audio_arrays(video_path: str, interval: float = 0.1, engine: str = 'pcm',
+                         audio_path: str = None, use_cache: bool = True, workers: int = 1,
+                         on_levels=None) -> tuple:
+    """
+    音声のRMSレベルを分析し、(timestamps, rms_db) 配列で返す
 
     Args:
         video_path: 動画ファイルのパス
-        interval: 分析間隔（秒）
+        interval: 分析間隔（秒）。pcmエンジンのみ有効
+        engine: 'pcm'（生PCMを窓ごとに集計）または 'astats'（ffmpegのastatsを解析）
+        audio_path: 抽出済みのWAV（pcmエンジンのみ。指定時は動画をデコードしない）
+        use_cache: 解析結果キャッシュを使うか（pcmエンジンのみ）
+        workers: 時間分割して並列に解析するプロセス数（pcmエンジンのみ）
+        on_levels: pcmエンジンの RMS(dB) のブロックごとに解析しながら呼び出す関数
+                   （astats と代替の方法では窓の長さが interval と異なるので呼ばない）
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine} (choose from {', '.join(ENGINES)})")
+
+    if engine == 'astats':
+        return rms_data_to_arrays(analyze_audio_rms_astats(video_path, interval))
+
+    print(f"Analyzing audio (pcm, {interval:.3f}s windows)", file=sys.stderr)
+
+    timestamps, rms_db = analyze_audio_levels(video_path, interval, audio_path, use_cache, workers, on_levels)
+
+    if not len(timestamps):
+        print("Warning: No RMS data extracted, using alternative method", file=sys.stderr)
+        return rms_data_to_arrays(analyze_audio_volumedetect(video_path, interval))
+
+    print(f"Extracted {len(timestamps)} RMS samples", file=sys.stderr)
+    return timestamps, rms_db
+
+
+def analyze_audio_rms(video_path: str, interval: float = 0.1, engine: str = 'pcm',
+                      audio_path: str = None, use_cache: bool = True, workers: int = 1) -> list:
+    """
+    音声のRMSレベルを分析
+
+    引数は analyze_audio_arrays と同じ。
 
     Returns:
         タイムスタンプとRMSレベルのリスト
     """
+    return build_rms_data(*analyze_audio_arrays(video_path, interval, engine, audio_path, use_cache, workers))
+
+
+def analyze_audio_rms_astats(video_path: str, interval: float = 0.1) -> list:
+    """
+    ffmpegのastatsフィルター出力を解析してRMSレベルを取得（フォールバック）
+
+    astatsは音声フレームごとに値を出力するため interval は使用しない。
+    """
     # 音声情報を取得
     audio_info = extract_audio_info(video_path)
     duration = audio_info['duration']
@@ -73,7 +461,7 @@ def analyze_audio_rms(video_path: str, interval: float = 0.1) -> list:
         '-'
     ]
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = tracing.run(cmd, name='ffmpeg-astats', capture_output=True, text=True)
 
     # 出力からRMSデータを抽出
     rms_data = []
@@ -129,7 +517,7 @@ def analyze_audio_volumedetect(video_path: str, interval: float = 0.1) -> list:
         '-'
     ]
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = tracing.run(cmd, name='ffmpeg-volumedetect', capture_output=True, text=True)
 
     # mean_volumeを取得
     mean_volume = -20.0  # デフォルト値
@@ -160,66 +548,303 @@ def analyze_audio_volumedetect(video_path: str, interval: float = 0.1) -> list:
     return rms_data
 
 
-def calculate_percentile_threshold(rms_data: list, percentile: float = 75.0) -> float:
+def calculate_percentile_threshold(rms_data, percentile: float = 75.0) -> float:
     """
     パーセンタイル閾値を計算
+
+    rms_data はサンプルのリスト、または rms_linear の配列。
     """
-    rms_values = [item['rms_linear'] for item in rms_data]
+    if isinstance(rms_data, np.ndarray):
+        rms_values = rms_data
+    else:
+        rms_values = [item['rms_linear'] for item in rms_data]
     threshold = np.percentile(rms_values, percentile)
     return float(threshold)
 
 
-def mark_loud_segments(rms_data: list, threshold: float) -> list:
+def calculate_loud_thresholds(timestamps: np.ndarray, rms_linear: np.ndarray, percentile: float = 75.0,
+                              mode: str = 'global', window: float = 30.0,
+                              tracker: ThresholdTracker = None) -> tuple:
+    """
+    大音量判定に使う閾値を計算
+
+    Args:
+        mode: 'global'（全体のパーセンタイル）、'streaming'（P²推定）、
+              'rolling'（直近 window 秒の局所パーセンタイル）
+        tracker: 解析ループで全サンプルを受け取り済みの ThresholdTracker
+                 （省略すると rms_linear から計算する）
+
+    Returns:
+        (threshold, thresholds)。threshold は出力用の代表値、
+        thresholds は判定に使う値（rolling のみサンプルごとの配列）
+    """
+    if mode not in THRESHOLD_MODES:
+        raise ValueError(f"Unknown threshold mode: {mode} (choose from {', '.join(THRESHOLD_MODES)})")
+
+    if mode != 'global' and tracker is None:
+        # サンプル間隔から窓のサンプル数を求める
+        step = float(np.median(np.diff(timestamps))) if len(timestamps) > 1 else window
+        window_samples = max(1, int(round(window / step))) if step > 0 else 1
+        tracker = ThresholdTracker(mode, percentile, window_samples)
+        tracker.update(rms_linear)
+
+    if mode == 'streaming':
+        threshold = tracker.value()
+        return threshold, threshold
+
+    threshold = calculate_percentile_threshold(rms_linear, percentile)
+    if mode == 'global':
+        return threshold, threshold
+
+    thresholds = tracker.thresholds()
+
+    # 無音が続く区間では局所閾値が0になるため、無音（-60dB以下）は大音量にしない
+    return threshold, np.maximum(thresholds, np.finfo(np.float64).tiny)
+
+
+def mark_loud_segments(rms_data: list, threshold) -> list:
     """
     大音量区間をマーク
+
+    threshold は全体の閾値、またはサンプルごとの閾値の配列。
     """
+    if isinstance(threshold, np.ndarray):
+        thresholds = threshold.tolist()
+    else:
+        thresholds = [threshold] * len(rms_data)
+
     result = []
-    for item in rms_data:
+    for item, item_threshold in zip(rms_data, thresholds):
         result.append({
             **item,
-            'is_loud': item['rms_linear'] >= threshold
+            'is_loud': item['rms_linear'] >= item_threshold
         })
     return result
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python analyze-audio.py <video_path> [percentile]", file=sys.stderr)
-        sys.exit(1)
-
-    video_path = sys.argv[1]
-    percentile = float(sys.argv[2]) if len(sys.argv) > 2 else 75.0
-
-    if not Path(video_path).exists():
-        print(f"Error: File not found: {video_path}", file=sys.stderr)
-        sys.exit(1)
+def analyze_audio(video_path: str, percentile: float = 75.0, engine: str = 'pcm', interval: float = 0.1,
+                  audio_path: str = None, use_cache: bool = True, workers: int = 1,
+                  threshold_mode: str = 'global', window: float = 30.0,
+                  hysteresis_db: float = DEFAULT_HYSTERESIS_DB,
+                  min_duration: float = DEFAULT_MIN_DURATION,
+                  merge_gap: float = DEFAULT_MERGE_GAP) -> dict:
+    """
+    音量解析・閾値計算・大音量区間の検出をまとめて実行
+    （process-video.py などからインポートして使うステージ関数）
 
+    Returns:
+        analysis_io.normalize_audio_analysis と同じ形式の辞書
+        （threshold_mode と window を追加で持つ）
+    """
     print(f"Analyzing audio from: {video_path}", file=sys.stderr)
     print(f"Percentile threshold: {percentile}%", file=sys.stderr)
+    print(f"Engine: {engine}", file=sys.stderr)
+
+    # pcmエンジンの streaming / rolling の閾値は解析ループからブロックごとに更新する
+    # （窓の長さが interval になるのは pcm のみ。それ以外はサンプル間隔から窓を求める）
+    tracker = None
+    on_levels = None
+    if threshold_mode != 'global' and engine == 'pcm':
+        tracker = ThresholdTracker(threshold_mode, percentile, max(1, int(round(window / interval))))
+        on_levels = lambda block_db: tracker.update(rms_db_to_linear(block_db))
 
     # 音声を分析
-    rms_data = analyze_audio_rms(video_path)
+    with tracing.span('analyze', engine=engine) as sp:
+        timestamps, rms_db = analyze_audio_arrays(video_path, interval, engine, audio_path, use_cache, workers,
+                                                  on_levels)
+        sp.set(samples=len(timestamps))
+    rms_linear = rms_db_to_linear(rms_db)
+
+    # 代替の方法に切り替わった場合はトラッカーにサンプルが渡っていない
+    if tracker is not None and tracker.count != len(rms_linear):
+        tracker = None
 
     # 閾値を計算
-    threshold = calculate_percentile_threshold(rms_data, percentile)
-    print(f"Calculated threshold: {threshold:.4f}", file=sys.stderr)
+    with tracing.span('threshold', mode=threshold_mode):
+        threshold, thresholds = calculate_loud_thresholds(timestamps, rms_linear, percentile, threshold_mode, window,
+                                                          tracker)
+    print(f"Calculated threshold: {threshold:.4f} ({threshold_mode})", file=sys.stderr)
 
     # 大音量区間をマーク
-    result = mark_loud_segments(rms_data, threshold)
+    is_loud = rms_linear >= thresholds
 
     # 統計情報
-    loud_count = sum(1 for item in result if item['is_loud'])
-    print(f"Loud segments: {loud_count}/{len(result)} ({loud_count/len(result)*100:.1f}%)", file=sys.stderr)
+    loud_count = int(np.count_nonzero(is_loud))
+    print(f"Loud segments: {loud_count}/{len(is_loud)} ({loud_count/len(is_loud)*100:.1f}%)", file=sys.stderr)
+
+    # ヒステリシス付きで大音量区間を検出
+    with tracing.span('loud-intervals') as sp:
+        loud_intervals = detect_loud_intervals(timestamps, rms_linear, thresholds,
+                                               hysteresis_db, min_duration, merge_gap)
+        sp.set(intervals=len(loud_intervals))
+    print(f"Loud intervals: {len(loud_intervals)}", file=sys.stderr)
 
-    # JSON形式で出力
-    output = {
+    return {
         'video_path': video_path,
         'percentile': percentile,
         'threshold': threshold,
-        'analysis_data': result
+        'threshold_mode': threshold_mode,
+        'window': window,
+        'timestamps': timestamps,
+        'rms_db': rms_db,
+        'rms_linear': rms_linear,
+        'is_loud': is_loud,
+        'loud_intervals': loud_intervals
     }
 
-    print(json.dumps(output, indent=2, ensure_ascii=False))
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python analyze-audio.py <video_path> [percentile] [--engine pcm|astats] [--interval SEC] [--audio WAV]", file=sys.stderr)
+        print("\nOptions:", file=sys.stderr)
+        print("  --engine NAME    Analysis engine: pcm (default) or astats", file=sys.stderr)
+        print("  --interval SEC   Analysis window for the pcm engine (default: 0.1)", file=sys.stderr)
+        print("  --audio WAV      Reuse audio extracted by audio_source.py (pcm engine)", file=sys.stderr)
+        print("  --no-cache       Do not read or write the loudness cache (pcm engine)", file=sys.stderr)
+        print("  --workers N      Analyze N time shards in parallel (pcm engine, default: 1)", file=sys.stderr)
+        print(f"                   Levels may differ from one process by up to {SHARD_TOLERANCE_DB}dB at shard seams",
+              file=sys.stderr)
+        print("  --threshold-mode MODE  global (default), streaming (P² estimate) or rolling", file=sys.stderr)
+        print("  --window SEC     Window for the rolling threshold (default: 30)", file=sys.stderr)
+        print("  --hysteresis DB  Loud intervals end this many dB below the threshold (default: 3)", file=sys.stderr)
+        print("  --min-duration SEC  Drop loud intervals shorter than this (default: 0.2)", file=sys.stderr)
+        print("  --merge-gap SEC  Join loud intervals separated by at most this (default: 0.3)", file=sys.stderr)
+        print("  --format FMT     Output format: json (default), columnar, intervals or npz", file=sys.stderr)
+        print("  --output PATH    Write to PATH instead of stdout (required for npz)", file=sys.stderr)
+        print("  --trace PATH     Write a Chrome trace (trace.json) of the run", file=sys.stderr)
+        sys.exit(1)
+
+    video_path = sys.argv[1]
+    percentile = 75.0
+    engine = 'pcm'
+    interval = 0.1
+    audio_path = None
+    use_cache = True
+    output_format = None
+    output_path = None
+    workers = 1
+    threshold_mode = 'global'
+    window = 30.0
+    hysteresis_db = DEFAULT_HYSTERESIS_DB
+    min_duration = DEFAULT_MIN_DURATION
+    merge_gap = DEFAULT_MERGE_GAP
+
+    # 引数パース
+    i = 2
+    while i < len(sys.argv):
+        if sys.argv[i] == '--engine' and i + 1 < len(sys.argv):
+            engine = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--audio' and i + 1 < len(sys.argv):
+            audio_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--no-cache':
+            use_cache = False
+            i += 1
+        elif sys.argv[i] == '--workers' and i + 1 < len(sys.argv):
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--threshold-mode' and i + 1 < len(sys.argv):
+            threshold_mode = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--window' and i + 1 < len(sys.argv):
+            window = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--hysteresis' and i + 1 < len(sys.argv):
+            hysteresis_db = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--min-duration' and i + 1 < len(sys.argv):
+            min_duration = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--merge-gap' and i + 1 < len(sys.argv):
+            merge_gap = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--format' and i + 1 < len(sys.argv):
+            output_format = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--output' and i + 1 < len(sys.argv):
+            output_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--interval' and i + 1 < len(sys.argv):
+            interval = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--trace' and i + 1 < len(sys.argv):
+            tracing.enable(sys.argv[i + 1])
+            i += 2
+        elif not sys.argv[i].startswith('--'):
+            percentile = float(sys.argv[i])
+            i += 1
+        else:
+            i += 1
+
+    if engine not in ENGINES:
+        print(f"Error: Unknown engine: {engine}", file=sys.stderr)
+        sys.exit(1)
+
+    # 出力形式（未指定の場合は出力ファイルの拡張子から判定）
+    if output_format is None:
+        output_format = 'npz' if output_path and output_path.endswith('.npz') else 'json'
+
+    if output_format not in FORMATS:
+        print(f"Error: Unknown format: {output_format}", file=sys.stderr)
+        sys.exit(1)
+
+    if output_format == 'npz' and not output_path:
+        print("Error: --format npz requires --output", file=sys.stderr)
+        sys.exit(1)
+
+    if threshold_mode not in THRESHOLD_MODES:
+        print(f"Error: Unknown threshold mode: {threshold_mode}", file=sys.stderr)
+        sys.exit(1)
+
+    if audio_path and engine != 'pcm':
+        print("Error: --audio requires the pcm engine", file=sys.stderr)
+        sys.exit(1)
+
+    if audio_path and not Path(audio_path).exists():
+        print(f"Error: File not found: {audio_path}", file=sys.stderr)
+        sys.exit(1)
+
+    if not Path(video_path).exists():
+        print(f"Error: File not found: {video_path}", file=sys.stderr)
+        sys.exit(1)
+
+    result = analyze_audio(video_path, percentile, engine, interval, audio_path, use_cache, workers,
+                           threshold_mode, window, hysteresis_db, min_duration, merge_gap)
+    threshold = result['threshold']
+    timestamps = result['timestamps']
+    rms_db = result['rms_db']
+    is_loud = result['is_loud']
+    loud_intervals = result['loud_intervals']
+
+    if output_format == 'npz':
+        with tracing.span('write-npz', cat='io'):
+            save_npz(output_path, video_path, percentile, threshold, timestamps, rms_db, is_loud, loud_intervals,
+                     threshold_mode=threshold_mode)
+        print(f"Audio analysis saved to: {output_path}", file=sys.stderr)
+        return
+
+    with tracing.span('serialize-json', cat='io', format=output_format) as sp:
+        output = build_output(video_path, percentile, threshold, timestamps, rms_db, is_loud,
+                              output_format, loud_intervals)
+        if threshold_mode != 'global':
+            output['threshold_mode'] = threshold_mode
+            if threshold_mode == 'rolling':
+                output['window'] = window
+
+        # JSON形式で出力（列指向・区間のみの形式は空白なしで詰める）
+        if output_format in ('columnar', 'intervals'):
+            text = json.dumps(output, ensure_ascii=False, separators=(',', ':'))
+        else:
+            text = json.dumps(output, indent=2, ensure_ascii=False)
+        sp.set(bytes=len(text))
+
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Audio analysis saved to: {output_path}", file=sys.stderr)
+    else:
+        print(text)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+音声取得スクリプト
+動画の音声を一度だけデコードし、文字起こしと音声解析の両方で
+共有できる16kHzモノラルPCM（WAV）を生成します。
+"""
+
+import sys
+import json
+import wave
+import numpy as np
+from pathlib import Path
+
+import tracing
+
+# Whisper推奨の16kHzモノラル。音量分析もこの同じPCMを読む
+ASR_SAMPLE_RATE = 16000
+
+# 文字起こしAPIへアップロードする圧縮形式
+# max_bytes_per_second はチャンク長を決めるための1秒あたりのサイズの上限の見積もり
+UPLOAD_FORMATS = {
+    'flac': {
+        'args': ['-c:a', 'flac', '-f', 'flac'],
+        'suffix': '.flac',
+        'mime': 'audio/flac',
+        'max_bytes_per_second': ASR_SAMPLE_RATE * 2  # 可逆圧縮なのでPCMを超えない
+    },
+    'opus': {
+        'args': ['-c:a', 'libopus', '-b:a', '32k', '-application', 'voip', '-f', 'ogg'],
+        'suffix': '.ogg',
+        'mime': 'audio/ogg',
+        'max_bytes_per_second': 32000 / 8 * 1.1  # 32kbps + Oggコンテナ分
+    }
+}
+
+
+def acquire_audio(video_path: str, output_path: str,
+                  sample_rate: int = ASR_SAMPLE_RATE) -> dict:
+    """
+    動画から音声を一度だけデコードしてPCM WAVに保存
+
+    Returns:
+        WAVの情報（wav_info と同じ形式）
+    """
+    cmd = [
+        'ffmpeg',
+        '-v', 'error',
+        '-i', video_path,
+        '-vn',  # 映像なし
+        '-map', '0:a:0',
+        '-acodec', 'pcm_s16le',  # PCM 16-bit
+        '-ar', str(sample_rate),
+        '-ac', '1',  # モノラル
+        '-y',  # 上書き
+        output_path
+    ]
+
+    result = tracing.run(cmd, name='ffmpeg-extract', capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"Audio extraction failed: {result.stderr}")
+
+    return wav_info(output_path)
+
+
+def encode_command(source_path: str, upload_format: str, start: float = None, duration: float = None,
+                   sample_rate: int = ASR_SAMPLE_RATE) -> list:
+    """
+    音声を UPLOAD_FORMATS の形式にエンコードして標準出力に書き出すffmpegコマンド
+
+    start / duration を指定するとその区間のみエンコードする。
+    """
+    cmd = ['ffmpeg', '-v', 'error']
+    if start:
+        cmd += ['-ss', f'{start:.3f}']
+    cmd += ['-i', source_path]
+    if duration is not None:
+        cmd += ['-t', f'{duration:.3f}']
+    cmd += [
+        '-vn',
+        '-map', '0:a:0',
+        '-ar', str(sample_rate),
+        '-ac', '1',
+        *UPLOAD_FORMATS[upload_format]['args'],
+        'pipe:1'
+    ]
+    return cmd
+
+
+def probe_duration(media_path: str) -> float:
+    """
+    ffprobeで長さ（秒）を取得
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'json',
+        media_path
+    ]
+
+    result = tracing.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"ffprobe error: {result.stderr}")
+
+    return float(json.loads(result.stdout)['format']['duration'])
+
+
+def wav_info(wav_path: str) -> dict:
+    """
+    WAVファイルの情報を取得（ffprobeを使わずヘッダーから読む）
+    """
+    with wave.open(wav_path, 'rb') as wav:
+        sample_rate = wav.getframerate()
+        num_samples = wav.getnframes()
+        channels = wav.getnchannels()
+        sample_width = wav.getsampwidth()
+
+    return {
+        'path': wav_path,
+        'duration': num_samples / sample_rate if sample_rate else 0.0,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'sample_width': sample_width,
+        'num_samples': num_samples
+    }
+
+
+def iter_wav_blocks(wav_path: str, block_samples: int):
+    """
+    16-bit PCM WAVを固定長ブロックごとにfloat32（-1.0〜1.0）で返す
+
+    最後のブロックのみ短くなる場合がある。
+    """
+    with wave.open(wav_path, 'rb') as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+            raise Exception(f"Unsupported WAV format (expected mono 16-bit): {wav_path}")
+
+        while True:
+            frames = wav.readframes(block_samples)
+            if not frames:
+                break
+            samples = np.frombuffer(frames, dtype='<i2').astype(np.float32)
+            samples *= 1.0 / 32768.0
+            yield samples
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python audio_source.py <video_path> <output.wav>", file=sys.stderr)
+        sys.exit(1)
+
+    video_path = sys.argv[1]
+    output_path = sys.argv[2]
+
+    if not Path(video_path).exists():
+        print(f"Error: File not found: {video_path}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Extracting audio from: {video_path}", file=sys.stderr)
+    info = acquire_audio(video_path, output_path)
+    print(f"Audio saved to: {output_path} ({info['duration']:.2f}s, {info['sample_rate']}Hz)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+動画の一括処理スクリプト
+ディレクトリまたはglobで指定した複数の動画を、ワーカー数を制限したプロセスプールで
+並列に処理します。動画ごとに出力ディレクトリを作り、進捗をマニフェストに記録するので、
+中断したバッチは再実行すると続きから処理されます。
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import contextlib
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPT_DIR))
+
+from alignment import AGGREGATIONS
+from stage_cache import StageCache
+from whisper_worker import DEFAULT_MODEL, connect_worker
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.mkv', '.webm', '.avi', '.m4v')
+MANIFEST_NAME = 'manifest.json'
+OUTPUT_NAME = 'telop-data.json'
+LOG_NAME = 'process.log'
+
+
+def find_videos(pattern: str) -> List[Path]:
+    """
+    ディレクトリ（直下の動画ファイル）またはglobパターンから入力動画を列挙
+    """
+    path = Path(pattern)
+    if path.is_dir():
+        candidates = path.iterdir()
+    else:
+        candidates = (Path(p) for p in glob.glob(pattern, recursive=True))
+
+    return sorted(p.resolve() for p in candidates
+                  if p.is_file() and p.suffix.lower() in VIDEO_EXTENSIONS)
+
+
+def assign_output_dirs(videos: List[Path], output_root: Path) -> Dict[str, Path]:
+    """
+    動画ごとの出力ディレクトリを決める（同名のファイルはパスのハッシュで区別）
+    """
+    stems = {}
+    for video in videos:
+        stems.setdefault(video.stem, []).append(video)
+
+    output_dirs = {}
+    for stem, paths in stems.items():
+        for video in paths:
+            name = stem
+            if len(paths) > 1:
+                name = f"{stem}-{hashlib.sha1(str(video).encode('utf-8')).hexdigest()[:8]}"
+            output_dirs[str(video)] = output_root / name
+
+    return output_dirs
+
+
+def input_signature(video: Path) -> Dict:
+    """
+    入力が変わったかを判定するためのサイズと更新時刻
+    """
+    stat = video.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_manifest(path: Path) -> Dict:
+    if not path.exists():
+        return {'files': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path: Path, manifest: Dict) -> None:
+    """
+    マニフェストを書き出す（途中で中断しても壊れないよう一時ファイルから置き換える）
+    """
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def is_done(entry: Dict, video: Path) -> bool:
+    """
+    前回の実行で処理済みで、入力も出力も変わっていないか
+    """
+    if not entry or entry.get('status') != 'done':
+        return False
+    if entry.get('input') != input_signature(video):
+        return False
+    return Path(entry['output']).exists()
+
+
+def process_one(video_path: str, output_dir: str, options: Dict) -> Dict:
+    """
+    1本の動画を処理（ワーカープロセスで実行）
+
+    process-video.py の process_video を呼び出し、ログは出力ディレクトリに書き出す。
+    """
+    spec = importlib.util.spec_from_file_location('process_video', SCRIPT_DIR / 'process-video.py')
+    process_video = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(process_video)
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / OUTPUT_NAME
+
+    cache = StageCache(enabled=options['use_cache'])
+
+    start = time.perf_counter()
+    with open(output_dir / LOG_NAME, 'w', encoding='utf-8') as log, contextlib.redirect_stderr(log):
+        print(f"Processing video: {video_path}", file=sys.stderr)
+        output_data = process_video.process_video(
+            video_path, str(output_path),
+            api_key=options['api_key'],
+            percentile=options['percentile'],
+            aggregate=options['aggregate'],
+            cache=cache,
+            use_local=options['use_local'],
+            whisper_model=options['whisper_model']
+        )
+        cache.report()
+
+    subtitles = output_data['subtitles']
+    return {
+        'output': str(output_path),
+        'subtitles': len(subtitles),
+        'loud': sum(1 for sub in subtitles if sub['style'] == 'loud'),
+        'seconds': round(time.perf_counter() - start, 3)
+    }
+
+
+def run_batch(videos: List[Path], output_root: Path, workers: int, options: Dict,
+              retry_failed: bool = True) -> Dict:
+    """
+    未処理の動画を並列に処理し、1本終わるごとにマニフェストを更新
+
+    Returns:
+        ステータスごとの件数
+    """
+    output_root = output_root.resolve()
+    output_root.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_root / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    files = manifest['files']
+    output_dirs = assign_output_dirs(videos, output_root)
+
+    pending = []
+    for video in videos:
+        key = str(video)
+        entry = files.get(key)
+        if is_done(entry, video):
+            continue
+        if entry and entry.get('status') == 'failed' and not retry_failed:
+            continue
+        # 前回と同じ出力ディレクトリを使い続ける
+        files[key] = {
+            'status': 'pending',
+            'input': input_signature(video),
+            'output_dir': entry['output_dir'] if entry else str(output_dirs[key])
+        }
+        pending.append(video)
+
+    save_manifest(manifest_path, manifest)
+
+    skipped = len(videos) - len(pending)
+    if skipped:
+        print(f"Skipping {skipped} video(s) recorded in the manifest", file=sys.stderr)
+    print(f"Processing {len(pending)} video(s) with {workers} worker(s)", file=sys.stderr)
+
+    # ローカルWhisperは全ワーカーが共有する常駐ワーカーを先に起動しておく
+    if pending and options['use_local']:
+        connect_worker(options['whisper_model']).close()
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+            futures = {}
+            for video in pending:
+                key = str(video)
+                futures[executor.submit(process_one, key, files[key]['output_dir'], options)] = key
+                files[key]['status'] = 'running'
+            save_manifest(manifest_path, manifest)
+
+            for done, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                entry = files[key]
+                try:
+                    entry.update(future.result())
+                    entry['status'] = 'done'
+                    entry.pop('error', None)
+                    print(f"[{done}/{len(pending)}] ✓ {Path(key).name} "
+                          f"({entry['subtitles']} subtitles, {entry['seconds']:.1f}s)", file=sys.stderr)
+                except Exception as e:
+                    entry['status'] = 'failed'
+                    entry['error'] = str(e)
+                    print(f"[{done}/{len(pending)}] ✗ {Path(key).name}: {e}", file=sys.stderr)
+
+                # 中断しても完了分は記録されるよう1本ごとに保存
+                save_manifest(manifest_path, manifest)
+
+    counts = {}
+    for video in videos:
+        status = files[str(video)]['status']
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python batch-process.py <directory_or_glob> [--output-dir DIR] [--workers N] [--api-key KEY] [--percentile N]", file=sys.stderr)
+        print("\nOptions:", file=sys.stderr)
+        print("  --output-dir DIR    Root of the per-video output directories (default: telop-output)", file=sys.stderr)
+        print("  --workers N         Number of videos processed in parallel (default: 2)", file=sys.stderr)
+        print("  --api-key KEY       OpenAI API key for Whisper API", file=sys.stderr)
+        print("  --local             Use one resident local Whisper worker shared by all videos", file=sys.stderr)
+        print(f"  --whisper-model NAME  Local Whisper model (default: {DEFAULT_MODEL})", file=sys.stderr)
+        print("  --percentile N      Volume percentile threshold (default: 75)", file=sys.stderr)
+        print("  --aggregate MODE    Loudness per subtitle: mid (default), max, mean or percentile", file=sys.stderr)
+        print("  --skip-failed       Do not retry videos that failed in a previous run", file=sys.stderr)
+        print("  --no-cache          Do not read or write the stage cache", file=sys.stderr)
+        print("\nQuote glob patterns so the shell does not expand them: 'clips/**/*.mp4'", file=sys.stderr)
+        sys.exit(1)
+
+    pattern = sys.argv[1]
+    output_root = 'telop-output'
+    workers = 2
+    api_key = None
+    percentile = 75.0
+    aggregate = 'mid'
+    retry_failed = True
+    use_cache = True
+    use_local = False
+    whisper_model = DEFAULT_MODEL
+
+    # 引数パース
+    i = 2
+    while i < len(sys.argv):
+        if sys.argv[i] == '--output-dir' and i + 1 < len(sys.argv):
+            output_root = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--workers' and i + 1 < len(sys.argv):
+            workers = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--api-key' and i + 1 < len(sys.argv):
+            api_key = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--local':
+            use_local = True
+            i += 1
+        elif sys.argv[i] == '--whisper-model' and i + 1 < len(sys.argv):
+            whisper_model = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--percentile' and i + 1 < len(sys.argv):
+            percentile = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--aggregate' and i + 1 < len(sys.argv):
+            aggregate = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--skip-failed':
+            retry_failed = False
+            i += 1
+        elif sys.argv[i] == '--no-cache':
+            use_cache = False
+            i += 1
+        else:
+            i += 1
+
+    if aggregate not in AGGREGATIONS:
+        print(f"Error: Unknown aggregation: {aggregate}", file=sys.stderr)
+        sys.exit(1)
+
+    if workers < 1:
+        print("Error: --workers must be at least 1", file=sys.stderr)
+        sys.exit(1)
+
+    videos = find_videos(pattern)
+    if not videos:
+        print(f"Error: No videos found: {pattern}", file=sys.stderr)
+        sys.exit(1)
+
+    options = {
+        'api_key': api_key or os.environ.get('OPENAI_API_KEY'),
+        'percentile': percentile,
+        'aggregate': aggregate,
+        'use_cache': use_cache,
+        'use_local': use_local,
+        'whisper_model': whisper_model
+    }
+
+    counts = run_batch(videos, Path(output_root), workers, options, retry_failed)
+
+    print("=" * 60, file=sys.stderr)
+    print(f"Done: {counts.get('done', 0)}, Failed: {counts.get('failed', 0)}", file=sys.stderr)
+    print(f"Manifest: {Path(output_root) / MANIFEST_NAME}", file=sys.stderr)
+
+    if counts.get('failed'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+キャッシュの共通処理
+音量解析（loudness）・文字起こし（transcripts）・ステージ（stages）・見出しスプライト（sprites）の
+各キャッシュが共有するディレクトリ・キー・書き込み・LRU削除の処理です。
+
+キャッシュは ~/.cache/remotion-telop（TELOP_CACHE_DIR で変更可）の下にキャッシュごとのディレクトリを作ります。
+上限サイズ TELOP_CACHE_MAX_BYTES（デフォルト1GB）はすべてのキャッシュの合計に対するもので、
+超えた場合はキャッシュの種類を問わず最終アクセスが古いエントリから削除します。
+
+エントリは meta.json を含むディレクトリか、1つのファイル（スプライトの PNG）です。
+最終アクセス時刻は meta.json（ファイルの場合はファイル自体）の更新時刻で記録します。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, List
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1GB（全キャッシュの合計）
+CACHE_NAMES = ('loudness', 'transcripts', 'stages', 'sprites')
+
+
+def get_cache_root() -> Path:
+    """
+    キャッシュのルートディレクトリを取得（TELOP_CACHE_DIR で変更可能）
+    """
+    base = os.environ.get('TELOP_CACHE_DIR')
+    if base:
+        return Path(base)
+    return Path.home() / '.cache' / 'remotion-telop'
+
+
+def get_cache_dir(name: str) -> Path:
+    """
+    キャッシュごとのディレクトリを取得
+    """
+    if name not in CACHE_NAMES:
+        raise ValueError(f"Unknown cache: {name} (choose from {', '.join(CACHE_NAMES)})")
+    return get_cache_root() / name
+
+
+def get_max_bytes() -> int:
+    """
+    全キャッシュの合計の上限サイズを取得（TELOP_CACHE_MAX_BYTES で変更可能）
+    """
+    value = os.environ.get('TELOP_CACHE_MAX_BYTES')
+    return int(value) if value else DEFAULT_MAX_BYTES
+
+
+def make_key(payload: Dict) -> str:
+    """
+    JSON にできる値からキャッシュキーを作成
+    """
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]
+
+
+def touch(path: Path) -> None:
+    """
+    LRU用にアクセス時刻を更新
+    """
+    now = time.time()
+    os.utime(path, (now, now))
+
+
+def _access_path(entry_path: Path) -> Path:
+    return entry_path / 'meta.json' if entry_path.is_dir() else entry_path
+
+
+def _entry_size(entry_path: Path) -> int:
+    if entry_path.is_dir():
+        return sum(p.stat().st_size for p in entry_path.iterdir() if p.is_file())
+    return entry_path.stat().st_size
+
+
+def read_meta(entry_path: Path) -> Dict:
+    """
+    ディレクトリのエントリの meta.json を読み込む（読めない場合は空の辞書）
+    """
+    try:
+        with open(entry_path / 'meta.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def list_entries(name: str = None) -> List[Dict]:
+    """
+    キャッシュエントリの一覧（最終アクセスが新しい順、name を省略すると全キャッシュ）
+
+    各エントリは cache・key・path・size・last_access を持つ。
+    """
+    entries = []
+    for cache in ([name] if name else CACHE_NAMES):
+        cache_dir = get_cache_dir(cache)
+        if not cache_dir.exists():
+            continue
+        for path in cache_dir.iterdir():
+            # 書き込み途中の一時ファイル・ディレクトリは除く
+            if path.name.startswith('.'):
+                continue
+            access_path = _access_path(path)
+            try:
+                last_access = access_path.stat().st_mtime
+                size = _entry_size(path)
+            except OSError:
+                continue
+            entries.append({
+                'cache': cache,
+                'key': path.stem,
+                'path': path,
+                'size': size,
+                'last_access': last_access
+            })
+
+    entries.sort(key=lambda e: e['last_access'], reverse=True)
+    return entries
+
+
+def remove_entry(entry: Dict) -> None:
+    if entry['path'].is_dir():
+        shutil.rmtree(entry['path'], ignore_errors=True)
+    else:
+        entry['path'].unlink(missing_ok=True)
+
+
+def evict(max_bytes: int = None, keep: List[Path] = ()) -> List[str]:
+    """
+    全キャッシュの合計サイズが max_bytes 以下になるまで最終アクセスが古いエントリを削除
+
+    keep に指定したエントリ（保存したばかりのもの・これから使うもの）は削除しない。
+    """
+    if max_bytes is None:
+        max_bytes = get_max_bytes()
+    keep = {Path(path) for path in keep}
+    entries = list_entries()
+    total = sum(e['size'] for e in entries)
+    removed = []
+
+    for entry in reversed(entries):
+        if total <= max_bytes:
+            break
+        if entry['path'] in keep:
+            continue
+        remove_entry(entry)
+        total -= entry['size']
+        removed.append(entry['key'])
+
+    return removed
+
+
+def purge(name: str = None) -> int:
+    """
+    キャッシュを削除し（name を省略すると全キャッシュ）、削除したエントリ数を返す
+    """
+    entries = list_entries(name)
+    for entry in entries:
+        remove_entry(entry)
+    return len(entries)
+
+
+@contextmanager
+def write_entry(name: str, key: str):
+    """
+    ディレクトリのエントリを書き込む
+
+    一時ディレクトリを渡し、ブロックを抜けたらエントリの位置にリネームしてから上限を超えた分を削除する
+    （途中で中断しても壊れたエントリを残さない）。ブロック内で meta.json を書くこと。
+    """
+    cache_dir = get_cache_dir(name)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry_dir = cache_dir / key
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f'.{key}-', dir=cache_dir))
+    try:
+        yield tmp_dir
+        if entry_dir.exists():
+            shutil.rmtree(entry_dir)
+        os.rename(tmp_dir, entry_dir)
+    finally:
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    evict(keep=[entry_dir])
+
+
+def write_meta(entry_dir: Path, meta: Dict) -> None:
+    with open(entry_dir / 'meta.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+
+
+def describe(entry: Dict) -> str:
+    """
+    一覧に表示するエントリの説明
+    """
+    path = entry['path']
+    if not path.is_dir():
+        if path.suffix == '.png':
+            from PIL import Image
+            with Image.open(path) as img:
+                caption = img.text.get('caption', '?').replace('\n', ' ')
+                return f"{img.width}x{img.height}  {caption}"
+        return ''
+
+    meta = read_meta(path)
+    parts = []
+    if 'stage' in meta:
+        parts.append(meta['stage'])
+    if 'num_samples' in meta:
+        parts.append(f"{meta['num_samples']} samples")
+    if 'num_segments' in meta:
+        parts.append(f"{meta['num_segments']} segments")
+    if meta.get('params'):
+        parts.append('[' + ', '.join(f"{k}={v}" for k, v in sorted(meta['params'].items())) + ']')
+    if 'source' in meta:
+        parts.append(meta['source'])
+    return '  '.join(str(part) for part in parts)
+
+
+def main(name: str = None, argv: List[str] = None):
+    """
+    list / purge / evict コマンド（各キャッシュのスクリプトは name を指定して呼ぶ）
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    script = Path(sys.argv[0]).name
+    if not argv or argv[0] not in ('list', 'purge', 'evict'):
+        target = f"{name} cache" if name else 'all caches'
+        print(f"Usage: python {script} <list|purge|evict> [--max-size MB]"
+              + ('' if name else ' [--cache NAME]'), file=sys.stderr)
+        print("\nCommands:", file=sys.stderr)
+        print(f"  list             Show entries of {target} (most recently used first)", file=sys.stderr)
+        print(f"  purge            Delete all entries of {target}", file=sys.stderr)
+        print("  evict            Delete least recently used entries (of any cache) above the size limit",
+              file=sys.stderr)
+        print("\nOptions:", file=sys.stderr)
+        print("  --max-size MB    Total size limit of all caches for evict "
+              "(default: TELOP_CACHE_MAX_BYTES or 1024MB)", file=sys.stderr)
+        if not name:
+            print(f"  --cache NAME     Only list/purge one cache ({', '.join(CACHE_NAMES)})", file=sys.stderr)
+        sys.exit(1)
+
+    command = argv[0]
+    max_bytes = get_max_bytes()
+
+    # 引数パース
+    i = 1
+    while i < len(argv):
+        if argv[i] == '--max-size' and i + 1 < len(argv):
+            max_bytes = int(float(argv[i + 1]) * 1024 * 1024)
+            i += 2
+        elif argv[i] == '--cache' and i + 1 < len(argv) and name is None:
+            name = argv[i + 1]
+            i += 2
+        else:
+            i += 1
+
+    try:
+        cache_dir = get_cache_dir(name) if name else get_cache_root()
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Cache directory: {cache_dir}", file=sys.stderr)
+
+    if command == 'list':
+        entries = list_entries(name)
+        for entry in entries:
+            accessed = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_access']))
+            print(f"{entry['key'][:12]}  {entry['cache']:<12} {entry['size'] / 1024 / 1024:8.2f}MB  {accessed}  "
+                  f"{describe(entry)}")
+        total = sum(e['size'] for e in list_entries())
+        print(f"{len(entries)} entries, all caches {total / 1024 / 1024:.2f}MB / {max_bytes / 1024 / 1024:.0f}MB",
+              file=sys.stderr)
+
+    elif command == 'purge':
+        count = purge(name)
+        print(f"Removed {count} entries", file=sys.stderr)
+
+    elif command == 'evict':
+        removed = evict(max_bytes)
+        print(f"Removed {len(removed)} entries", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+見出し・テロップのスプライト（RGBA画像）の描画とキャッシュ
+テキストのバウンディングボックスを縁取りを含めて正確に測り、背景と余白の分だけの最小のキャンバスに描画します。
+縁取りは Pillow の stroke で1回で描画します（ずらして何度も描く必要がありません）。
+
+描画したスプライトはテキスト・フォント・色・サイズなどのハッシュをキーとして
+~/.cache/remotion-telop/sprites（TELOP_CACHE_DIR で変更可）に PNG で保存し、
+同じ見出しの再描画（再実行や一括処理）では保存済みの PNG をそのまま使います。
+"""
+
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
+
+import cache_store
+
+CACHE_NAME = 'sprites'
+CACHE_VERSION = 1
+FONT_FILE = '/home/lasuone/.fonts/NotoSansJP.ttf'
+
+# render_caption の既定値（キャッシュキーにも同じ値を使う）
+SPRITE_DEFAULTS = {
+    'font_size': 84,
+    'text_color': '#ffffff',
+    'bg_color': '#ff0000',
+    'stroke_width': 2,
+    'stroke_color': '#000000',
+    'padding': 30,
+    'corner_radius': 25,
+    'font_path': FONT_FILE,
+    'spacing': 4,
+    'line_height': None
+}
+
+# 測定用の描画先（キャンバスの大きさは測定に影響しない）
+_MEASURE = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+
+
+def hex_to_rgba(color) -> Optional[Tuple[int, int, int, int]]:
+    """
+    #rrggbb / #rrggbbaa / (r, g, b[, a]) -> (r, g, b, a)（None はそのまま）
+    """
+    if color is None:
+        return None
+    if isinstance(color, (tuple, list)):
+        return tuple(color) + (255,) * (4 - len(color))
+    color = color.lstrip('#')
+    alpha = int(color[6:8], 16) if len(color) == 8 else 255
+    return (int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16), alpha)
+
+
+def load_font(font_path: str, font_size: int):
+    """
+    フォントを読み込む（見つからない場合は Pillow の既定のフォント）
+    """
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except OSError:
+        return ImageFont.load_default(font_size)
+
+
+def measure_text(text: str, font, stroke_width: int = 0, spacing: int = 4) -> Tuple[int, int, int, int]:
+    """
+    縁取りを含めたテキストのインクの範囲 (left, top, right, bottom)（(0, 0) に描画した場合の座標）
+    """
+    return _MEASURE.multiline_textbbox((0, 0), text, font=font, stroke_width=stroke_width,
+                                       spacing=spacing, align='center')
+
+
+def render_caption(text: str, font_size: int = SPRITE_DEFAULTS['font_size'],
+                   text_color=SPRITE_DEFAULTS['text_color'], bg_color=SPRITE_DEFAULTS['bg_color'],
+                   stroke_width: int = SPRITE_DEFAULTS['stroke_width'], stroke_color=SPRITE_DEFAULTS['stroke_color'],
+                   padding=SPRITE_DEFAULTS['padding'], corner_radius: int = SPRITE_DEFAULTS['corner_radius'],
+                   font_path: str = SPRITE_DEFAULTS['font_path'], spacing: int = SPRITE_DEFAULTS['spacing'],
+                   line_height: float = SPRITE_DEFAULTS['line_height']) -> Image.Image:
+    """
+    テキストを描画した最小の大きさの RGBA 画像を作成
+
+    キャンバスはテキスト（縁取りを含む）の範囲に padding（上下左右、または (左右, 上下)）を足した大きさ。
+    line_height を指定すると、CSS の line-height と同じく1行の高さを font_size * line_height にする
+    （文字によって背景の高さが変わらない）。bg_color が None なら背景を描かない（透明）。
+    """
+    font = load_font(font_path, font_size)
+    pad_x, pad_y = padding if isinstance(padding, (tuple, list)) else (padding, padding)
+    text_color = hex_to_rgba(text_color)
+    stroke_color = hex_to_rgba(stroke_color)
+
+    if line_height:
+        lines = text.split('\n')
+        boxes = [measure_text(line, font, stroke_width) for line in lines]
+        left = min(box[0] for box in boxes)
+        right = max(box[2] for box in boxes)
+        line_step = font_size * line_height
+        width = right - left + pad_x * 2
+        height = round(line_step * len(lines)) + pad_y * 2
+    else:
+        left, top, right, bottom = measure_text(text, font, stroke_width, spacing)
+        width = right - left + pad_x * 2
+        height = bottom - top + pad_y * 2
+
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+
+    # 角丸の背景
+    if bg_color is not None:
+        draw.rounded_rectangle([(0, 0), (width - 1, height - 1)], radius=corner_radius,
+                               fill=hex_to_rgba(bg_color))
+
+    if line_height:
+        # 各行を中央揃えにし、行の高さの中央にフォントの ascent + descent を置く
+        ascent, descent = font.getmetrics()
+        for i, (line, box) in enumerate(zip(lines, boxes)):
+            x = pad_x + (right - left - (box[2] - box[0])) // 2 - box[0]
+            y = pad_y + round(i * line_step + (line_step - ascent - descent) / 2)
+            draw.text((x, y), line, font=font, fill=text_color,
+                      stroke_width=stroke_width, stroke_fill=stroke_color)
+    else:
+        # 縁取りと文字を1回で描画（インクの左上が余白の位置に来るようにずらす）
+        draw.multiline_text((pad_x - left, pad_y - top), text, font=font, fill=text_color,
+                            stroke_width=stroke_width, stroke_fill=stroke_color,
+                            spacing=spacing, align='center')
+
+    return img
+
+
+def sprite_params(text: str, **options) -> Dict:
+    """
+    キャッシュキーに使う描画パラメータ（既定値を補い、色を正規化し、フォントファイルの指紋を加える）
+    """
+    params = dict(SPRITE_DEFAULTS)
+    unknown = set(options) - set(params)
+    if unknown:
+        raise TypeError(f"Unknown sprite options: {', '.join(sorted(unknown))}")
+    params.update(options)
+
+    for key in ('text_color', 'bg_color', 'stroke_color'):
+        params[key] = hex_to_rgba(params[key])
+    if isinstance(params['padding'], tuple):
+        params['padding'] = list(params['padding'])
+
+    # 同じパスのフォントが差し替えられた場合は別のキーにする
+    try:
+        stat = os.stat(params['font_path'])
+        font = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    except OSError:
+        font = None
+
+    return {'text': text, **params, 'font': font}
+
+
+def make_cache_key(params: Dict) -> str:
+    """
+    描画パラメータからキャッシュキーを作成
+    """
+    return cache_store.make_key({'version': CACHE_VERSION, 'params': params})
+
+
+def sprite_path(text: str, **options) -> Path:
+    """
+    スプライトの PNG のパス（キャッシュになければ描画して保存する）
+
+    options は render_caption の引数。上限を超えた分の削除はしないので、
+    描画し終えたら呼び出し側で cache_store.evict を1回呼ぶこと。
+    """
+    params = sprite_params(text, **options)
+    key = make_cache_key(params)
+    cache_dir = cache_store.get_cache_dir(CACHE_NAME)
+    path = cache_dir / f"{key}.png"
+
+    if path.exists():
+        cache_store.touch(path)
+        return path
+
+    img = render_caption(text, **options)
+    info = PngInfo()
+    info.add_text('caption', text)
+
+    # 一時ファイルに書いてからリネーム（並行に描画しても壊れたファイルを残さない）
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{key}-', suffix='.png', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, 'PNG', pnginfo=info)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    return path
+
+
+if __name__ == '__main__':
+    cache_store.main(CACHE_NAME)
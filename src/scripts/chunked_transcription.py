@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+分割・並行文字起こし
+Whisper APIのアップロード上限を超えないように、音量の小さい位置で音声を分割し、
+各チャンクを asyncio で並行に文字起こししてから、時刻をずらして1つの結果にまとめます。
+チャンクは抽出済みのWAVから切り出すか、一時ファイルを作らずにffmpegのパイプで
+FLAC / Opus に圧縮してそのまま送信します。
+"""
+
+import io
+import sys
+import wave
+import asyncio
+import numpy as np
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import tracing
+import loudness_cache
+from audio_source import ASR_SAMPLE_RATE, UPLOAD_FORMATS, encode_command, iter_wav_blocks, probe_duration, wav_info
+
+API_MAX_UPLOAD_BYTES = 25 * 1024 * 1024  # Whisper APIのファイルサイズ上限
+UPLOAD_SIZE_MARGIN = 0.9  # 上限に対してこの割合までに収める
+SPLIT_SEARCH_FRACTION = 0.2  # チャンク末尾のこの割合の範囲から最も静かな位置を探す
+LEVEL_WINDOW_SECONDS = 0.1  # 分割位置を探すための音量の分析間隔
+DEFAULT_CONCURRENCY = 4
+WAV_HEADER_BYTES = 44
+
+
+def wav_levels(wav_path: str, interval: float = LEVEL_WINDOW_SECONDS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    WAVの interval 秒ごとのRMS（dB）を計算
+
+    Returns:
+        (timestamps, rms_db) の配列
+    """
+    sample_rate = wav_info(wav_path)['sample_rate']
+    window = max(1, int(round(interval * sample_rate)))
+
+    rms_blocks = []
+    for block in iter_wav_blocks(wav_path, window * 1024):
+        full = len(block) // window * window
+        frames = block[:full].reshape(-1, window).astype(np.float64)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        if full < len(block):
+            tail = block[full:].astype(np.float64)
+            rms = np.append(rms, np.sqrt(np.mean(tail * tail)))
+        rms_blocks.append(rms)
+
+    rms = np.concatenate(rms_blocks) if rms_blocks else np.empty(0)
+    timestamps = np.arange(len(rms), dtype=np.float64) * (window / sample_rate)
+    return timestamps, 20 * np.log10(np.maximum(rms, 1e-6))
+
+
+def cached_levels(video_path: str, sample_rate: int = ASR_SAMPLE_RATE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    analyze-audio.py が同じ動画を解析済みなら loudness_cache の (timestamps, rms_db) を返す（なければ None）
+    """
+    params = {'engine': 'pcm', 'interval': LEVEL_WINDOW_SECONDS, 'sample_rate': sample_rate}
+    cached = loudness_cache.load(video_path, params)
+    if cached is not None:
+        print("Using cached RMS data to find split points", file=sys.stderr)
+    return cached
+
+
+def load_levels(wav_path: str, video_path: str = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    分割位置を探すための音量データを取得（キャッシュがなければWAVから計算）
+    """
+    if video_path:
+        cached = cached_levels(video_path, wav_info(wav_path)['sample_rate'])
+        if cached is not None:
+            return cached
+    return wav_levels(wav_path)
+
+
+def max_chunk_seconds(info: Dict, max_bytes: int = API_MAX_UPLOAD_BYTES) -> float:
+    """
+    アップロード上限に収まるWAVチャンクの最大長（秒）
+    """
+    bytes_per_second = info['sample_rate'] * info['channels'] * info['sample_width']
+    return (max_bytes * UPLOAD_SIZE_MARGIN - WAV_HEADER_BYTES) / bytes_per_second
+
+
+def plan_chunks(duration: float, max_seconds: float, timestamps: np.ndarray = None,
+                rms_db: np.ndarray = None, search_fraction: float = SPLIT_SEARCH_FRACTION) -> List[Tuple[float, float]]:
+    """
+    音声を max_seconds 以下のチャンクに分割する位置を決める
+
+    各チャンクの末尾 search_fraction の範囲で最もRMSが小さい窓の位置で区切る。
+    音量データがない場合は max_seconds ごとに区切る。
+
+    Returns:
+        (start, end) 秒のリスト
+    """
+    if duration <= max_seconds:
+        return [(0.0, duration)]
+
+    has_levels = timestamps is not None and len(timestamps) > 0
+    if has_levels:
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        rms_db = np.asarray(rms_db, dtype=np.float64)
+        step = float(timestamps[1] - timestamps[0]) if len(timestamps) > 1 else 0.0
+
+    chunks = []
+    start = 0.0
+    while duration - start > max_seconds:
+        limit = start + max_seconds
+        cut = limit
+
+        if has_levels:
+            # 探索範囲に完全に収まる窓のうち最も静かな窓の中央で区切る
+            lo = np.searchsorted(timestamps, limit - max_seconds * search_fraction, side='left')
+            hi = np.searchsorted(timestamps, limit - step, side='right')
+            if hi > lo:
+                quietest = lo + int(np.argmin(rms_db[lo:hi]))
+                cut = float(timestamps[quietest]) + step / 2
+
+        chunks.append((start, cut))
+        start = cut
+
+    chunks.append((start, duration))
+    return chunks
+
+
+def read_wav_chunk(wav_path: str, start: float, end: float) -> bytes:
+    """
+    WAVの [start, end) 秒を切り出し、WAV形式のバイト列として返す
+    """
+    with wave.open(wav_path, 'rb') as src:
+        sample_rate = src.getframerate()
+        first = int(round(start * sample_rate))
+        last = min(int(round(end * sample_rate)), src.getnframes())
+        src.setpos(first)
+        frames = src.readframes(max(0, last - first))
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as dst:
+            dst.setnchannels(src.getnchannels())
+            dst.setsampwidth(src.getsampwidth())
+            dst.setframerate(sample_rate)
+            dst.writeframes(frames)
+
+    return buffer.getvalue()
+
+
+def merge_transcripts(results: List[Dict], chunks: List[Tuple[float, float]]) -> Dict:
+    """
+    チャンクごとの verbose_json をチャンクの開始時刻だけずらして結合
+    """
+    segments = []
+    words = []
+    texts = []
+
+    for result, (offset, _) in zip(results, chunks):
+        texts.append((result.get('text') or '').strip())
+
+        for segment in result.get('segments') or []:
+            segments.append({
+                **segment,
+                'id': len(segments),
+                'start': segment['start'] + offset,
+                'end': segment['end'] + offset
+            })
+
+        for word in result.get('words') or []:
+            words.append({
+                **word,
+                'start': word['start'] + offset,
+                'end': word['end'] + offset
+            })
+
+    merged = {
+        'text': ''.join(texts),
+        'language': results[0].get('language') if results else None,
+        'duration': chunks[-1][1] if chunks else 0.0,
+        'segments': segments
+    }
+    if words:
+        merged['words'] = words
+    return merged
+
+
+async def encode_chunk(source_path: str, upload_format: str, start: float = None, duration: float = None) -> bytes:
+    """
+    ffmpegで区間を圧縮し、パイプから受け取ったバイト列を返す（一時ファイルを作らない）
+
+    stdout を HTTP クライアントへ流さずにすべて受け取るのは意図的なもの。openai の multipart アップロードは
+    バイト列か長さの分かるファイルしか受け付けず（Content-Length が必要）、エンコード後の大きさが分からないと
+    アップロード上限も確かめられない。1チャンクはアップロード上限以下で、メモリに載るのは同時実行数分のみ。
+    """
+    cmd = encode_command(source_path, upload_format, start, duration)
+    with tracing.span('ffmpeg-encode', cat='subprocess', format=upload_format, start=start or 0.0) as sp:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE)
+        data, stderr = await proc.communicate()
+        sp.set(bytes=len(data), returncode=proc.returncode)
+
+    if proc.returncode != 0:
+        raise Exception(f"Audio encoding failed: {stderr.decode('utf-8', errors='replace')}")
+    return data
+
+
+# (index, start, end) からアップロードする (ファイル名, バイト列, MIMEタイプ) を作る関数
+ChunkLoader = Callable[[int, float, float], Awaitable[Tuple[str, bytes, str]]]
+
+
+async def transcribe_chunks_async(chunks: List[Tuple[float, float]], load_chunk: ChunkLoader, api_key: str,
+                                  language: str = 'ja', model: str = 'whisper-1', base_url: str = None,
+                                  concurrency: int = DEFAULT_CONCURRENCY) -> List[Dict]:
+    """
+    チャンクを共有の非同期クライアントで並行に文字起こし（同時実行数は concurrency まで）
+    """
+    import openai
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async with openai.AsyncOpenAI(api_key=api_key, base_url=base_url) as client:
+        async def transcribe(index: int, start: float, end: float) -> Dict:
+            async with semaphore:
+                # 送信直前に用意するので、メモリに載るのは同時実行数分のチャンクのみ
+                upload = await load_chunk(index, start, end)
+                transcript = await client.audio.transcriptions.create(
+                    model=model,
+                    file=upload,
+                    language=language,
+                    response_format='verbose_json',
+                    timestamp_granularities=['segment', 'word']
+                )
+                print(f"Transcribed chunk {index + 1}/{len(chunks)} ({start:.1f}s - {end:.1f}s, "
+                      f"{len(upload[1]) / 1024 / 1024:.1f}MB)", file=sys.stderr)
+                return transcript.model_dump()
+
+        return await asyncio.gather(*(transcribe(i, start, end) for i, (start, end) in enumerate(chunks)))
+
+
+def transcribe_wav_chunked(wav_path: str, api_key: str, language: str = 'ja', model: str = 'whisper-1',
+                           base_url: str = None, concurrency: int = DEFAULT_CONCURRENCY,
+                           max_bytes: int = API_MAX_UPLOAD_BYTES, video_path: str = None) -> Dict:
+    """
+    WAVをアップロード上限以下のチャンクに分割して並行に文字起こし
+
+    Args:
+        wav_path: audio_source.py で抽出した16-bit PCM WAV
+        base_url: APIのベースURL（ローカルの代替サーバーでのテスト用。None ならデフォルト）
+        video_path: 元の動画（解析済みの音量データを分割位置の決定に使う）
+    Returns:
+        Whisper API の verbose_json と同じ形式の辞書（segments / words の時刻は元の音声基準）
+    """
+    info = wav_info(wav_path)
+    max_seconds = max_chunk_seconds(info, max_bytes)
+
+    timestamps = rms_db = None
+    if info['duration'] > max_seconds:
+        timestamps, rms_db = load_levels(wav_path, video_path)
+
+    chunks = plan_chunks(info['duration'], max_seconds, timestamps, rms_db)
+    if len(chunks) > 1:
+        print(f"Splitting audio into {len(chunks)} chunks at quiet points", file=sys.stderr)
+
+    async def load_chunk(index: int, start: float, end: float) -> Tuple[str, bytes, str]:
+        # 切り出しはファイルI/Oなのでスレッドで行う
+        data = await asyncio.to_thread(read_wav_chunk, wav_path, start, end)
+        return f'chunk-{index:04d}.wav', data, 'audio/wav'
+
+    results = asyncio.run(transcribe_chunks_async(chunks, load_chunk, api_key, language, model,
+                                                  base_url, concurrency))
+    return merge_transcripts(results, chunks)
+
+
+def transcribe_encoded_chunked(source_path: str, api_key: str, upload_format: str = 'flac', language: str = 'ja',
+                               model: str = 'whisper-1', base_url: str = None,
+                               concurrency: int = DEFAULT_CONCURRENCY, max_bytes: int = API_MAX_UPLOAD_BYTES,
+                               video_path: str = None) -> Dict:
+    """
+    音声をffmpegのパイプで FLAC / Opus に圧縮しながら並行に文字起こし
+
+    source_path は動画でも抽出済みのWAVでもよい（一時WAVは作らない）。
+    チャンク長は UPLOAD_FORMATS の1秒あたりのサイズの上限から決めるので、
+    圧縮後のチャンクは必ずアップロード上限に収まる。
+    分割位置は音声解析キャッシュがあればその静かな位置、なければ等間隔。
+    """
+    if upload_format not in UPLOAD_FORMATS:
+        raise Exception(f"Unknown upload format: {upload_format} (choose from wav, {', '.join(UPLOAD_FORMATS)})")
+
+    fmt = UPLOAD_FORMATS[upload_format]
+    duration = probe_duration(source_path)
+    max_seconds = max_bytes * UPLOAD_SIZE_MARGIN / fmt['max_bytes_per_second']
+
+    timestamps = rms_db = None
+    if duration > max_seconds:
+        cached = cached_levels(video_path or source_path)
+        if cached is not None:
+            timestamps, rms_db = cached
+        elif source_path.lower().endswith('.wav'):
+            timestamps, rms_db = wav_levels(source_path)
+
+    chunks = plan_chunks(duration, max_seconds, timestamps, rms_db)
+    if len(chunks) > 1:
+        where = 'quiet points' if timestamps is not None else 'fixed intervals'
+        print(f"Splitting audio into {len(chunks)} chunks at {where}", file=sys.stderr)
+
+    async def load_chunk(index: int, start: float, end: float) -> Tuple[str, bytes, str]:
+        if len(chunks) == 1:
+            data = await encode_chunk(source_path, upload_format)
+        else:
+            data = await encode_chunk(source_path, upload_format, start, end - start)
+        return f"chunk-{index:04d}{fmt['suffix']}", data, fmt['mime']
+
+    results = asyncio.run(transcribe_chunks_async(chunks, load_chunk, api_key, language, model,
+                                                  base_url, concurrency))
+    return merge_transcripts(results, chunks)
@@ -5,158 +5,97 @@ OpenAI Whisper APIを使用して動画から字幕を自動生成します。
 """
 
 import sys
-import json
 import os
-import subprocess
 import tempfile
+import importlib.util
 from pathlib import Path
 from typing import List, Dict, Optional
 
-# OpenAI APIが利用可能かチェック
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+import tracing
+import subtitle_io
+import transcript_cache
+from segmentation import split_text, split_texts
+from subtitle_table import SubtitleTable
+from audio_source import UPLOAD_FORMATS, acquire_audio
+from chunked_transcription import DEFAULT_CONCURRENCY, transcribe_encoded_chunked, transcribe_wav_chunked
+from whisper_worker import DEFAULT_MODEL, connect_worker
+
+# OpenAI APIが利用可能かチェック（使うのは chunked_transcription なのでここでは読み込まない）
+OPENAI_AVAILABLE = importlib.util.find_spec('openai') is not None
+if not OPENAI_AVAILABLE:
     print("Warning: openai package not found. Install with: pip install openai", file=sys.stderr)
 
 
 def extract_audio(video_path: str, output_path: str) -> None:
     """
-    動画から音声を抽出
+    動画から音声を抽出（16kHzモノラルPCM、Whisper推奨）
     """
-    cmd = [
-        'ffmpeg',
-        '-i', video_path,
-        '-vn',  # 映像なし
-        '-acodec', 'pcm_s16le',  # PCM 16-bit
-        '-ar', '16000',  # 16kHz（Whisper推奨）
-        '-ac', '1',  # モノラル
-        '-y',  # 上書き
-        output_path
-    ]
-
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise Exception(f"Audio extraction failed: {result.stderr}")
-
-
-def transcribe_with_whisper_api(audio_path: str, api_key: str, language: str = 'ja') -> Dict:
+    acquire_audio(video_path, output_path)
+
+
+@tracing.traced('whisper-api', cat='asr')
+def transcribe_with_whisper_api(audio_path: str, api_key: str, language: str = 'ja', base_url: str = None,
+                                concurrency: int = DEFAULT_CONCURRENCY, video_path: str = None,
+                                upload_format: str = 'wav') -> Dict:
     """
     Whisper APIで音声を文字起こし
+
+    アップロード上限を超える音声は静かな位置で分割し、チャンクを並行に送信する。
+    base_url を指定すると（または OPENAI_BASE_URL 環境変数）互換サーバーに送信する。
+    upload_format が flac / opus の場合、audio_path は動画でもよく、パイプで圧縮しながら送信する。
     """
     if not OPENAI_AVAILABLE:
         raise Exception("OpenAI package not installed")
 
-    client = openai.OpenAI(api_key=api_key)
+    base_url = base_url or os.environ.get('OPENAI_BASE_URL') or None
 
-    with open(audio_path, 'rb') as audio_file:
-        transcript = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            language=language,
-            response_format="verbose_json"
-        )
+    if upload_format == 'wav':
+        return transcribe_wav_chunked(audio_path, api_key, language, base_url=base_url,
+                                      concurrency=concurrency, video_path=video_path)
 
-    # TranscriptionVerboseオブジェクトを辞書に変換
-    return transcript.model_dump()
+    return transcribe_encoded_chunked(audio_path, api_key, upload_format, language, base_url=base_url,
+                                      concurrency=concurrency, video_path=video_path)
 
 
-def transcribe_with_whisper_local(audio_path: str, model: str = 'base') -> Dict:
+def transcribe_with_whisper_local(audio_path: str, model: str = DEFAULT_MODEL, language: str = 'ja') -> Dict:
     """
-    ローカルのWhisperで文字起こし（whisperコマンドが必要）
-    """
-    cmd = [
-        'whisper',
-        audio_path,
-        '--model', model,
-        '--language', 'Japanese',
-        '--output_format', 'json',
-        '--output_dir', tempfile.gettempdir()
-    ]
-
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise Exception(f"Whisper transcription failed: {result.stderr}")
+    ローカルのWhisperで文字起こし
 
-    # JSONファイルを読み込み
-    json_path = Path(audio_path).with_suffix('.json')
-    with open(json_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    モデルを読み込んだ常駐ワーカー（whisper_worker.py）に送り、起動していなければ起動する。
+    2回目以降はモデルの読み込みなしで結果が返る。
+    """
+    with connect_worker(model) as client:
+        return client.transcribe(audio_path, language)
 
 
 def split_text_japanese(text: str, max_length: int = 20) -> List[str]:
     """
-    日本語テキストを自然な単位で分割
+    日本語テキストを自然な単位で分割（segmentation.py の形態素単位の分割）
     """
-    try:
-        from janome.tokenizer import Tokenizer
-        tokenizer = Tokenizer()
-
-        # 形態素解析
-        tokens = list(tokenizer.tokenize(text, wakati=True))
-
-        chunks = []
-        current_chunk = ""
-
-        for token in tokens:
-            if len(current_chunk) + len(token) <= max_length:
-                current_chunk += token
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = token
+    return split_text(text, max_length, 'morpheme')
 
-        if current_chunk:
-            chunks.append(current_chunk)
 
-        return chunks
-
-    except ImportError:
-        # Janomeがない場合は単純分割
-        print("Warning: janome not found, using simple splitting", file=sys.stderr)
-        chunks = []
-        for i in range(0, len(text), max_length):
-            chunks.append(text[i:i + max_length])
-        return chunks
-
-
-def create_subtitle_entries(transcript: Dict, max_chars_per_line: int = 20) -> List[Dict]:
+def create_subtitle_entries(transcript: Dict, max_chars_per_line: int = 20, workers: int = 1) -> List[Dict]:
     """
     トランスクリプトから字幕エントリを作成
+
+    長いセグメントはまとめて形態素解析する（workers が2以上ならプロセスプールで）。
     """
     subtitles = []
     entry_id = 1
 
     # segmentsがある場合
     if 'segments' in transcript:
-        for segment in transcript['segments']:
-            text = segment['text'].strip()
-            start_time = segment['start']
-            end_time = segment['end']
-
-            # テキストが長い場合は分割
-            if len(text) > max_chars_per_line:
-                chunks = split_text_japanese(text, max_chars_per_line)
-                duration = end_time - start_time
-                chunk_duration = duration / len(chunks)
-
-                for i, chunk in enumerate(chunks):
-                    subtitles.append({
-                        'id': entry_id,
-                        'startTime': start_time + (i * chunk_duration),
-                        'endTime': start_time + ((i + 1) * chunk_duration),
-                        'text': chunk
-                    })
-                    entry_id += 1
-            else:
-                subtitles.append({
-                    'id': entry_id,
-                    'startTime': start_time,
-                    'endTime': end_time,
-                    'text': text
-                })
-                entry_id += 1
+        texts = [segment['text'].strip() for segment in transcript['segments']]
+        long_texts = [text for text in texts if len(text) > max_chars_per_line]
+        split_map = dict(zip(long_texts, split_texts(long_texts, max_chars_per_line, 'morpheme', workers)))
+
+        # テキストが長い場合は分割し、セグメントの時間を均等に配分
+        segments = transcript['segments']
+        table = SubtitleTable([segment['start'] for segment in segments], [segment['end'] for segment in segments],
+                              texts)
+        table = table.split([split_map[text] if len(text) > max_chars_per_line else [text] for text in texts])
+        subtitles = table.renumber(entry_id).to_dicts()
 
     # wordsがある場合（より細かい制御）
     elif 'words' in transcript:
@@ -206,46 +145,153 @@ def create_subtitle_entries(transcript: Dict, max_chars_per_line: int = 20) -> L
     return subtitles
 
 
-def export_srt(subtitles: List[Dict], output_path: str) -> None:
+def transcribe_video(video_path: str, api_key: str = None, use_local: bool = False,
+                     audio_path: str = None, base_url: str = None,
+                     concurrency: int = DEFAULT_CONCURRENCY, whisper_model: str = DEFAULT_MODEL,
+                     upload_format: str = 'wav') -> Dict:
     """
-    SRT形式で出力
+    動画を文字起こしして生の結果（verbose_json）を返す
+
+    audio_path に audio_source.py で抽出済みのWAVを渡すと再デコードしない。
+    upload_format を flac / opus にするとWhisper APIへは圧縮して送信し、一時WAVを作らない
+    （ローカルWhisperは常にWAVを使う）。
     """
-    with open(output_path, 'w', encoding='utf-8') as f:
-        for sub in subtitles:
-            start = format_timestamp_srt(sub['startTime'])
-            end = format_timestamp_srt(sub['endTime'])
+    if not use_local and not api_key:
+        raise Exception("No API key provided and --local not specified")
+
+    if upload_format != 'wav' and upload_format not in UPLOAD_FORMATS:
+        raise Exception(f"Unknown upload format: {upload_format} (choose from wav, {', '.join(UPLOAD_FORMATS)})")
+
+    shared_audio_path = audio_path
+    needs_wav = use_local or upload_format == 'wav'
+    if not shared_audio_path and needs_wav:
+        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_audio:
+            audio_path = tmp_audio.name
+
+    try:
+        if shared_audio_path:
+            print(f"Using extracted audio: {audio_path}", file=sys.stderr)
+        elif needs_wav:
+            print("Extracting audio...", file=sys.stderr)
+            extract_audio(video_path, audio_path)
+
+        # 文字起こし
+        print("Transcribing audio...", file=sys.stderr)
+        if use_local:
+            return transcribe_with_whisper_local(audio_path, whisper_model)
 
-            f.write(f"{sub['id']}\n")
-            f.write(f"{start} --> {end}\n")
-            f.write(f"{sub['text']}\n")
-            f.write("\n")
+        # 圧縮アップロードでWAVがなければ動画から直接エンコードする
+        return transcribe_with_whisper_api(audio_path or video_path, api_key, base_url=base_url,
+                                           concurrency=concurrency, video_path=video_path,
+                                           upload_format=upload_format)
+
+    finally:
+        # 一時ファイルを削除（共有された音声は呼び出し元が管理する）
+        if not shared_audio_path and audio_path and Path(audio_path).exists():
+            Path(audio_path).unlink()
 
 
-def format_timestamp_srt(seconds: float) -> str:
+def build_subtitle_data(video_path: str, transcript: Dict, max_chars_per_line: int = 20) -> Dict:
     """
-    秒をSRT形式のタイムスタンプに変換
+    文字起こし結果から字幕データ（generate-subtitles.py のJSON出力と同じ形式）を作成
     """
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = int(seconds % 60)
-    millis = int((seconds % 1) * 1000)
+    print("Creating subtitle entries...", file=sys.stderr)
+    with tracing.span('create-subtitle-entries', cat='text') as sp:
+        subtitles = create_subtitle_entries(transcript, max_chars_per_line)
+        sp.set(segments=len(transcript.get('segments', [])), entries=len(subtitles))
+
+    print(f"Generated {len(subtitles)} subtitle entries", file=sys.stderr)
+
+    return {
+        'video_path': video_path,
+        'subtitles': subtitles
+    }
 
-    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+def generate_subtitles(video_path: str, api_key: str = None, use_local: bool = False,
+                       audio_path: str = None, base_url: str = None,
+                       concurrency: int = DEFAULT_CONCURRENCY, whisper_model: str = DEFAULT_MODEL,
+                       upload_format: str = 'wav', max_chars_per_line: int = 20,
+                       use_cache: bool = True, refresh_cache: bool = False) -> Dict:
+    """
+    動画から字幕データを生成（process-video.py などからインポートして使うステージ関数）
+
+    生の文字起こし結果は transcript_cache に保存され、同じ音声・モデル・言語なら
+    文字起こしせずに字幕の分割だけをやり直す（use_cache=False で読み書きしない、
+    refresh_cache=True でキャッシュを読まずに文字起こしして置き換える）。
+
+    Returns:
+        video_path と subtitles を持つ辞書（generate-subtitles.py のJSON出力と同じ形式）
+    """
+    params = transcript_cache.transcription_params(use_local, whisper_model, upload_format)
+
+    transcript = None
+    if use_cache and not refresh_cache:
+        with tracing.span('transcript-cache-load', cat='cache') as sp:
+            transcript = transcript_cache.load(video_path, params)
+            sp.set(hit=transcript is not None)
+
+    if transcript is not None:
+        print(f"Loaded transcript from cache ({len(transcript.get('segments') or [])} segments)", file=sys.stderr)
+    else:
+        transcript = transcribe_video(video_path, api_key, use_local, audio_path, base_url, concurrency,
+                                      whisper_model, upload_format)
+        if use_cache:
+            try:
+                transcript_cache.store(video_path, params, transcript)
+            except OSError as e:
+                print(f"Warning: Failed to write transcript cache: {e}", file=sys.stderr)
+
+    return build_subtitle_data(video_path, transcript, max_chars_per_line)
+
+
+def write_subtitle_files(output_data: Dict, output_path: str) -> None:
+    """
+    字幕データをJSONと、同じ名前のSRTに書き出す
+    """
+    subtitles = output_data['subtitles']
+
+    # JSON形式で出力
+    with tracing.span('write-json', cat='io', entries=len(subtitles)):
+        subtitle_io.write_json(output_data, output_path)
+
+    print(f"Subtitles saved to: {output_path}", file=sys.stderr)
+
+    # SRT形式でも出力
+    srt_path = Path(output_path).with_suffix('.srt')
+    subtitle_io.write_srt(subtitles, srt_path)
+    print(f"SRT subtitles saved to: {srt_path}", file=sys.stderr)
 
 
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python generate-subtitles.py <video_path> [--api-key KEY] [--local] [--output OUTPUT]", file=sys.stderr)
+        print("Usage: python generate-subtitles.py <video_path> [--api-key KEY] [--local] [--output OUTPUT] [--audio WAV]", file=sys.stderr)
         print("\nOptions:", file=sys.stderr)
         print("  --api-key KEY    OpenAI API key for Whisper API", file=sys.stderr)
-        print("  --local          Use local Whisper installation", file=sys.stderr)
+        print("  --local          Use local Whisper (a resident worker keeps the model loaded)", file=sys.stderr)
+        print(f"  --whisper-model NAME  Local Whisper model (default: {DEFAULT_MODEL})", file=sys.stderr)
         print("  --output PATH    Output file path (default: subtitles.json)", file=sys.stderr)
+        print("  --audio WAV      Reuse audio extracted by audio_source.py", file=sys.stderr)
+        print("  --api-base-url URL  Send Whisper API requests to a compatible server (default: $OPENAI_BASE_URL)", file=sys.stderr)
+        print(f"  --concurrency N  Chunks transcribed in parallel for long audio (default: {DEFAULT_CONCURRENCY})", file=sys.stderr)
+        print("  --upload-format FMT  wav (default), flac or opus: compress through an ffmpeg pipe before uploading", file=sys.stderr)
+        print("  --max-chars N    Maximum characters per subtitle (default: 20)", file=sys.stderr)
+        print("  --no-cache       Do not read or write the transcript cache", file=sys.stderr)
+        print("  --trace PATH     Write a Chrome trace (trace.json) of the run", file=sys.stderr)
+        print("\nTo change --max-chars without transcribing again, use resegment.py.", file=sys.stderr)
         sys.exit(1)
 
     video_path = sys.argv[1]
     api_key = None
     use_local = False
     output_path = "subtitles.json"
+    shared_audio_path = None
+    base_url = None
+    concurrency = DEFAULT_CONCURRENCY
+    whisper_model = DEFAULT_MODEL
+    upload_format = 'wav'
+    max_chars_per_line = 20
+    use_cache = True
 
     # 引数パース
     i = 2
@@ -253,12 +299,36 @@ def main():
         if sys.argv[i] == '--api-key' and i + 1 < len(sys.argv):
             api_key = sys.argv[i + 1]
             i += 2
+        elif sys.argv[i] == '--audio' and i + 1 < len(sys.argv):
+            shared_audio_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--api-base-url' and i + 1 < len(sys.argv):
+            base_url = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--concurrency' and i + 1 < len(sys.argv):
+            concurrency = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--upload-format' and i + 1 < len(sys.argv):
+            upload_format = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--max-chars' and i + 1 < len(sys.argv):
+            max_chars_per_line = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--no-cache':
+            use_cache = False
+            i += 1
+        elif sys.argv[i] == '--whisper-model' and i + 1 < len(sys.argv):
+            whisper_model = sys.argv[i + 1]
+            i += 2
         elif sys.argv[i] == '--local':
             use_local = True
             i += 1
         elif sys.argv[i] == '--output' and i + 1 < len(sys.argv):
             output_path = sys.argv[i + 1]
             i += 2
+        elif sys.argv[i] == '--trace' and i + 1 < len(sys.argv):
+            tracing.enable(sys.argv[i + 1])
+            i += 2
         else:
             i += 1
 
@@ -272,51 +342,23 @@ def main():
 
     print(f"Generating subtitles from: {video_path}", file=sys.stderr)
 
-    # 音声を抽出
-    with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_audio:
-        audio_path = tmp_audio.name
-
-    try:
-        print("Extracting audio...", file=sys.stderr)
-        extract_audio(video_path, audio_path)
-
-        # 文字起こし
-        print("Transcribing audio...", file=sys.stderr)
-        if use_local:
-            transcript = transcribe_with_whisper_local(audio_path)
-        elif api_key:
-            transcript = transcribe_with_whisper_api(audio_path, api_key)
-        else:
-            print("Error: No API key provided and --local not specified", file=sys.stderr)
-            print("Set OPENAI_API_KEY environment variable or use --api-key", file=sys.stderr)
-            sys.exit(1)
-
-        # 字幕エントリを作成
-        print("Creating subtitle entries...", file=sys.stderr)
-        subtitles = create_subtitle_entries(transcript)
-
-        print(f"Generated {len(subtitles)} subtitle entries", file=sys.stderr)
-
-        # JSON形式で出力
-        output_data = {
-            'video_path': video_path,
-            'subtitles': subtitles
-        }
-
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
+    if shared_audio_path and not Path(shared_audio_path).exists():
+        print(f"Error: File not found: {shared_audio_path}", file=sys.stderr)
+        sys.exit(1)
 
-        print(f"Subtitles saved to: {output_path}", file=sys.stderr)
+    if not use_local and not api_key:
+        print("Error: No API key provided and --local not specified", file=sys.stderr)
+        print("Set OPENAI_API_KEY environment variable or use --api-key", file=sys.stderr)
+        sys.exit(1)
 
-        # SRT形式でも出力
-        srt_path = Path(output_path).with_suffix('.srt')
-        export_srt(subtitles, str(srt_path))
-        print(f"SRT subtitles saved to: {srt_path}", file=sys.stderr)
+    if upload_format != 'wav' and upload_format not in UPLOAD_FORMATS:
+        print(f"Error: Unknown upload format: {upload_format}", file=sys.stderr)
+        sys.exit(1)
 
-    finally:
-        # 一時ファイルを削除
-        if Path(audio_path).exists():
-            Path(audio_path).unlink()
+    # 抽出済みの音声があればそれを使う
+    output_data = generate_subtitles(video_path, api_key, use_local, shared_audio_path, base_url, concurrency,
+                                     whisper_model, upload_format, max_chars_per_line, use_cache)
+    write_subtitle_files(output_data, output_path)
 
 
 if __name__ == '__main__':
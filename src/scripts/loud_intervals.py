@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+大音量区間の検出
+RMS配列からヒステリシス付きで大音量区間を検出し、
+[start, end, peak] の区間リストとして返します。
+字幕の分類は区間との重なりを searchsorted で一括判定します。
+"""
+
+import numpy as np
+from typing import Tuple
+
+DEFAULT_HYSTERESIS_DB = 3.0  # 開始閾値と終了閾値の差（dB）
+DEFAULT_MIN_DURATION = 0.2  # これより短い区間は捨てる（秒）
+DEFAULT_MERGE_GAP = 0.3  # これ以下の隙間は前後の区間をつなぐ（秒）
+
+
+def _runs(state: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    真偽値配列の True が続く範囲の (開始位置, 終了位置+1) を返す
+    """
+    padded = np.concatenate(([False], state, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges[0::2], edges[1::2]
+
+
+def hysteresis_state(levels: np.ndarray, on_threshold, off_threshold) -> np.ndarray:
+    """
+    ヒステリシス付きの大音量状態
+
+    on_threshold 以上で大音量になり、off_threshold 未満になるまで維持する。
+    閾値はスカラーまたはサンプルごとの配列。
+    """
+    levels = np.asarray(levels, dtype=np.float64)
+    event = np.zeros(len(levels), dtype=np.int8)
+    event[levels < off_threshold] = -1
+    event[levels >= on_threshold] = 1
+
+    # 直前の「開始」「終了」イベントを前方に伝播させる
+    last_event = np.where(event != 0, np.arange(len(levels)), -1)
+    np.maximum.accumulate(last_event, out=last_event)
+    return (last_event >= 0) & (event[np.maximum(last_event, 0)] == 1)
+
+
+def intervals_from_state(timestamps: np.ndarray, levels: np.ndarray, state: np.ndarray,
+                         min_duration: float = 0.0, merge_gap: float = 0.0) -> np.ndarray:
+    """
+    大音量状態の配列を [start, end, peak] の区間配列（shape: (N, 3)）に変換
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64)
+    if len(timestamps) == 0:
+        return np.empty((0, 3))
+
+    # 各サンプルはその間隔だけ続くものとして区間の終端を決める
+    step = float(np.median(np.diff(timestamps))) if len(timestamps) > 1 else 0.0
+    first, last = _runs(np.asarray(state, dtype=bool))
+    if len(first) == 0:
+        return np.empty((0, 3))
+
+    starts = timestamps[first]
+    ends = timestamps[last - 1] + step
+
+    # 短い隙間でつながる区間をまとめる
+    new_group = np.concatenate(([True], starts[1:] - ends[:-1] > merge_gap))
+    group_first = np.flatnonzero(new_group)
+    group_last = np.concatenate((group_first[1:], [len(first)])) - 1
+    first, last = first[group_first], last[group_last]
+    starts, ends = starts[group_first], ends[group_last]
+
+    peaks = np.maximum.reduceat(np.append(levels, 0.0), np.column_stack((first, last)).ravel())[::2]
+
+    keep = ends - starts >= min_duration
+    return np.column_stack((starts[keep], ends[keep], peaks[keep]))
+
+
+def detect_loud_intervals(timestamps, rms_linear, threshold,
+                          hysteresis_db: float = DEFAULT_HYSTERESIS_DB,
+                          min_duration: float = DEFAULT_MIN_DURATION,
+                          merge_gap: float = DEFAULT_MERGE_GAP) -> np.ndarray:
+    """
+    RMS配列から大音量区間を検出
+
+    Args:
+        timestamps: サンプルのタイムスタンプ（昇順）
+        rms_linear: 線形スケール(0-1)の音量（-60dB〜0dB）
+        threshold: 開始閾値（スカラーまたはサンプルごとの配列）
+        hysteresis_db: 終了閾値を開始閾値より何dB下げるか
+        min_duration: 最短区間長（秒）
+        merge_gap: 区間をつなぐ最大の隙間（秒）
+
+    Returns:
+        [start, end, peak] の配列（shape: (N, 3)）。peak は区間内の最大 rms_linear
+    """
+    # rms_linear は60dBを0〜1に対応させた値なので、dB差は /60 で変換できる
+    off_threshold = np.asarray(threshold) - hysteresis_db / 60
+    state = hysteresis_state(rms_linear, threshold, off_threshold)
+    return intervals_from_state(timestamps, rms_linear, state, min_duration, merge_gap)
+
+
+def classify_spans(intervals, starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    各 [start, end] が大音量区間と重なるかを一括判定
+
+    Args:
+        intervals: 時刻順で重ならない [start, end, peak] の配列
+
+    Returns:
+        (重なる区間の最大peak（なければ nan）, 重なりの有無)
+    """
+    intervals = np.asarray(intervals, dtype=np.float64).reshape(-1, 3)
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+
+    # 終了が start 以降の最初の区間から、開始が end 以前の最後の区間までが重なる
+    lo = np.searchsorted(intervals[:, 1], starts, side='right')
+    hi = np.searchsorted(intervals[:, 0], ends, side='left')
+    overlaps = hi > lo
+
+    peaks = np.full(len(starts), np.nan)
+    if np.any(overlaps):
+        padded = np.append(intervals[:, 2], 0.0)
+        bounds = np.column_stack((lo[overlaps], hi[overlaps])).ravel()
+        peaks[overlaps] = np.maximum.reduceat(padded, bounds)[::2]
+
+    return peaks, overlaps
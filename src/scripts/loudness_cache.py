@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+音量解析キャッシュ
+動画ごとのRMS解析結果（timestamps, rms_db）を .npy として保存し、
+同じ素材を再解析するときはデコードせずにメモリマップで読み込みます。
+
+キャッシュキーはファイルサイズ・更新時刻・部分ハッシュと解析パラメータから作られます。
+パーセンタイルはキーに含まれないため、閾値だけを変えた再実行もキャッシュを利用できます。
+"""
+
+import os
+import time
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import cache_store
+
+CACHE_NAME = 'loudness'
+CACHE_VERSION = 1
+HASH_CHUNK_BYTES = 1024 * 1024  # 先頭・中央・末尾から読むバイト数
+
+ARRAY_NAMES = ('timestamps', 'rms_db')
+
+
+def media_fingerprint(path: str) -> Dict:
+    """
+    ファイルサイズ・更新時刻・部分ハッシュからメディアの指紋を作成
+
+    ファイル全体は読まず、先頭・中央・末尾の一部だけをハッシュする。
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - HASH_CHUNK_BYTES // 2), max(0, size - HASH_CHUNK_BYTES)}):
+            f.seek(offset)
+            digest.update(f.read(HASH_CHUNK_BYTES))
+
+    return {
+        'size': size,
+        'mtime_ns': stat.st_mtime_ns,
+        'partial_hash': digest.hexdigest()
+    }
+
+
+def make_cache_key(fingerprint: Dict, params: Dict) -> str:
+    """
+    指紋と解析パラメータからキャッシュキーを作成
+    """
+    return cache_store.make_key({'version': CACHE_VERSION, 'fingerprint': fingerprint, 'params': params})
+
+
+def load(media_path: str, params: Dict) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    キャッシュから (timestamps, rms_db) をメモリマップで読み込む
+
+    見つからない場合は None を返す。
+    """
+    key = make_cache_key(media_fingerprint(media_path), params)
+    entry_dir = cache_store.get_cache_dir(CACHE_NAME) / key
+    meta_path = entry_dir / 'meta.json'
+
+    if not meta_path.exists():
+        return None
+
+    try:
+        arrays = tuple(np.load(entry_dir / f'{name}.npy', mmap_mode='r') for name in ARRAY_NAMES)
+    except (OSError, ValueError):
+        return None
+
+    cache_store.touch(meta_path)
+    return arrays
+
+
+def store(media_path: str, params: Dict, timestamps: np.ndarray, rms_db: np.ndarray) -> Path:
+    """
+    解析結果をキャッシュに保存し、全キャッシュの合計が上限を超えた分を古い順に削除
+    """
+    fingerprint = media_fingerprint(media_path)
+    key = make_cache_key(fingerprint, params)
+
+    with cache_store.write_entry(CACHE_NAME, key) as tmp_dir:
+        np.save(tmp_dir / 'timestamps.npy', np.ascontiguousarray(timestamps, dtype=np.float64))
+        np.save(tmp_dir / 'rms_db.npy', np.ascontiguousarray(rms_db, dtype=np.float64))
+        cache_store.write_meta(tmp_dir, {
+            'version': CACHE_VERSION,
+            'source': str(Path(media_path).resolve()),
+            'fingerprint': fingerprint,
+            'params': params,
+            'num_samples': int(len(timestamps)),
+            'created': time.time()
+        })
+
+    return cache_store.get_cache_dir(CACHE_NAME) / key
+
+
+if __name__ == '__main__':
+    cache_store.main(CACHE_NAME)
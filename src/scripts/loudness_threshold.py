@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+大音量判定の閾値計算
+全サンプルを保持せずに閾値を求めるストリーミング推定（P²アルゴリズム）と、
+直近N秒の局所パーセンタイルを使うローリング閾値を提供します。
+
+ThresholdTracker は解析ループからブロックごとのレベルを受け取るので、
+デコードしながら（ライブ入力でも）閾値を更新できます。
+"""
+
+import bisect
+import numpy as np
+from collections import deque
+
+# global: 全サンプルのパーセンタイル（従来の挙動）
+# streaming: P²アルゴリズムによる定数メモリの推定
+# rolling: 直近 window 秒の局所パーセンタイル
+THRESHOLD_MODES = ('global', 'streaming', 'rolling')
+
+
+def _interpolated_percentile(sorted_values: list, percentile: float) -> float:
+    """
+    ソート済みリストのパーセンタイル（np.percentile と同じ線形補間）
+    """
+    position = (len(sorted_values) - 1) * percentile / 100.0
+    below = int(position)
+    above = min(below + 1, len(sorted_values) - 1)
+    fraction = position - below
+    return sorted_values[below] + (sorted_values[above] - sorted_values[below]) * fraction
+
+
+class P2Quantile:
+    """
+    P²アルゴリズム（Jain & Chlamtac, 1985）による分位点のストリーミング推定
+
+    5つのマーカーだけを保持するので、サンプル数に関係なくメモリは一定。
+    """
+
+    def __init__(self, percentile: float = 75.0):
+        self.p = percentile / 100.0
+        self.count = 0
+        self._initial = []
+        self._heights = []
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [0.0, 2 * self.p, 4 * self.p, 2 + 2 * self.p, 4.0]
+        self._increments = [0.0, self.p / 2, self.p, (1 + self.p) / 2, 1.0]
+
+    def update(self, x: float) -> None:
+        """
+        サンプルを1つ追加
+        """
+        self.count += 1
+
+        if not self._heights:
+            bisect.insort(self._initial, x)
+            if len(self._initial) == 5:
+                self._heights = self._initial
+            return
+
+        q = self._heights
+        n = self._positions
+
+        # x が入るセル k を探し、端のマーカーを更新
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        # 中間マーカーの高さを放物線（不可なら線形）補間で調整
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def update_many(self, values) -> None:
+        """
+        配列やブロック単位でサンプルを追加
+        """
+        for x in np.asarray(values, dtype=np.float64).tolist():
+            self.update(x)
+
+    def value(self) -> float:
+        """
+        現在の分位点の推定値
+        """
+        if self._heights:
+            return self._heights[2]
+        if not self._initial:
+            raise ValueError("No samples")
+        return _interpolated_percentile(self._initial, self.p * 100)
+
+
+class RollingPercentile:
+    """
+    直近 window 個のサンプルの局所パーセンタイル
+
+    ソート済みの窓を保持するので、メモリは窓の長さに比例する。
+    """
+
+    def __init__(self, window: int, percentile: float = 75.0):
+        if window < 1:
+            raise ValueError("window must be at least 1 sample")
+        self.window = window
+        self.percentile = percentile
+        self._recent = deque()
+        self._sorted = []
+
+    def update(self, x: float) -> float:
+        """
+        サンプルを追加し、そのサンプルを含む窓の閾値を返す
+        """
+        self._recent.append(x)
+        bisect.insort(self._sorted, x)
+
+        if len(self._recent) > self.window:
+            oldest = self._recent.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+
+        return _interpolated_percentile(self._sorted, self.percentile)
+
+    def update_many(self, values) -> np.ndarray:
+        """
+        ブロック単位でサンプルを追加し、各サンプルの閾値の配列を返す
+        """
+        values = np.asarray(values, dtype=np.float64).tolist()
+        return np.fromiter((self.update(x) for x in values), dtype=np.float64, count=len(values))
+
+
+class ThresholdTracker:
+    """
+    ブロックごとの rms_linear を受け取り、streaming / rolling の閾値を逐次計算
+
+    streaming は P² 推定の5つのマーカーだけを保持する。rolling は直近 window_samples 個の窓と、
+    判定に使うサンプルごとの閾値（レベルの配列と同じ長さ）を保持する。
+    """
+
+    def __init__(self, mode: str, percentile: float = 75.0, window_samples: int = 1):
+        if mode not in ('streaming', 'rolling'):
+            raise ValueError(f"ThresholdTracker supports streaming and rolling, not {mode}")
+        self.mode = mode
+        self.count = 0
+        if mode == 'streaming':
+            self._estimator = P2Quantile(percentile)
+        else:
+            self._estimator = RollingPercentile(window_samples, percentile)
+            self._blocks = []
+
+    def update(self, rms_linear) -> None:
+        """
+        解析ループから1ブロック分のレベルを追加
+        """
+        if self.mode == 'streaming':
+            self._estimator.update_many(rms_linear)
+        else:
+            self._blocks.append(self._estimator.update_many(rms_linear))
+        self.count += len(rms_linear)
+
+    def value(self) -> float:
+        """
+        streaming の閾値
+        """
+        return float(self._estimator.value())
+
+    def thresholds(self) -> np.ndarray:
+        """
+        rolling のサンプルごとの閾値
+        """
+        if not self._blocks:
+            return np.empty(0, dtype=np.float64)
+        return np.concatenate(self._blocks)
+
+
+def streaming_threshold(rms_linear, percentile: float = 75.0) -> float:
+    """
+    P²推定でパーセンタイル閾値を計算
+    """
+    estimator = P2Quantile(percentile)
+    estimator.update_many(rms_linear)
+    return float(estimator.value())
+
+
+def rolling_thresholds(rms_linear, window: int, percentile: float = 75.0) -> np.ndarray:
+    """
+    各サンプルについて直近 window 個（先頭付近はそれまでの全サンプル）の
+    パーセンタイルを閾値とした配列を返す
+    """
+    return RollingPercentile(window, percentile).update_many(rms_linear)
@@ -2,100 +2,246 @@
 """
 動画処理統合スクリプト
 字幕生成と音声解析を統合し、Remotionで使用可能なデータを生成します。
+各ステージは同じプロセス内で関数として呼び出し、字幕生成と音声解析は並行に実行します。
 """
 
+import os
 import sys
 import json
-import subprocess
+import tempfile
+import functools
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, List
 
+import numpy as np
 
-def run_subtitle_generation(video_path: str, api_key: str = None) -> Dict:
+import subtitle_io
+import tracing
+import transcript_cache
+from alignment import AGGREGATIONS, align_loudness
+from analysis_io import load_audio_analysis, save_npz
+from audio_source import ASR_SAMPLE_RATE, acquire_audio
+from stage_cache import STAGES, StageCache
+from subtitle_table import SubtitleTable
+from whisper_worker import DEFAULT_MODEL
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+# ステージキャッシュのキーに含めるパラメータ（結果が変わる設定を変えたらここも変える）
+ANALYSIS_PARAMS = {'engine': 'pcm', 'interval': 0.1, 'threshold_mode': 'global', 'format': 'npz'}
+MAX_CHARS_PER_LINE = 20
+
+
+@functools.lru_cache(maxsize=None)
+def load_stage_module(name: str):
     """
-    字幕生成スクリプトを実行
+    ハイフンを含むスクリプト（generate-subtitles.py など）をモジュールとして読み込む
     """
-    script_dir = Path(__file__).parent
-    generate_script = script_dir / 'generate-subtitles.py'
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), SCRIPT_DIR / f'{name}.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
-    cmd = ['python3', str(generate_script), video_path]
 
-    if api_key:
-        cmd.extend(['--api-key', api_key])
+def run_audio_acquisition(video_path: str, work_dir: str) -> str:
+    """
+    音声を一度だけデコードし、字幕生成と音声解析で共有するWAVを作成
+    """
+    audio_path = str(Path(work_dir) / 'audio.wav')
 
-    output_path = 'subtitles.json'
-    cmd.extend(['--output', output_path])
+    print("Extracting audio...", file=sys.stderr)
+    with tracing.span('audio-acquisition') as sp:
+        info = acquire_audio(video_path, audio_path)
+        sp.set(seconds=info['duration'])
+    print(f"✓ Extracted {info['duration']:.2f}s of audio", file=sys.stderr)
 
-    print(f"Running subtitle generation...", file=sys.stderr)
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    return audio_path
 
-    if result.returncode != 0:
-        raise Exception(f"Subtitle generation failed: {result.stderr}")
 
-    print(result.stderr, file=sys.stderr)
+def transcript_params(use_local: bool = False, whisper_model: str = DEFAULT_MODEL,
+                      upload_format: str = 'wav') -> Dict:
+    """
+    文字起こしステージのキャッシュキーに含めるパラメータ
 
-    # 生成されたJSONを読み込み
-    with open(output_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    文字起こしキャッシュと同じパラメータに、ステージの出力（分割した字幕）を決める1行の最大文字数を加える。
+    """
+    return {**transcript_cache.transcription_params(use_local, whisper_model, upload_format),
+            'max_chars_per_line': MAX_CHARS_PER_LINE}
 
 
-def run_audio_analysis(video_path: str, percentile: float = 75.0) -> Dict:
+def run_subtitle_generation(video_path: str, api_key: str = None, audio_path: str = None,
+                            use_local: bool = False, whisper_model: str = DEFAULT_MODEL,
+                            upload_format: str = 'wav', use_cache: bool = True,
+                            refresh_cache: bool = False) -> Dict:
     """
-    音声解析スクリプトを実行
+    字幕生成ステージを実行（generate-subtitles.py の generate_subtitles を呼び出す）
+
+    use_local の場合は常駐のWhisperワーカーを使う（一括処理の各プロセスで同じモデルを共有する）。
+    use_cache の場合は文字起こしキャッシュも使う（refresh_cache なら読まずに置き換える）。
     """
-    script_dir = Path(__file__).parent
-    analyze_script = script_dir / 'analyze-audio.py'
+    generate = load_stage_module('generate-subtitles')
 
-    cmd = ['python3', str(analyze_script), video_path, str(percentile)]
+    # generate-subtitles.py と同じく環境変数のAPIキーも使う
+    api_key = api_key or os.environ.get('OPENAI_API_KEY')
 
-    print(f"Running audio analysis...", file=sys.stderr)
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    print(f"Running subtitle generation...", file=sys.stderr)
+    with tracing.span('subtitle-generation') as sp:
+        try:
+            subtitle_data = generate.generate_subtitles(video_path, api_key, use_local, audio_path=audio_path,
+                                                        whisper_model=whisper_model, upload_format=upload_format,
+                                                        use_cache=use_cache, refresh_cache=refresh_cache)
+        except Exception as e:
+            raise Exception(f"Subtitle generation failed: {e}")
+        sp.set(entries=len(subtitle_data['subtitles']))
+
+    return subtitle_data
 
-    if result.returncode != 0:
-        raise Exception(f"Audio analysis failed: {result.stderr}")
 
-    print(result.stderr, file=sys.stderr)
+def run_audio_analysis(video_path: str, percentile: float = 75.0, audio_path: str = None) -> Dict:
+    """
+    音声解析ステージを実行（analyze-audio.py の analyze_audio を呼び出す）
+
+    Returns:
+        analysis_io の配列形式（normalize_audio_analysis と同じ）
+    """
+    analyze = load_stage_module('analyze-audio')
+
+    print(f"Running audio analysis...", file=sys.stderr)
+    with tracing.span('audio-analysis') as sp:
+        try:
+            audio_data = analyze.analyze_audio(video_path, percentile, audio_path=audio_path)
+        except Exception as e:
+            raise Exception(f"Audio analysis failed: {e}")
+        sp.set(samples=len(audio_data['timestamps']))
 
-    # JSON出力をパース
-    return json.loads(result.stdout)
+    return audio_data
 
 
-def merge_subtitle_and_audio_data(subtitle_data: Dict, audio_data: Dict) -> List[Dict]:
+def merge_subtitle_and_audio_data(subtitle_data: Dict, audio_data: Dict, aggregate: str = 'mid') -> List[Dict]:
     """
     字幕データと音声データをマージ
+
+    audio_data は analysis_io の配列形式（normalize_audio_analysis の戻り値）
+    aggregate は音量の求め方（alignment.AGGREGATIONS）
+    """
+    table = SubtitleTable.from_json(subtitle_data)
+
+    # 各字幕エントリに対して、その時間帯の音量レベルを一括で取得
+    volume_levels, loud_flags = align_loudness(audio_data, table.start, table.end, aggregate)
+    table.columns['volumeLevel'] = volume_levels
+    # スタイルを自動決定
+    table.columns['style'] = np.where(loud_flags, 'loud', 'normal')
+
+    return table.to_dicts()
+
+
+def process_video(video_path: str, output_path: str, api_key: str = None, percentile: float = 75.0,
+                  analysis_path: str = None, aggregate: str = 'mid', cache: StageCache = None,
+                  use_local: bool = False, whisper_model: str = DEFAULT_MODEL, upload_format: str = 'wav') -> Dict:
     """
-    subtitles = subtitle_data['subtitles']
-    analysis = audio_data['analysis_data']
-    threshold = audio_data['threshold']
+    1本の動画を処理してテロップデータを output_path に書き出す
 
-    # 各字幕エントリに対して、その時間帯の音量レベルを取得
-    enhanced_subtitles = []
+    cache を渡すと、入力とパラメータが変わっていないステージは実行せずに
+    キャッシュから出力を復元する。
 
-    for subtitle in subtitles:
-        start_time = subtitle['startTime']
-        end_time = subtitle['endTime']
-        mid_time = (start_time + end_time) / 2
+    Returns:
+        書き出したテロップデータ
+    """
+    if cache is None:
+        cache = StageCache(enabled=False)
+
+    with tempfile.TemporaryDirectory(prefix='telop-work-') as work_dir:
+        audio_path = str(Path(work_dir) / 'audio.wav')
+        analysis_file = analysis_path or str(Path(work_dir) / 'audio-analysis.npz')
+        transcript_file = str(Path(work_dir) / 'subtitles.json')
+
+        # 音量解析と文字起こしのキーは抽出した音声ではなく、そのキー（動画とサンプルレート）から作る
+        audio_key = cache.key('audio', [video_path], {'sample_rate': ASR_SAMPLE_RATE})
+        analysis_key = cache.key('analysis', params={'percentile': percentile, **ANALYSIS_PARAMS}, upstream=[audio_key])
+        transcript_key = cache.key('transcript', params=transcript_params(use_local, whisper_model, upload_format),
+                                   upstream=[audio_key])
+
+        # 先に文字起こしと音量解析の出力を復元し、どちらかが復元できなければ音声を一度だけ抽出して両ステージで共有
+        transcript_restored = cache.restore('transcript', transcript_key, [transcript_file])
+        analysis_restored = bool(analysis_path) or cache.restore('analysis', analysis_key, [analysis_file])
+        if transcript_restored and analysis_restored:
+            cache.skip('audio', audio_key)
+        else:
+            cache.run('audio', audio_key, [audio_path], lambda: run_audio_acquisition(video_path, work_dir))
+
+        def transcribe():
+            subtitle_data = run_subtitle_generation(video_path, api_key, audio_path, use_local, whisper_model,
+                                                    upload_format, cache.enabled, cache.is_forced('transcript'))
+            with open(transcript_file, 'w', encoding='utf-8') as f:
+                json.dump(subtitle_data, f, ensure_ascii=False)
+
+        def analyze():
+            result = run_audio_analysis(video_path, percentile, audio_path)
+            save_npz(analysis_file, video_path, percentile, result['threshold'], result['timestamps'],
+                     result['rms_db'], result['is_loud'], result['loud_intervals'], rms_dtype=np.float64,
+                     threshold_mode=result['threshold_mode'])
+
+        # 字幕生成と音声解析は互いに依存しないので並行に実行
+        # （Whisper API・ffmpeg・NumPy の処理中はGILが解放される）
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            subtitle_future = None
+            if not transcript_restored:
+                subtitle_future = executor.submit(cache.run, 'transcript', transcript_key, [transcript_file],
+                                                  transcribe)
+
+            # 音声解析（解析済みデータがあればそれを使う）
+            if not analysis_restored:
+                executor.submit(cache.run, 'analysis', analysis_key, [analysis_file], analyze).result()
+
+            with tracing.span('load-audio-analysis', cat='io'):
+                audio_data = load_audio_analysis(analysis_file)
+            verb = 'Loaded' if analysis_path else 'Analyzed'
+            print(f"✓ {verb} audio analysis with threshold {audio_data['threshold']:.4f}", file=sys.stderr)
+
+            if subtitle_future is not None:
+                subtitle_future.result()
+            with open(transcript_file, 'r', encoding='utf-8') as f:
+                subtitle_data = json.load(f)
+            print(f"✓ Generated {len(subtitle_data['subtitles'])} subtitles", file=sys.stderr)
+
+        def merge():
+            with tracing.span('merge', aggregate=aggregate) as sp:
+                enhanced_subtitles = merge_subtitle_and_audio_data(subtitle_data, audio_data, aggregate)
+                sp.set(entries=len(enhanced_subtitles))
+
+            # 最終出力データを作成
+            output_data = {
+                'videoPath': video_path,
+                'subtitles': enhanced_subtitles,
+                'audioAnalysis': {
+                    'threshold': audio_data['threshold'],
+                    'percentile': audio_data['percentile']
+                }
+            }
 
-        # 該当時間の音量レベルを検索
-        volume_level = 0.5  # デフォルト値
-        is_loud = False
+            # JSON出力
+            with tracing.span('write-json', cat='io', entries=len(enhanced_subtitles)):
+                subtitle_io.write_json(output_data, output_path)
 
-        for audio_sample in analysis:
-            if abs(audio_sample['timestamp'] - mid_time) < 0.5:  # 0.5秒の範囲
-                volume_level = audio_sample['rms_linear']
-                is_loud = audio_sample['is_loud']
-                break
+        # データをマージ（マージは解析結果と字幕の内容から直接キーを作る）
+        merge_key = cache.key('merge', [analysis_file, transcript_file],
+                              {'aggregate': aggregate, 'video_path': video_path})
+        cache.run('merge', merge_key, [output_path], merge)
+        print("✓ Merged subtitle and audio data", file=sys.stderr)
 
-        # スタイルを自動決定
-        style = 'loud' if is_loud else 'normal'
+    with open(output_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
-        enhanced_subtitles.append({
-            **subtitle,
-            'volumeLevel': volume_level,
-            'style': style
-        })
 
-    return enhanced_subtitles
+def print_trace_summary(events: List[Dict]) -> None:
+    """
+    スパン名ごとの合計時間を表示
+    """
+    print("\nTiming:", file=sys.stderr)
+    for entry in tracing.summarize(events):
+        print(f"  {entry['name']:<28} {entry['seconds']:9.3f}s  x{entry['count']}", file=sys.stderr)
 
 
 def main():
@@ -103,14 +249,32 @@ def main():
         print("Usage: python process-video.py <video_path> [--api-key KEY] [--percentile N] [--output OUTPUT]", file=sys.stderr)
         print("\nOptions:", file=sys.stderr)
         print("  --api-key KEY       OpenAI API key for Whisper API", file=sys.stderr)
+        print("  --local             Use the local Whisper worker instead of the API", file=sys.stderr)
+        print(f"  --whisper-model NAME  Local Whisper model (default: {DEFAULT_MODEL})", file=sys.stderr)
+        print("  --upload-format FMT wav (default), flac or opus audio sent to the Whisper API", file=sys.stderr)
         print("  --percentile N      Volume percentile threshold (default: 75)", file=sys.stderr)
         print("  --output PATH       Output file path (default: telop-data.json)", file=sys.stderr)
+        print("  --audio-analysis PATH  Use an existing analyze-audio.py output (.json or .npz)", file=sys.stderr)
+        print("  --aggregate MODE    Loudness per subtitle: mid (default), max, mean or percentile", file=sys.stderr)
+        print("  --trace PATH        Write a Chrome/Perfetto trace (trace.json) covering every stage", file=sys.stderr)
+        print("  --no-cache          Do not read or write the stage cache", file=sys.stderr)
+        print("  --force             Rerun every stage and refresh the stage cache", file=sys.stderr)
+        print(f"  --from-stage STAGE  Rerun STAGE and the stages after it ({', '.join(STAGES)})", file=sys.stderr)
         sys.exit(1)
 
     video_path = sys.argv[1]
     api_key = None
     percentile = 75.0
     output_path = "telop-data.json"
+    analysis_path = None
+    aggregate = 'mid'
+    trace_path = None
+    use_cache = True
+    force = False
+    from_stage = None
+    use_local = False
+    whisper_model = DEFAULT_MODEL
+    upload_format = 'wav'
 
     # 引数パース
     i = 2
@@ -118,12 +282,39 @@ def main():
         if sys.argv[i] == '--api-key' and i + 1 < len(sys.argv):
             api_key = sys.argv[i + 1]
             i += 2
+        elif sys.argv[i] == '--local':
+            use_local = True
+            i += 1
+        elif sys.argv[i] == '--upload-format' and i + 1 < len(sys.argv):
+            upload_format = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--whisper-model' and i + 1 < len(sys.argv):
+            whisper_model = sys.argv[i + 1]
+            i += 2
         elif sys.argv[i] == '--percentile' and i + 1 < len(sys.argv):
             percentile = float(sys.argv[i + 1])
             i += 2
         elif sys.argv[i] == '--output' and i + 1 < len(sys.argv):
             output_path = sys.argv[i + 1]
             i += 2
+        elif sys.argv[i] == '--audio-analysis' and i + 1 < len(sys.argv):
+            analysis_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--aggregate' and i + 1 < len(sys.argv):
+            aggregate = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--trace' and i + 1 < len(sys.argv):
+            trace_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--no-cache':
+            use_cache = False
+            i += 1
+        elif sys.argv[i] == '--force':
+            force = True
+            i += 1
+        elif sys.argv[i] == '--from-stage' and i + 1 < len(sys.argv):
+            from_stage = sys.argv[i + 1]
+            i += 2
         else:
             i += 1
 
@@ -131,35 +322,27 @@ def main():
         print(f"Error: File not found: {video_path}", file=sys.stderr)
         sys.exit(1)
 
+    if aggregate not in AGGREGATIONS:
+        print(f"Error: Unknown aggregation: {aggregate}", file=sys.stderr)
+        sys.exit(1)
+
+    if from_stage is not None and from_stage not in STAGES:
+        print(f"Error: Unknown stage: {from_stage}", file=sys.stderr)
+        sys.exit(1)
+
+    cache = StageCache(force=force, from_stage=from_stage, enabled=use_cache)
+
+    # 字幕生成・音声解析はスレッドで同じプロセス内で実行されるので、両ステージのイベントが同じトレースに入る
+    if trace_path:
+        tracing.enable(trace_path)
+
     print(f"Processing video: {video_path}", file=sys.stderr)
     print(f"=" * 60, file=sys.stderr)
 
     try:
-        # 字幕生成
-        subtitle_data = run_subtitle_generation(video_path, api_key)
-        print(f"✓ Generated {len(subtitle_data['subtitles'])} subtitles", file=sys.stderr)
-
-        # 音声解析
-        audio_data = run_audio_analysis(video_path, percentile)
-        print(f"✓ Analyzed audio with threshold {audio_data['threshold']:.4f}", file=sys.stderr)
-
-        # データをマージ
-        enhanced_subtitles = merge_subtitle_and_audio_data(subtitle_data, audio_data)
-        print(f"✓ Merged subtitle and audio data", file=sys.stderr)
-
-        # 最終出力データを作成
-        output_data = {
-            'videoPath': video_path,
-            'subtitles': enhanced_subtitles,
-            'audioAnalysis': {
-                'threshold': audio_data['threshold'],
-                'percentile': audio_data['percentile']
-            }
-        }
-
-        # JSON出力
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
+        output_data = process_video(video_path, output_path, api_key, percentile, analysis_path, aggregate, cache,
+                                    use_local, whisper_model, upload_format)
+        enhanced_subtitles = output_data['subtitles']
 
         print(f"=" * 60, file=sys.stderr)
         print(f"✓ Telop data saved to: {output_path}", file=sys.stderr)
@@ -172,6 +355,11 @@ def main():
         print(f"  Normal style: {normal_count}", file=sys.stderr)
         print(f"  Loud style: {loud_count}", file=sys.stderr)
 
+        cache.report()
+
+        if trace_path:
+            print_trace_summary(tracing.save())
+
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+字幕の再分割スクリプト
+文字起こしキャッシュ（transcript_cache.py）に保存された生の文字起こし結果から、
+文字起こしし直さずに字幕JSON / SRTを作り直します。
+1行の文字数を変えたいときや、縦型動画向けの短い字幕を作りたいときに使います。
+"""
+
+import sys
+import json
+import importlib.util
+from pathlib import Path
+
+import tracing
+import transcript_cache
+from whisper_worker import DEFAULT_MODEL
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+
+def load_generate_module():
+    """
+    generate-subtitles.py をモジュールとして読み込む
+    """
+    spec = importlib.util.spec_from_file_location('generate_subtitles', SCRIPT_DIR / 'generate-subtitles.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python resegment.py <video_path> [--max-chars N] [--output OUTPUT]", file=sys.stderr)
+        print("\nOptions:", file=sys.stderr)
+        print("  --max-chars N        Maximum characters per subtitle (default: 20)", file=sys.stderr)
+        print("  --output PATH        Output file path (default: subtitles.json, SRT written alongside)", file=sys.stderr)
+        print("  --local              Use the transcript made by local Whisper", file=sys.stderr)
+        print(f"  --whisper-model NAME Local Whisper model of the transcript (default: {DEFAULT_MODEL})", file=sys.stderr)
+        print("  --upload-format FMT  Upload format of the Whisper API transcript (default: wav)", file=sys.stderr)
+        print("  --transcript PATH    Read a raw transcript JSON instead of the cache", file=sys.stderr)
+        print("  --trace PATH         Write a Chrome trace (trace.json) of the run", file=sys.stderr)
+        print("\nThe options must match the generate-subtitles.py run that made the transcript.", file=sys.stderr)
+        sys.exit(1)
+
+    video_path = sys.argv[1]
+    max_chars_per_line = 20
+    output_path = "subtitles.json"
+    use_local = False
+    whisper_model = DEFAULT_MODEL
+    upload_format = 'wav'
+    transcript_path = None
+
+    # 引数パース
+    i = 2
+    while i < len(sys.argv):
+        if sys.argv[i] == '--max-chars' and i + 1 < len(sys.argv):
+            max_chars_per_line = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--output' and i + 1 < len(sys.argv):
+            output_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--local':
+            use_local = True
+            i += 1
+        elif sys.argv[i] == '--whisper-model' and i + 1 < len(sys.argv):
+            whisper_model = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--upload-format' and i + 1 < len(sys.argv):
+            upload_format = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--transcript' and i + 1 < len(sys.argv):
+            transcript_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--trace' and i + 1 < len(sys.argv):
+            tracing.enable(sys.argv[i + 1])
+            i += 2
+        else:
+            i += 1
+
+    if max_chars_per_line < 1:
+        print("Error: --max-chars must be at least 1", file=sys.stderr)
+        sys.exit(1)
+
+    generate = load_generate_module()
+
+    if transcript_path:
+        if not Path(transcript_path).exists():
+            print(f"Error: File not found: {transcript_path}", file=sys.stderr)
+            sys.exit(1)
+        with open(transcript_path, 'r', encoding='utf-8') as f:
+            transcript = json.load(f)
+    else:
+        if not Path(video_path).exists():
+            print(f"Error: File not found: {video_path}", file=sys.stderr)
+            sys.exit(1)
+
+        params = transcript_cache.transcription_params(use_local, whisper_model, upload_format)
+        with tracing.span('transcript-cache-load', cat='cache'):
+            transcript = transcript_cache.load(video_path, params)
+        if transcript is None:
+            print(f"Error: No cached transcript for {video_path} "
+                  f"[{', '.join(f'{k}={v}' for k, v in sorted(params.items()))}]", file=sys.stderr)
+            print("Run generate-subtitles.py with the same options first", file=sys.stderr)
+            sys.exit(1)
+
+    print(f"Resegmenting {len(transcript.get('segments') or [])} segments "
+          f"with max {max_chars_per_line} characters", file=sys.stderr)
+
+    output_data = generate.build_subtitle_data(video_path, transcript, max_chars_per_line)
+    generate.write_subtitle_files(output_data, output_path)
+
+
+if __name__ == '__main__':
+    main()
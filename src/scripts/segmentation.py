@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+日本語テキストの分割
+字幕を表示しやすい長さに分割するルールをまとめたモジュールです。
+
+- morpheme:    形態素（janome）単位で max_length 以内に詰める（generate-subtitles.py）
+- breakpoint:  max_length 以内の最後の句読点・助詞の直後で区切る（merge-data.py）
+- punctuation: 句読点ごと、または max_length 文字ごとに区切る（optimize_subtitles_for_vertical.py）
+
+janome の Tokenizer は辞書の読み込みに時間がかかるため、プロセスごとに1つだけ作って使い回します。
+同じ行の分割結果は LRU でメモ化し、split_texts() で複数の行をまとめて（必要ならプロセスプールで）分割できます。
+"""
+
+import sys
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence
+
+import tracing
+
+# merge-data.py の文節の区切り文字
+BREAKPOINTS = ('、', '。', 'が', 'を', 'に', 'で', 'と', 'は', 'の', 'や', 'ね', 'よ', 'ぞ', 'か')
+# optimize_subtitles_for_vertical.py の区切り文字
+PUNCTUATION = '。、！？'
+
+MEMO_SIZE = 65536
+POOL_MIN_TEXTS = 256  # これより少ない場合はプロセスプールを使わない
+
+
+@functools.lru_cache(maxsize=1)
+def get_tokenizer():
+    """
+    プロセス共通の janome Tokenizer（janome がなければ None）
+    """
+    try:
+        from janome.tokenizer import Tokenizer
+    except ImportError:
+        print("Warning: janome not found, using simple splitting", file=sys.stderr)
+        return None
+
+    with tracing.span('janome-load', cat='text'):
+        return Tokenizer()
+
+
+def _split_morpheme(text: str, max_length: int) -> List[str]:
+    tokenizer = get_tokenizer()
+
+    # Janomeがない場合は単純分割
+    if tokenizer is None:
+        return [text[i:i + max_length] for i in range(0, len(text), max_length)]
+
+    chunks = []
+    current_chunk = ""
+
+    for token in tokenizer.tokenize(text, wakati=True):
+        if len(current_chunk) + len(token) <= max_length:
+            current_chunk += token
+        else:
+            if current_chunk:
+                chunks.append(current_chunk)
+            current_chunk = token
+
+    if current_chunk:
+        chunks.append(current_chunk)
+
+    return chunks
+
+
+def _split_breakpoint(text: str, max_length: int) -> List[str]:
+    parts = []
+
+    while len(text) > max_length:
+        # max_length 文字以内で最後の区切り文字の直後（なければ max_length 文字目）で区切る
+        last = max(text.rfind(char, 0, max_length) for char in BREAKPOINTS)
+        best_split = last + 1 if last >= 0 else max_length
+
+        parts.append(text[:best_split].strip())
+        text = text[best_split:].strip()
+        if not text:
+            return parts
+
+    parts.append(text)
+    return parts
+
+
+def _split_punctuation(text: str, max_length: int) -> List[str]:
+    chunks = []
+    current_chunk = ""
+
+    for char in text:
+        current_chunk += char
+
+        # 句読点で区切るか、最大文字数に達したら分割
+        if char in PUNCTUATION or len(current_chunk) >= max_length:
+            if current_chunk.strip():
+                chunks.append(current_chunk.strip())
+            current_chunk = ""
+
+    # 残りのテキスト
+    if current_chunk.strip():
+        chunks.append(current_chunk.strip())
+
+    return chunks if chunks else [text]
+
+
+SPLITTERS = {
+    'morpheme': _split_morpheme,
+    'breakpoint': _split_breakpoint,
+    'punctuation': _split_punctuation
+}
+
+
+@functools.lru_cache(maxsize=MEMO_SIZE)
+def _split_memo(rule: str, text: str, max_length: int) -> tuple:
+    return tuple(SPLITTERS[rule](text, max_length))
+
+
+def split_text(text: str, max_length: int, rule: str = 'morpheme') -> List[str]:
+    """
+    1行を rule の方法で分割（同じ行・同じ設定の結果はメモ化される）
+    """
+    if rule not in SPLITTERS:
+        raise ValueError(f"Unknown split rule: {rule} (choose from {', '.join(SPLITTERS)})")
+    return list(_split_memo(rule, text, max_length))
+
+
+def _split_batch(rule: str, texts: Sequence[str], max_length: int) -> List[tuple]:
+    """
+    プロセスプールのワーカーで実行（ワーカーごとに Tokenizer を1回だけ作る）
+    """
+    return [_split_memo(rule, text, max_length) for text in texts]
+
+
+def split_texts(texts: Sequence[str], max_length: int, rule: str = 'morpheme', workers: int = 1) -> List[List[str]]:
+    """
+    複数の行をまとめて分割
+
+    重複する行は1回だけ分割する。workers が2以上で行数が多い場合はプロセスプールで分割する
+    （結果は入力の順序どおりで、workers によらず同じ）。
+    """
+    if rule not in SPLITTERS:
+        raise ValueError(f"Unknown split rule: {rule} (choose from {', '.join(SPLITTERS)})")
+
+    unique = list(dict.fromkeys(texts))
+    results: Dict[str, tuple] = {}
+
+    with tracing.span(f'split-{rule}', cat='text', texts=len(texts), unique=len(unique)) as sp:
+        if workers > 1 and len(unique) >= POOL_MIN_TEXTS:
+            size = -(-len(unique) // workers)
+            batches = [unique[i:i + size] for i in range(0, len(unique), size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for batch, parts in zip(batches, executor.map(_split_batch, [rule] * len(batches), batches,
+                                                              [max_length] * len(batches))):
+                    results.update(zip(batch, parts))
+            sp.set(workers=len(batches))
+        else:
+            results.update(zip(unique, _split_batch(rule, unique, max_length)))
+
+    return [list(results[text]) for text in texts]
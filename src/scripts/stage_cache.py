@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+パイプラインのステージキャッシュ
+各ステージ（音声抽出・音量解析・文字起こし・マージ）の出力ファイルを、
+入力のハッシュとパラメータから作ったキーで保存します。
+再実行時は入力もパラメータも変わっていないステージを実行せずに出力を復元します。
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import cache_store
+from loudness_cache import media_fingerprint
+
+CACHE_NAME = 'stages'
+CACHE_VERSION = 1
+STAGES = ('audio', 'analysis', 'transcript', 'merge')  # 実行順
+FULL_HASH_MAX_BYTES = 64 * 1024 * 1024  # これより大きいファイルは部分ハッシュ
+
+
+def input_digest(path: str) -> str:
+    """
+    入力ファイルのハッシュ
+
+    字幕やJSONなどの小さいファイルは全体を、動画のような大きいファイルは
+    サイズ・更新時刻・部分ハッシュ（loudness_cache.media_fingerprint）をハッシュする。
+    """
+    if os.path.getsize(path) > FULL_HASH_MAX_BYTES:
+        payload = json.dumps(media_fingerprint(path), sort_keys=True).encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_stage_key(stage: str, digests: List[str], params: Dict) -> str:
+    """
+    ステージ名・入力のハッシュ・パラメータからキャッシュキーを作成
+    """
+    return cache_store.make_key({'version': CACHE_VERSION, 'stage': stage, 'inputs': digests, 'params': params})
+
+
+class StageCache:
+    """
+    ステージ単位のキャッシュと、ヒット/ミスの記録
+
+    force=True なら全ステージを、from_stage を指定するとそのステージ以降を
+    キャッシュを読まずに実行する（結果はキャッシュに保存し直す）。
+    enabled=False なら常に実行し、何も保存しない。
+    """
+
+    def __init__(self, force: bool = False, from_stage: str = None, enabled: bool = True):
+        if from_stage is not None and from_stage not in STAGES:
+            raise ValueError(f"Unknown stage: {from_stage} (choose from {', '.join(STAGES)})")
+        self.force = force
+        self.from_stage = from_stage
+        self.enabled = enabled
+        self.records = []
+
+    def key(self, stage: str, inputs: List[str] = (), params: Dict = None, upstream: List[str] = ()) -> str:
+        """
+        ステージのキーを作成
+
+        inputs はハッシュする入力ファイル、upstream は入力を生成した上流ステージのキー
+        （上流の出力を作らずにキーを決めたい場合に使う）。
+        """
+        if not self.enabled:
+            return ''
+        digests = [input_digest(str(path)) for path in inputs] + list(upstream)
+        return make_stage_key(stage, digests, params or {})
+
+    def is_forced(self, stage: str) -> bool:
+        if self.force:
+            return True
+        return self.from_stage is not None and STAGES.index(stage) >= STAGES.index(self.from_stage)
+
+    def has(self, stage: str, key: str) -> bool:
+        """
+        キャッシュから復元できるか（強制実行するステージは False）
+        """
+        if not self.enabled or self.is_forced(stage):
+            return False
+        return (cache_store.get_cache_dir(CACHE_NAME) / key / 'meta.json').exists()
+
+    def run(self, stage: str, key: str, outputs: List[str], compute: Callable[[], None]) -> bool:
+        """
+        キャッシュがあれば outputs に復元し、なければ compute() で outputs を作って保存
+
+        Returns:
+            キャッシュから復元した場合は True
+        """
+        if not self.enabled:
+            compute()
+            return False
+
+        if self.restore(stage, key, outputs):
+            return True
+
+        start = time.perf_counter()
+        compute()
+        try:
+            self._store(stage, key, outputs)
+        except OSError as e:
+            print(f"Warning: Failed to write stage cache: {e}", file=sys.stderr)
+
+        self._record(stage, key, 'forced' if self.is_forced(stage) else 'miss', start)
+        return False
+
+    def restore(self, stage: str, key: str, outputs: List[str]) -> bool:
+        """
+        キャッシュがあれば outputs に復元してヒットを記録（なければ何もしない）
+
+        Returns:
+            キャッシュから復元した場合は True
+        """
+        if not self.enabled:
+            return False
+
+        start = time.perf_counter()
+        if self.has(stage, key) and self._restore(key, outputs):
+            self._record(stage, key, 'hit', start)
+            return True
+        return False
+
+    def skip(self, stage: str, key: str) -> None:
+        """
+        後続ステージがすべてキャッシュにあるため実行不要だったステージを記録
+        """
+        if self.enabled:
+            self.records.append({'stage': stage, 'key': key, 'status': 'skipped', 'seconds': 0.0})
+
+    def _record(self, stage: str, key: str, status: str, start: float) -> None:
+        self.records.append({
+            'stage': stage,
+            'key': key,
+            'status': status,
+            'seconds': time.perf_counter() - start
+        })
+
+    def _restore(self, key: str, outputs: List[str]) -> bool:
+        entry_dir = cache_store.get_cache_dir(CACHE_NAME) / key
+        meta_path = entry_dir / 'meta.json'
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if len(meta['outputs']) != len(outputs):
+                return False
+            for name, output in zip(meta['outputs'], outputs):
+                shutil.copyfile(entry_dir / name, output)
+        except (OSError, ValueError, KeyError):
+            return False
+
+        cache_store.touch(meta_path)
+        return True
+
+    def _store(self, stage: str, key: str, outputs: List[str]) -> None:
+        with cache_store.write_entry(CACHE_NAME, key) as tmp_dir:
+            names = []
+            for i, output in enumerate(outputs):
+                name = f'output-{i}{Path(output).suffix}'
+                shutil.copyfile(output, tmp_dir / name)
+                names.append(name)
+
+            cache_store.write_meta(tmp_dir, {
+                'version': CACHE_VERSION,
+                'stage': stage,
+                'outputs': names,
+                'created': time.time()
+            })
+
+    def report(self, file=sys.stderr) -> None:
+        """
+        ステージごとのヒット/ミスを表示
+        """
+        if not self.records:
+            return
+        print("\nStage cache:", file=file)
+        for record in self.records:
+            print(f"  {record['stage']:<12} {record['status']:<8} {record['key'][:12]}  {record['seconds']:7.2f}s",
+                  file=file)
+        hits = sum(1 for r in self.records if r['status'] in ('hit', 'skipped'))
+        print(f"  {hits}/{len(self.records)} stages reused", file=file)
+
+
+def purge(stage: str = None) -> int:
+    """
+    キャッシュを削除し（stage を指定するとそのステージのみ）、削除したエントリ数を返す
+    """
+    entries = [e for e in cache_store.list_entries(CACHE_NAME)
+               if stage is None or cache_store.read_meta(e['path']).get('stage') == stage]
+    for entry in entries:
+        cache_store.remove_entry(entry)
+    return len(entries)
+
+
+def cache_from_env() -> StageCache:
+    """
+    TELOP_FORCE / TELOP_FROM_STAGE 環境変数から StageCache を作成（シェルスクリプト用）
+    """
+    return StageCache(force=os.environ.get('TELOP_FORCE') == '1',
+                      from_stage=os.environ.get('TELOP_FROM_STAGE') or None)
+
+
+def main():
+    commands = ('run', 'check', 'list', 'purge', 'evict')
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print("Usage: python stage_cache.py <run|check|list|purge|evict> ...", file=sys.stderr)
+        print("\nCommands:", file=sys.stderr)
+        print("  run STAGE [--input PATH]... [--param K=V]... [--output PATH]... [--capture] [--quiet] -- CMD...", file=sys.stderr)
+        print("                   Restore the outputs from the cache, or run CMD and cache them", file=sys.stderr)
+        print("                   --capture writes the stdout of CMD to the first output", file=sys.stderr)
+        print("                   --quiet discards the stderr of CMD", file=sys.stderr)
+        print("  check STAGE [--input PATH]... [--param K=V]...", file=sys.stderr)
+        print("                   Exit 0 if the stage would be restored from the cache", file=sys.stderr)
+        print("  list             Show cached stage outputs (most recently used first)", file=sys.stderr)
+        print("  purge [STAGE]    Delete cached outputs (of one stage)", file=sys.stderr)
+        print("  evict [--max-size MB]", file=sys.stderr)
+        print("                   Delete least recently used entries (of any cache) above the size limit",
+              file=sys.stderr)
+        print(f"\nStages: {', '.join(STAGES)}", file=sys.stderr)
+        print("Set TELOP_FORCE=1 to rerun every stage, or TELOP_FROM_STAGE=STAGE to rerun from STAGE on.", file=sys.stderr)
+        sys.exit(1)
+
+    command = sys.argv[1]
+
+    if command in ('list', 'evict'):
+        cache_store.main(CACHE_NAME, sys.argv[1:])
+        return
+
+    if command == 'purge':
+        stage = sys.argv[2] if len(sys.argv) > 2 else None
+        print(f"Removed {purge(stage)} entries", file=sys.stderr)
+        return
+
+    if len(sys.argv) < 3 or sys.argv[2] not in STAGES:
+        print(f"Error: Unknown stage (choose from {', '.join(STAGES)})", file=sys.stderr)
+        sys.exit(1)
+
+    stage = sys.argv[2]
+    inputs = []
+    params = {}
+    outputs = []
+    cmd = []
+    capture = False
+    quiet = False
+
+    # 引数パース（-- 以降は実行するコマンド）
+    i = 3
+    while i < len(sys.argv):
+        if sys.argv[i] == '--':
+            cmd = sys.argv[i + 1:]
+            break
+        elif sys.argv[i] == '--input' and i + 1 < len(sys.argv):
+            inputs.append(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--param' and i + 1 < len(sys.argv):
+            name, _, value = sys.argv[i + 1].partition('=')
+            params[name] = value
+            i += 2
+        elif sys.argv[i] == '--output' and i + 1 < len(sys.argv):
+            outputs.append(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--capture':
+            capture = True
+            i += 1
+        elif sys.argv[i] == '--quiet':
+            quiet = True
+            i += 1
+        else:
+            i += 1
+
+    for path in inputs:
+        if not Path(path).exists():
+            print(f"Error: File not found: {path}", file=sys.stderr)
+            sys.exit(1)
+
+    try:
+        cache = cache_from_env()
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    key = cache.key(stage, inputs, params)
+
+    if command == 'check':
+        sys.exit(0 if cache.has(stage, key) else 1)
+
+    if not cmd or not outputs:
+        print("Error: run requires --output and a command after --", file=sys.stderr)
+        sys.exit(1)
+
+    def compute():
+        stderr = subprocess.DEVNULL if quiet else None
+        if capture:
+            with open(outputs[0], 'wb') as f:
+                result = subprocess.run(cmd, stdout=f, stderr=stderr)
+        else:
+            result = subprocess.run(cmd, stderr=stderr)
+        if result.returncode != 0:
+            print(f"Error: {stage} stage failed: {' '.join(cmd)}", file=sys.stderr)
+            sys.exit(result.returncode)
+
+    cache.run(stage, key, outputs, compute)
+    record = cache.records[-1]
+    print(f"[cache] {stage}: {record['status']} ({key[:12]}, {record['seconds']:.2f}s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
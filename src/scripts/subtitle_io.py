@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+字幕ファイルの入出力
+SRT / WebVTT / JSON（generate-subtitles.py・merge-data.py の出力形式）を1キューずつ読み書きします。
+ファイル全体を読み込まずに行単位で処理するので、キュー数によらずメモリ使用量は一定です。
+CRLF の改行、BOM、キューの間の余分な空行、空行の抜けにも対応します。
+
+    for entry in subtitle_io.read_subtitles('input.srt'):
+        ...
+    subtitle_io.write_subtitles(entries, 'output.vtt')
+"""
+
+import re
+import sys
+import json
+import contextlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, TextIO, Union
+
+Source = Union[str, Path, TextIO]
+
+READ_CHARS = 256 * 1024
+JSON_READ_BYTES = 64 * 1024
+VTT_SKIP_BLOCKS = ('WEBVTT', 'NOTE', 'STYLE', 'REGION')
+# 空白だけの行も空行として扱う
+BLANK_LINES = re.compile(r'\n[ \t]*\n\s*')
+
+
+class SubtitleEntry:
+    """
+    字幕1件（時刻は秒）
+
+    extra には style や volumeLevel などの追加のフィールドを保持する。
+    """
+
+    __slots__ = ('id', 'start', 'end', 'text', 'extra')
+
+    def __init__(self, id, start: float, end: float, text: str, extra: Dict = None):
+        self.id = id
+        self.start = start
+        self.end = end
+        self.text = text
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'SubtitleEntry':
+        """
+        JSONの字幕（startTime / endTime、または start / end）から作成
+        """
+        if 'startTime' in data:
+            start, end = data['startTime'], data['endTime']
+            known = ('id', 'startTime', 'endTime', 'text')
+        else:
+            start, end = data['start'], data['end']
+            known = ('id', 'start', 'end', 'text')
+        extra = {k: v for k, v in data.items() if k not in known} or None
+        return cls(data.get('id'), start, end, data.get('text', ''), extra)
+
+    def to_dict(self) -> Dict:
+        """
+        JSONの字幕形式（id, startTime, endTime, text, 追加のフィールド）に変換
+        """
+        data = {'id': self.id, 'startTime': self.start, 'endTime': self.end, 'text': self.text}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __eq__(self, other):
+        if not isinstance(other, SubtitleEntry):
+            return NotImplemented
+        return (self.id, self.start, self.end, self.text, self.extra) == \
+            (other.id, other.start, other.end, other.text, other.extra)
+
+    def __repr__(self):
+        return f"SubtitleEntry(id={self.id!r}, start={self.start!r}, end={self.end!r}, text={self.text!r})"
+
+
+def _as_entry(item) -> SubtitleEntry:
+    return item if isinstance(item, SubtitleEntry) else SubtitleEntry.from_dict(item)
+
+
+@contextlib.contextmanager
+def _open_text(source: Source, mode: str = 'r'):
+    """
+    パスならファイルを開き、ファイルオブジェクトならそのまま使う
+    """
+    if hasattr(source, 'read') or hasattr(source, 'write'):
+        yield source
+        return
+    # 読み込みは BOM を除去し、改行は CRLF / CR も LF に変換される
+    encoding = 'utf-8-sig' if mode == 'r' else 'utf-8'
+    with open(source, mode, encoding=encoding, newline=None if mode == 'r' else '') as f:
+        yield f
+
+
+def parse_timestamp(value: str) -> float:
+    """
+    HH:MM:SS,mmm（SRT）/ HH:MM:SS.mmm / MM:SS.mmm（WebVTT）を秒に変換
+    """
+    parts = value.split(':')
+    if len(parts) == 3:
+        return int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2].replace(',', '.'))
+    if len(parts) == 2:
+        return int(parts[0]) * 60 + float(parts[1].replace(',', '.'))
+    raise ValueError(f"Invalid timestamp: {value}")
+
+
+def parse_timing(line: str) -> tuple:
+    """
+    "開始 --> 終了 [WebVTTの設定]" を (start, end) に変換
+    """
+    start, _, rest = line.partition('-->')
+    fields = rest.split(None, 1)
+    if not fields:
+        raise ValueError(f"Invalid timing line: {line}")
+    return parse_timestamp(start), parse_timestamp(fields[0])
+
+
+def format_timestamp(seconds: float, separator: str = ',') -> str:
+    """
+    秒をSRT（separator=','）/ WebVTT（separator='.'）のタイムスタンプに変換
+
+    ミリ秒に丸めるので、読み込んだ時刻を書き出しても同じタイムスタンプになる。
+    """
+    millis = max(0, round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+def _iter_blocks(f: TextIO) -> Iterator[str]:
+    """
+    空行で区切られたブロックを、READ_CHARS 文字ずつ読みながら1つずつ取り出す
+    """
+    rest = ''
+    while True:
+        chunk = f.read(READ_CHARS)
+        if not chunk:
+            break
+        blocks = BLANK_LINES.split(rest + chunk)
+        # 最後のブロックは次の読み込みに続いている可能性がある
+        rest = blocks.pop()
+        for block in blocks:
+            if block.strip():
+                yield block
+    if rest.strip():
+        yield rest
+
+
+def _iter_cues(blocks: Iterable[str], vtt: bool = False) -> Iterator[SubtitleEntry]:
+    """
+    SRT / WebVTT のブロックからキューを1件ずつ取り出す
+
+    ブロックは通常「番号（WebVTTでは省略可）・時刻・テキスト」だが、
+    キューの間の空行が抜けていると1つのブロックに複数のキューが入るので、行ごとに区切り直す。
+    """
+    count = 0
+
+    for block in blocks:
+        block = block.strip('\n')
+        # WebVTT のヘッダーや NOTE / STYLE / REGION ブロック
+        if vtt and block.startswith(VTT_SKIP_BLOCKS):
+            continue
+
+        lines = block.split('\n')
+
+        # よくある「番号・時刻・テキスト」のブロックは関数呼び出しを省いて直接パースする
+        if len(lines) >= 3 and '-->' in lines[1] and block.count('-->') == 1:
+            start, _, end = lines[1].partition('-->')
+            try:
+                hours, minutes, seconds = start.split(':')
+                start = int(hours) * 3600 + int(minutes) * 60 + float(seconds.replace(',', '.'))
+                hours, minutes, seconds = end.split(None, 1)[0].split(':')
+                end = int(hours) * 3600 + int(minutes) * 60 + float(seconds.replace(',', '.'))
+            except ValueError:
+                pass
+            else:
+                count += 1
+                cue_id = lines[0].strip()
+                yield SubtitleEntry(int(cue_id) if cue_id.isdigit() else count, start, end,
+                                    lines[2] if len(lines) == 3 else '\n'.join(lines[2:]))
+                continue
+
+        cues = []  # [番号, 時刻の行, テキストの行]
+
+        if block.count('-->') == 1:
+            index = 0 if '-->' in lines[0] else 1
+            if index < len(lines) and '-->' in lines[index]:
+                cues.append([lines[index - 1] if index else '', lines[index], lines[index + 1:]])
+        else:
+            for i, line in enumerate(lines):
+                if '-->' in line:
+                    # 直前の行が数字だけなら次のキューの番号
+                    cue_id = ''
+                    if cues and cues[-1][2] and cues[-1][2][-1].strip().isdigit():
+                        cue_id = cues[-1][2].pop()
+                    elif not cues and i > 0:
+                        cue_id = lines[i - 1]
+                    cues.append([cue_id, line, []])
+                elif cues:
+                    cues[-1][2].append(line)
+
+        for cue_id, timing_line, text_lines in cues:
+            if not text_lines:
+                continue
+            try:
+                start, end = parse_timing(timing_line)
+            except ValueError:
+                continue
+            count += 1
+            cue_id = cue_id.strip()
+            yield SubtitleEntry(int(cue_id) if cue_id.isdigit() else count, start, end, '\n'.join(text_lines))
+
+
+def iter_srt(source: Source) -> Iterator[SubtitleEntry]:
+    """
+    SRTを1キューずつ読む
+    """
+    with _open_text(source) as f:
+        yield from _iter_cues(_iter_blocks(f))
+
+
+def iter_vtt(source: Source) -> Iterator[SubtitleEntry]:
+    """
+    WebVTTを1キューずつ読む（識別子が番号でないキューは出現順の番号になる）
+    """
+    with _open_text(source) as f:
+        yield from _iter_cues(_iter_blocks(f), vtt=True)
+
+
+def iter_json(source: Source, key: str = 'subtitles') -> Iterator[SubtitleEntry]:
+    """
+    JSONの字幕配列（{"subtitles": [...]} またはトップレベルの配列）を1件ずつ読む
+
+    配列の要素を JSONDecoder.raw_decode で順にデコードするので、ファイル全体は読み込まない。
+    """
+    decoder = json.JSONDecoder()
+
+    with _open_text(source) as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def fill() -> bool:
+            nonlocal buffer, pos, eof
+            if eof:
+                return False
+            chunk = f.read(JSON_READ_BYTES)
+            if not chunk:
+                eof = True
+                return False
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return True
+
+        def skip_whitespace(chars: str = ' \t\r\n') -> None:
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer) or not fill():
+                    return
+
+        # 配列の開始位置を探す
+        skip_whitespace()
+        if buffer[pos:pos + 1] != '[':
+            marker = json.dumps(key)
+            while True:
+                found = buffer.find(marker, pos)
+                if found >= 0:
+                    pos = found + len(marker)
+                    break
+                # キーが読み込みの境界をまたぐ場合に備えて末尾を残す
+                pos = max(pos, len(buffer) - len(marker))
+                if not fill():
+                    raise ValueError(f"No \"{key}\" array found in JSON")
+            skip_whitespace(' \t\r\n:')
+            if buffer[pos:pos + 1] != '[':
+                raise ValueError(f"\"{key}\" is not an array")
+        pos += 1
+
+        while True:
+            skip_whitespace(' \t\r\n,')
+            if pos >= len(buffer):
+                raise ValueError("Unexpected end of JSON")
+            if buffer[pos] == ']':
+                return
+
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                    break
+                except json.JSONDecodeError:
+                    # 要素が読み込みの境界をまたいでいる
+                    if not fill():
+                        raise
+            pos = end
+            yield SubtitleEntry.from_dict(item)
+
+
+READERS = {'.srt': iter_srt, '.vtt': iter_vtt, '.json': iter_json}
+
+
+def read_subtitles(path: Union[str, Path]) -> Iterator[SubtitleEntry]:
+    """
+    拡張子（.srt / .vtt / .json）に応じて字幕を1件ずつ読む
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix not in READERS:
+        raise ValueError(f"Unsupported subtitle format: {path} (expected {', '.join(READERS)})")
+    return READERS[suffix](path)
+
+
+def write_srt(entries: Iterable, dest: Source) -> int:
+    """
+    字幕（SubtitleEntry または JSONの字幕の辞書）をSRTで書き出し、件数を返す
+    """
+    count = 0
+    with _open_text(dest, 'w') as f:
+        for item in entries:
+            entry = _as_entry(item)
+            f.write(f"{entry.id}\n"
+                    f"{format_timestamp(entry.start)} --> {format_timestamp(entry.end)}\n"
+                    f"{entry.text}\n\n")
+            count += 1
+    return count
+
+
+def write_vtt(entries: Iterable, dest: Source) -> int:
+    """
+    字幕をWebVTTで書き出し、件数を返す
+    """
+    count = 0
+    with _open_text(dest, 'w') as f:
+        f.write("WEBVTT\n\n")
+        for item in entries:
+            entry = _as_entry(item)
+            f.write(f"{entry.id}\n"
+                    f"{format_timestamp(entry.start, '.')} --> {format_timestamp(entry.end, '.')}\n"
+                    f"{entry.text}\n\n")
+            count += 1
+    return count
+
+
+def _indent(text: str, prefix: str) -> str:
+    return text.replace('\n', '\n' + prefix)
+
+
+def write_json(data: Dict, dest: Source, key: str = 'subtitles') -> int:
+    """
+    data[key] の字幕を1件ずつ書き出しながら data をJSONで出力し、件数を返す
+
+    出力は json.dump(data, indent=2, ensure_ascii=False) と同じになる。
+    data[key] はジェネレーターでもよい（SubtitleEntry は to_dict() で変換する）。
+    """
+    count = 0
+    with _open_text(dest, 'w') as f:
+        f.write('{')
+        for index, (name, value) in enumerate(data.items()):
+            f.write(',\n  ' if index else '\n  ')
+            f.write(json.dumps(name, ensure_ascii=False) + ': ')
+
+            if name != key:
+                f.write(_indent(json.dumps(value, indent=2, ensure_ascii=False), '  '))
+                continue
+
+            f.write('[')
+            for item in value:
+                if isinstance(item, SubtitleEntry):
+                    item = item.to_dict()
+                f.write(',\n    ' if count else '\n    ')
+                f.write(_indent(json.dumps(item, indent=2, ensure_ascii=False), '    '))
+                count += 1
+            f.write('\n  ]' if count else ']')
+        f.write('\n}' if data else '}')
+    return count
+
+
+def write_subtitles(entries: Iterable, path: Union[str, Path], data: Dict = None) -> int:
+    """
+    拡張子（.srt / .vtt / .json）に応じて字幕を書き出し、件数を返す
+
+    JSONの場合、data に字幕以外のフィールド（video_path など）を渡せる。
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix == '.srt':
+        return write_srt(entries, path)
+    if suffix == '.vtt':
+        return write_vtt(entries, path)
+    if suffix == '.json':
+        return write_json({**(data or {}), 'subtitles': entries}, path)
+    raise ValueError(f"Unsupported subtitle format: {path} (expected .srt, .vtt, .json)")
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python subtitle_io.py <input.(srt|vtt|json)> <output.(srt|vtt|json)>", file=sys.stderr)
+        print("\nConverts between subtitle formats one cue at a time.", file=sys.stderr)
+        sys.exit(1)
+
+    input_path = sys.argv[1]
+    output_path = sys.argv[2]
+
+    if not Path(input_path).exists():
+        print(f"Error: File not found: {input_path}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        count = write_subtitles(read_subtitles(input_path), output_path)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Converted {count} subtitles to: {output_path}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+字幕の列指向テーブル
+開始・終了時刻を NumPy 配列、ID・テキストをリストで持ち、時刻の操作（オフセット・伸縮・範囲の制限・
+重なりの検出・隙間の詰め・最短表示時間・分割した字幕への時間の配分）を字幕ごとの辞書を作らずに
+配列演算でまとめて行います。JSONの字幕形式（id, startTime, endTime, text, ...）と相互に変換できます。
+
+    table = SubtitleTable.from_dicts(data['subtitles'])
+    table.offset(1.5).clamp(0.0, duration).enforce_min_duration(0.8)
+    data['subtitles'] = table.to_dicts()
+"""
+
+import sys
+import itertools
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+import numpy as np
+
+import subtitle_io
+from subtitle_io import SubtitleEntry
+
+KNOWN_FIELDS = ('id', 'startTime', 'endTime', 'text')
+
+# 追加の列でその字幕に値がないことを表す（to_dicts() でキーを出力しない）
+MISSING = object()
+
+
+class SubtitleTable:
+    """
+    字幕のテーブル
+
+    start / end は float64 の配列、ids / texts はリスト、columns は追加の列
+    （style・volumeLevel など。列名 → リストまたは配列）。
+    時刻の操作はテーブル自身を書き換えて self を返すので、続けて呼び出せる。
+    """
+
+    __slots__ = ('ids', 'start', 'end', 'texts', 'columns')
+
+    def __init__(self, start, end, texts: Sequence[str], ids: Sequence = None, columns: Dict = None):
+        self.start = np.array(start, dtype=np.float64)
+        self.end = np.array(end, dtype=np.float64)
+        self.texts = list(texts)
+        self.ids = list(ids) if ids is not None else list(range(1, len(self.texts) + 1))
+        self.columns = dict(columns or {})
+
+        n = len(self.texts)
+        if self.start.shape != (n,) or self.end.shape != (n,) or len(self.ids) != n:
+            raise ValueError("start, end, texts and ids must have the same length")
+        for name, values in self.columns.items():
+            if len(values) != n:
+                raise ValueError(f"Column {name} has {len(values)} values for {n} subtitles")
+
+    @classmethod
+    def from_dicts(cls, subtitles: Sequence[Dict]) -> 'SubtitleTable':
+        """
+        JSONの字幕（id, startTime, endTime, text と追加のフィールド）のリストから作成
+        """
+        n = len(subtitles)
+        start = np.fromiter((sub['startTime'] for sub in subtitles), dtype=np.float64, count=n)
+        end = np.fromiter((sub['endTime'] for sub in subtitles), dtype=np.float64, count=n)
+
+        # 追加のフィールドは出現順に列にする
+        names = {}
+        for sub in subtitles:
+            for key in sub:
+                if key not in KNOWN_FIELDS:
+                    names[key] = None
+        columns = {name: [sub.get(name, MISSING) for sub in subtitles] for name in names}
+
+        return cls(start, end, [sub.get('text', '') for sub in subtitles],
+                   [sub.get('id') for sub in subtitles], columns)
+
+    @classmethod
+    def from_entries(cls, entries: Iterable) -> 'SubtitleTable':
+        """
+        subtitle_io.SubtitleEntry（または JSONの字幕の辞書）から作成
+        """
+        return cls.from_dicts([entry.to_dict() if isinstance(entry, SubtitleEntry) else entry
+                               for entry in entries])
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'SubtitleTable':
+        """
+        字幕データ（{"subtitles": [...]}）から作成
+        """
+        return cls.from_dicts(data['subtitles'])
+
+    def to_dicts(self) -> List[Dict]:
+        """
+        JSONの字幕のリストに変換（時刻は Python の float になる）
+        """
+        columns = [(name, values.tolist() if isinstance(values, np.ndarray) else values)
+                   for name, values in self.columns.items()]
+        subtitles = []
+
+        for i, (entry_id, start, end, text) in enumerate(zip(self.ids, self.start.tolist(),
+                                                             self.end.tolist(), self.texts)):
+            sub = {'id': entry_id, 'startTime': start, 'endTime': end, 'text': text}
+            for name, values in columns:
+                if values[i] is not MISSING:
+                    sub[name] = values[i]
+            subtitles.append(sub)
+
+        return subtitles
+
+    def entries(self) -> Iterator[SubtitleEntry]:
+        """
+        subtitle_io.SubtitleEntry として1件ずつ返す（subtitle_io の書き出しに渡せる）
+        """
+        for sub in self.to_dicts():
+            yield SubtitleEntry.from_dict(sub)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def durations(self) -> np.ndarray:
+        return self.end - self.start
+
+    def copy(self) -> 'SubtitleTable':
+        return self.take(np.arange(len(self)))
+
+    def take(self, index) -> 'SubtitleTable':
+        """
+        index（位置の配列・ブール配列・スライス）の字幕だけを持つ新しいテーブル
+        """
+        positions = np.arange(len(self))[index]
+        position_list = positions.tolist()
+        columns = {name: values[positions] if isinstance(values, np.ndarray)
+                   else list(map(values.__getitem__, position_list))
+                   for name, values in self.columns.items()}
+        return SubtitleTable(self.start[positions], self.end[positions],
+                             list(map(self.texts.__getitem__, position_list)),
+                             list(map(self.ids.__getitem__, position_list)), columns)
+
+    def sort(self) -> 'SubtitleTable':
+        """
+        開始時刻順に並べ替えた新しいテーブル（同じ開始時刻は元の順序を保つ）
+        """
+        if len(self) < 2 or not np.any(self.start[1:] < self.start[:-1]):
+            return self
+        return self.take(np.argsort(self.start, kind='stable'))
+
+    def index_of(self, entry_id) -> int:
+        """
+        ID が entry_id の字幕の位置
+        """
+        try:
+            return self.ids.index(entry_id)
+        except ValueError:
+            raise KeyError(f"No subtitle with id {entry_id}")
+
+    def renumber(self, first: int = 1) -> 'SubtitleTable':
+        """
+        ID を first からの連番に振り直す
+        """
+        self.ids = list(range(first, first + len(self)))
+        return self
+
+    def offset(self, seconds: float, where=slice(None)) -> 'SubtitleTable':
+        """
+        where（スライス・ブール配列・位置の配列）の字幕の時刻を seconds ずらす（0秒未満は0秒にする）
+
+        ある字幕以降をずらす場合は where=slice(table.index_of(entry_id), None)。
+        """
+        self.start[where] = np.maximum(self.start[where] + seconds, 0.0)
+        self.end[where] = np.maximum(self.end[where] + seconds, 0.0)
+        return self
+
+    def scale(self, factor: float, origin: float = 0.0) -> 'SubtitleTable':
+        """
+        origin を基準に時刻を factor 倍する（再生速度やフレームレートの変更）
+        """
+        self.start = origin + (self.start - origin) * factor
+        self.end = origin + (self.end - origin) * factor
+        return self
+
+    def clamp(self, lower: float = 0.0, upper: float = None) -> 'SubtitleTable':
+        """
+        時刻を [lower, upper] の範囲に収める
+        """
+        np.clip(self.start, lower, upper, out=self.start)
+        np.clip(self.end, lower, upper, out=self.end)
+        return self
+
+    def overlaps(self) -> np.ndarray:
+        """
+        次の字幕と表示時間が重なっている字幕の位置（開始時刻順に並んでいること）
+        """
+        return np.flatnonzero(self.end[:-1] > self.start[1:])
+
+    def fill_gaps(self, max_gap: float) -> 'SubtitleTable':
+        """
+        次の字幕までの隙間が max_gap 秒以下なら、終了時刻を次の字幕の開始時刻まで延ばす
+        """
+        gap = self.start[1:] - self.end[:-1]
+        fill = (gap > 0) & (gap <= max_gap)
+        self.end[:-1][fill] = self.start[1:][fill]
+        return self
+
+    def enforce_min_duration(self, min_duration: float, allow_overlap: bool = False) -> 'SubtitleTable':
+        """
+        表示時間が min_duration 秒未満の字幕の終了時刻を延ばす
+
+        allow_overlap が False の場合は次の字幕の開始時刻までしか延ばさない（開始時刻順に並んでいること）。
+        """
+        target = self.start + min_duration
+        if not allow_overlap and len(self) > 1:
+            target[:-1] = np.minimum(target[:-1], self.start[1:])
+        np.maximum(self.end, target, out=self.end)
+        return self
+
+    def split(self, parts: Sequence[Sequence[str]]) -> 'SubtitleTable':
+        """
+        字幕 i を parts[i] のテキストに分割し、表示時間を均等に配分した新しいテーブル
+
+        分割しない字幕（parts[i] が1つ）は時刻・ID をそのまま、分割した字幕の ID は "元のID-番号" になる
+        （連番にする場合は renumber()）。parts[i] が空の字幕は取り除かれる。追加の列は分割後の字幕に引き継ぐ。
+        """
+        if len(parts) != len(self):
+            raise ValueError(f"Got {len(parts)} part lists for {len(self)} subtitles")
+
+        counts = np.array(list(map(len, parts)), dtype=np.int64)
+        rows = np.repeat(np.arange(len(self)), counts)
+        offsets = np.cumsum(counts) - counts
+        k = np.arange(len(rows)) - offsets[rows]
+        row_counts = counts[rows]
+
+        row_start = self.start[rows]
+        duration = (self.end - self.start)[rows] / row_counts
+        start = row_start + k * duration
+        end = np.where(row_counts == 1, self.end[rows], row_start + (k + 1) * duration)
+
+        row_list = rows.tolist()
+        ids = list(map(self.ids.__getitem__, row_list))
+        for i, number in zip(np.flatnonzero(row_counts > 1).tolist(), (k[row_counts > 1] + 1).tolist()):
+            ids[i] = f"{ids[i]}-{number}"
+
+        columns = {name: values[rows] if isinstance(values, np.ndarray) else list(map(values.__getitem__, row_list))
+                   for name, values in self.columns.items()}
+        texts = list(itertools.chain.from_iterable(parts))
+
+        return SubtitleTable(start, end, texts, ids, columns)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Usage: python subtitle_table.py <input.(srt|vtt|json)> <output.(srt|vtt|json)> [options]", file=sys.stderr)
+        print("\nOptions (applied in this order):", file=sys.stderr)
+        print("  --offset SEC         Shift all subtitles by SEC seconds", file=sys.stderr)
+        print("  --from-id ID         Apply --offset only from the subtitle with this id onward", file=sys.stderr)
+        print("  --scale FACTOR       Multiply all times by FACTOR", file=sys.stderr)
+        print("  --max-time SEC       Clamp times to [0, SEC]", file=sys.stderr)
+        print("  --fill-gaps SEC      Extend subtitles to the next one across gaps up to SEC seconds", file=sys.stderr)
+        print("  --min-duration SEC   Extend subtitles shorter than SEC seconds (up to the next one)", file=sys.stderr)
+        sys.exit(1)
+
+    input_path = sys.argv[1]
+    output_path = sys.argv[2]
+    offset = 0.0
+    from_id = None
+    scale = 1.0
+    max_time = None
+    max_gap = None
+    min_duration = None
+
+    # 引数パース
+    i = 3
+    while i < len(sys.argv):
+        if sys.argv[i] == '--offset' and i + 1 < len(sys.argv):
+            offset = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--from-id' and i + 1 < len(sys.argv):
+            from_id = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--scale' and i + 1 < len(sys.argv):
+            scale = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--max-time' and i + 1 < len(sys.argv):
+            max_time = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--fill-gaps' and i + 1 < len(sys.argv):
+            max_gap = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--min-duration' and i + 1 < len(sys.argv):
+            min_duration = float(sys.argv[i + 1])
+            i += 2
+        else:
+            i += 1
+
+    if not Path(input_path).exists():
+        print(f"Error: File not found: {input_path}", file=sys.stderr)
+        sys.exit(1)
+
+    table = SubtitleTable.from_entries(subtitle_io.read_subtitles(input_path)).sort()
+
+    where = slice(None)
+    if from_id is not None:
+        # SRT の番号は整数、merge-data.py の分割後の ID は文字列
+        entry_id = int(from_id) if from_id.isdigit() else from_id
+        where = slice(table.index_of(entry_id), None)
+
+    table.offset(offset, where).scale(scale).clamp(0.0, max_time)
+    if max_gap is not None:
+        table.fill_gaps(max_gap)
+    if min_duration is not None:
+        table.enforce_min_duration(min_duration)
+
+    overlaps = table.overlaps()
+    if len(overlaps):
+        print(f"Warning: {len(overlaps)} subtitles overlap the next one "
+              f"(first: id {table.ids[overlaps[0]]})", file=sys.stderr)
+
+    count = subtitle_io.write_subtitles(table.entries(), output_path)
+    print(f"Retimed {count} subtitles to: {output_path}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+処理時間のトレース
+各スクリプトの処理区間（スパン）の開始・終了時刻、サブプロセスの実行時間、
+処理件数を記録し、Chrome / Perfetto で開ける trace.json に書き出します。
+無効時の span() は共有の何もしないオブジェクトを返すだけなので、ほぼコストがかかりません。
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 子プロセスがイベントを書き出すディレクトリ（enable() が設定し、子プロセスに引き継がれる）
+SPOOL_ENV = 'TELOP_TRACE_SPOOL'
+
+# perf_counter をエポック基準に換算するオフセット（プロセス間で時刻をそろえる）
+_EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+_events: Optional[List[Dict]] = None  # None のときは無効
+_output_path: Optional[str] = None
+_owner_pid: Optional[int] = None  # trace.json を書き出すプロセス
+_spool_dir: Optional[str] = None
+_flush_count = 0
+
+
+def _now_us() -> float:
+    return (time.perf_counter_ns() + _EPOCH_OFFSET_NS) / 1000.0
+
+
+class _NullSpan:
+    """
+    無効時に返す何もしないスパン
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """
+    処理区間を1つ記録するコンテキストマネージャ
+
+    set() で件数などの属性を追加できる。
+    """
+
+    __slots__ = ('name', 'cat', 'args', '_start')
+
+    def __init__(self, name: str, cat: str, args: Dict):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = _now_us()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+
+        events = _events
+        if events is not None:
+            events.append({
+                'name': self.name,
+                'cat': self.cat,
+                'ph': 'X',
+                'ts': self._start,
+                'dur': end - self._start,
+                'pid': os.getpid(),
+                'tid': threading.get_native_id(),
+                'args': self.args
+            })
+        return False
+
+    def set(self, **args) -> None:
+        self.args.update(args)
+
+
+def is_enabled() -> bool:
+    return _events is not None
+
+
+def span(name: str, cat: str = 'stage', **args):
+    """
+    処理区間を記録する
+
+        with tracing.span('decode', cat='ffmpeg') as sp:
+            ...
+            sp.set(samples=n)
+    """
+    if _events is None:
+        return _NULL_SPAN
+    return Span(name, cat, args)
+
+
+def traced(name: str = None, cat: str = 'stage'):
+    """
+    関数呼び出し全体をスパンとして記録するデコレーター
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _events is None:
+                return func(*args, **kwargs)
+            with Span(span_name, cat, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run(cmd: list, name: str = None, **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run を実行し、その実行時間をスパンとして記録
+    """
+    if _events is None:
+        return subprocess.run(cmd, **kwargs)
+
+    with Span(name or Path(cmd[0]).name, 'subprocess', {'cmd': ' '.join(map(str, cmd))}) as sp:
+        result = subprocess.run(cmd, **kwargs)
+        sp.set(returncode=result.returncode)
+    return result
+
+
+def _process_name_event() -> Dict:
+    return {
+        'name': 'process_name',
+        'ph': 'M',
+        'pid': os.getpid(),
+        'args': {'name': Path(sys.argv[0]).name if sys.argv and sys.argv[0] else 'python'}
+    }
+
+
+def enable(output_path: str) -> None:
+    """
+    トレースを有効にし、終了時に output_path へ trace.json を書き出す
+
+    子プロセス（同じ環境変数を引き継いだスクリプト）のイベントもまとめて書き出す。
+    """
+    global _events, _output_path, _spool_dir, _owner_pid
+
+    _owner_pid = os.getpid()
+    if _events is not None and _spool_dir is None:
+        _output_path = output_path
+        return
+
+    _events = []
+    _output_path = output_path
+    _spool_dir = tempfile.mkdtemp(prefix='telop-trace-')
+    os.environ[SPOOL_ENV] = _spool_dir
+    atexit.register(save)
+
+
+def _enable_child(spool_dir: str) -> None:
+    """
+    親プロセスのトレースに参加する（終了時にイベントを spool_dir に書き出す）
+    """
+    global _events
+    _events = []
+    atexit.register(flush, spool_dir)
+
+
+def flush(spool_dir: str = None) -> None:
+    """
+    子プロセスで記録したイベントを親プロセスのディレクトリに書き出す
+
+    プロセスプールのワーカーのように atexit が呼ばれないプロセスでは明示的に呼ぶ。
+    """
+    global _flush_count
+
+    spool_dir = spool_dir or os.environ.get(SPOOL_ENV)
+    if _events is None or not _events or not spool_dir or os.getpid() == _owner_pid:
+        return
+
+    events, _events[:] = list(_events), []
+    _flush_count += 1
+    path = Path(spool_dir) / f'events-{os.getpid()}-{_flush_count}.json'
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([_process_name_event()] + events, f, ensure_ascii=False)
+    except OSError:
+        pass
+
+
+def collect_events() -> List[Dict]:
+    """
+    このプロセスと子プロセスのイベントを時刻順に集める
+    """
+    if _events is None:
+        return []
+
+    events = [_process_name_event()] + list(_events)
+    if _spool_dir and Path(_spool_dir).exists():
+        for path in sorted(Path(_spool_dir).glob('events-*.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    events.extend(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    # プロセス名のメタデータは1プロセスにつき1つ
+    seen = set()
+    unique = []
+    for event in events:
+        if event['ph'] == 'M':
+            if event['pid'] in seen:
+                continue
+            seen.add(event['pid'])
+        unique.append(event)
+
+    unique.sort(key=lambda e: e.get('ts', 0))
+    return unique
+
+
+def summarize(events: List[Dict]) -> List[Dict]:
+    """
+    スパン名ごとの回数と合計時間（秒）を合計時間の降順で返す
+    """
+    totals = {}
+    for event in events:
+        if event['ph'] != 'X':
+            continue
+        entry = totals.setdefault(event['name'], {'name': event['name'], 'count': 0, 'seconds': 0.0})
+        entry['count'] += 1
+        entry['seconds'] += event['dur'] / 1e6
+
+    return sorted(totals.values(), key=lambda e: e['seconds'], reverse=True)
+
+
+def save() -> Optional[List[Dict]]:
+    """
+    trace.json を書き出す（enable() したプロセスで一度だけ実行される）
+    """
+    global _output_path, _spool_dir
+
+    if _events is None or _output_path is None or os.getpid() != _owner_pid:
+        return None
+
+    events = collect_events()
+    with open(_output_path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+    print(f"Trace saved to: {_output_path}", file=sys.stderr)
+
+    if _spool_dir:
+        for path in Path(_spool_dir).glob('events-*.json'):
+            path.unlink()
+        Path(_spool_dir).rmdir()
+        if os.environ.get(SPOOL_ENV) == _spool_dir:
+            del os.environ[SPOOL_ENV]
+
+    _output_path = None
+    _spool_dir = None
+    return events
+
+
+def _reset_after_fork() -> None:
+    """
+    fork した子プロセスでは親のイベントを引き継がない
+    """
+    global _events
+    if _events is not None:
+        _events = []
+
+
+# 親プロセスがトレース中なら自動的に参加する
+if os.environ.get(SPOOL_ENV):
+    _enable_child(os.environ[SPOOL_ENV])
+
+os.register_at_fork(after_in_child=_reset_after_fork)
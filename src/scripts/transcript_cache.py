@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+文字起こしキャッシュ
+Whisper の生の文字起こし結果（segments / words を含む verbose_json）を保存し、
+字幕の分割設定（1行の文字数など）だけを変えた再生成で再び文字起こししないようにします。
+
+キャッシュキーは音声の指紋（動画ならサイズ・更新時刻・部分ハッシュ、WAVならPCMデータのハッシュ）と
+バックエンド・モデル・言語から作られます。字幕の分割パラメータはキーに含まれません。
+"""
+
+import json
+import time
+import wave
+import hashlib
+from pathlib import Path
+from typing import Dict, Optional
+
+import cache_store
+from loudness_cache import media_fingerprint
+from whisper_worker import DEFAULT_MODEL, default_backend
+
+CACHE_NAME = 'transcripts'
+CACHE_VERSION = 1
+
+
+def audio_fingerprint(path: str) -> Dict:
+    """
+    音声の指紋を作成
+
+    WAVはPCMデータ自体をハッシュするので、同じ動画から抽出し直したWAVも同じ指紋になる。
+    それ以外（動画）は loudness_cache.media_fingerprint を使う。
+    """
+    if Path(path).suffix.lower() != '.wav':
+        return media_fingerprint(path)
+
+    digest = hashlib.sha256()
+    with wave.open(path, 'rb') as wav:
+        params = {'sample_rate': wav.getframerate(), 'channels': wav.getnchannels(),
+                  'sample_width': wav.getsampwidth()}
+        while True:
+            frames = wav.readframes(1024 * 1024)
+            if not frames:
+                break
+            digest.update(frames)
+
+    return {**params, 'pcm_hash': digest.hexdigest()}
+
+
+def transcription_params(use_local: bool = False, whisper_model: str = DEFAULT_MODEL,
+                         upload_format: str = 'wav', language: str = 'ja') -> Dict:
+    """
+    文字起こしのキャッシュキーに含めるパラメータ（字幕の分割設定は含めない）
+
+    文字起こしキャッシュと、process-video.py のステージキャッシュの transcript ステージで共通。
+    """
+    if use_local:
+        return {'backend': 'whisper-local', 'engine': default_backend(), 'model': whisper_model, 'language': language}
+
+    params = {'backend': 'whisper-api', 'model': 'whisper-1', 'language': language}
+    # WAV 以外のアップロード形式（可逆の FLAC も含む）は別のキーにする（wav は従来のキーのまま）
+    if upload_format != 'wav':
+        params['upload_format'] = upload_format
+    return params
+
+
+def make_cache_key(fingerprint: Dict, params: Dict) -> str:
+    """
+    指紋と文字起こしのパラメータからキャッシュキーを作成
+    """
+    return cache_store.make_key({'version': CACHE_VERSION, 'fingerprint': fingerprint, 'params': params})
+
+
+def load(media_path: str, params: Dict) -> Optional[Dict]:
+    """
+    キャッシュから文字起こし結果を読み込む（見つからない場合は None）
+    """
+    key = make_cache_key(audio_fingerprint(media_path), params)
+    entry_dir = cache_store.get_cache_dir(CACHE_NAME) / key
+    meta_path = entry_dir / 'meta.json'
+
+    if not meta_path.exists():
+        return None
+
+    try:
+        with open(entry_dir / 'transcript.json', 'r', encoding='utf-8') as f:
+            transcript = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    cache_store.touch(meta_path)
+    return transcript
+
+
+def store(media_path: str, params: Dict, transcript: Dict) -> Path:
+    """
+    文字起こし結果をキャッシュに保存し、全キャッシュの合計が上限を超えた分を古い順に削除
+    """
+    fingerprint = audio_fingerprint(media_path)
+    key = make_cache_key(fingerprint, params)
+
+    with cache_store.write_entry(CACHE_NAME, key) as tmp_dir:
+        with open(tmp_dir / 'transcript.json', 'w', encoding='utf-8') as f:
+            json.dump(transcript, f, ensure_ascii=False, default=float)
+        cache_store.write_meta(tmp_dir, {
+            'version': CACHE_VERSION,
+            'source': str(Path(media_path).resolve()),
+            'fingerprint': fingerprint,
+            'params': params,
+            'num_segments': len(transcript.get('segments') or []),
+            'created': time.time()
+        })
+
+    return cache_store.get_cache_dir(CACHE_NAME) / key
+
+
+if __name__ == '__main__':
+    cache_store.main(CACHE_NAME)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Whisper API の代替サーバー（テスト用）
+POST /v1/audio/transcriptions を受け付け、送られた音声（WAV / FLAC / Ogg Opus）の長さに合わせた
+ダミーの verbose_json（segments / words）を返します。長さが分からない形式でもエラーにはせず、
+SEGMENT_SECONDS の1区間分の結果を返します。
+APIキーなしで分割・並行文字起こしの動作や時刻のずれを確認するのに使います。
+
+    python whisper_stub_server.py --port 8765 &
+    python generate-subtitles.py video.mp4 --api-key dummy --api-base-url http://127.0.0.1:8765/v1
+"""
+
+import io
+import sys
+import json
+import time
+import wave
+import struct
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+TRANSCRIPTION_PATH = '/v1/audio/transcriptions'
+SEGMENT_SECONDS = 5.0  # ダミーのセグメント長
+WORDS_PER_SEGMENT = 4
+
+
+def parse_multipart(content_type: str, body: bytes) -> Dict:
+    """
+    multipart/form-data を {フィールド名: 値} に変換（ファイルはバイト列、それ以外は文字列）
+
+    同じ名前のフィールド（timestamp_granularities[] など）はリストにまとめる。
+    """
+    message = BytesParser(policy=HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode('latin-1') + body
+    )
+
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        payload = part.get_payload(decode=True)
+        value = payload if part.get_filename() else payload.decode('utf-8')
+        if name in fields:
+            if not isinstance(fields[name], list):
+                fields[name] = [fields[name]]
+            fields[name].append(value)
+        else:
+            fields[name] = value
+    return fields
+
+
+def audio_duration(audio: bytes) -> Optional[float]:
+    """
+    アップロードされた音声の長さ（秒）をヘッダーから読む（分からない場合は None）
+
+    WAV はヘッダーのフレーム数、FLAC は STREAMINFO の総サンプル数
+    （パイプに書き出した FLAC では 0 になるので None）、Ogg Opus は最後のページの
+    グラニュール位置から pre-skip を引いた値（48kHz単位）を使う。
+    """
+    if audio[:4] == b'RIFF':
+        try:
+            with wave.open(io.BytesIO(audio), 'rb') as wav:
+                return wav.getnframes() / wav.getframerate()
+        except (EOFError, wave.Error):
+            return None
+
+    if audio[:4] == b'fLaC' and len(audio) >= 26:
+        # STREAMINFO: サンプルレート20bit・チャンネル3bit・ビット深度5bit・総サンプル数36bit
+        packed = int.from_bytes(audio[18:26], 'big')
+        sample_rate = packed >> 44
+        total_samples = packed & ((1 << 36) - 1)
+        return total_samples / sample_rate if sample_rate and total_samples else None
+
+    if audio[:4] == b'OggS':
+        head = audio.find(b'OpusHead')
+        last_page = audio.rfind(b'OggS')
+        if head < 0 or last_page + 14 > len(audio):
+            return None
+        pre_skip = struct.unpack_from('<H', audio, head + 10)[0]
+        granule = struct.unpack_from('<q', audio, last_page + 6)[0]
+        return max(0, granule - pre_skip) / 48000
+
+    return None
+
+
+def fake_transcript(audio: bytes, language: str) -> Dict:
+    """
+    音声の長さから SEGMENT_SECONDS ごとのダミーの文字起こし結果を作る
+
+    テキストにはチャンク内の開始時刻を入れるので、結合後の時刻と見比べられる。
+    """
+    duration = audio_duration(audio)
+    if duration is None:
+        duration = SEGMENT_SECONDS
+
+    segments = []
+    words = []
+    start = 0.0
+    while start < duration:
+        end = min(start + SEGMENT_SECONDS, duration)
+        text = f"区間{start:.1f}秒から{end:.1f}秒"
+        segments.append({
+            'id': len(segments),
+            'seek': 0,
+            'start': start,
+            'end': end,
+            'text': text,
+            'tokens': [],
+            'temperature': 0.0,
+            'avg_logprob': -0.1,
+            'compression_ratio': 1.0,
+            'no_speech_prob': 0.0
+        })
+
+        step = (end - start) / WORDS_PER_SEGMENT
+        for i in range(WORDS_PER_SEGMENT):
+            words.append({'word': f"語{len(words)}", 'start': start + i * step, 'end': start + (i + 1) * step})
+        start = end
+
+    return {
+        'task': 'transcribe',
+        'language': language,
+        'duration': duration,
+        'text': ''.join(s['text'] for s in segments),
+        'segments': segments,
+        'words': words
+    }
+
+
+class TranscriptionHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        if self.path != TRANSCRIPTION_PATH:
+            self.send_json(404, {'error': {'message': f'Unknown path: {self.path}'}})
+            return
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            fields = parse_multipart(self.headers['Content-Type'], body)
+            transcript = fake_transcript(fields['file'], fields.get('language', 'ja'))
+        except KeyError as e:
+            self.send_json(400, {'error': {'message': f'Invalid request: {e}'}})
+            return
+
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+            concurrent = cls.active
+        try:
+            # 処理時間の代わり（並行して送信されていることを確認できる）
+            time.sleep(self.delay)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+        print(f"Transcribed {len(fields['file'])} bytes ({transcript['duration']:.1f}s, "
+              f"{concurrent} concurrent)", file=sys.stderr)
+        self.send_json(200, transcript)
+
+    def send_json(self, status: int, data: Dict) -> None:
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    port = 8765
+    delay = 0.0
+
+    # 引数パース
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] == '--port' and i + 1 < len(sys.argv):
+            port = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--delay' and i + 1 < len(sys.argv):
+            delay = float(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] in ('-h', '--help'):
+            print("Usage: python whisper_stub_server.py [--port N] [--delay SECONDS]", file=sys.stderr)
+            print("\nOptions:", file=sys.stderr)
+            print("  --port N           Port to listen on (default: 8765)", file=sys.stderr)
+            print("  --delay SECONDS    Simulated processing time per request (default: 0)", file=sys.stderr)
+            sys.exit(1)
+        else:
+            i += 1
+
+    TranscriptionHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', port), TranscriptionHandler)
+    print(f"Stub Whisper API listening on http://127.0.0.1:{port}/v1", file=sys.stderr)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Max concurrent requests: {TranscriptionHandler.max_active}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
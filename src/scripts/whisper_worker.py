@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+常駐型のローカルWhisperワーカー
+モデルを一度だけ読み込んだプロセスを常駐させ、Unixソケット経由で文字起こしジョブを受け付けます。
+ファイルごとに whisper コマンドを起動してモデルを読み直す必要がなくなり、
+一括処理の各ワーカーも同じモデルを共有します。
+
+プロトコルは1行1つのJSON（リクエスト・レスポンスとも）:
+    {"op": "transcribe", "audio_path": "/abs/audio.wav", "language": "ja"}
+    {"op": "ping"} / {"op": "shutdown"}
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import socket
+import tempfile
+import threading
+import subprocess
+import socketserver
+from pathlib import Path
+from typing import Callable, Dict
+
+import tracing
+
+SOCKET_ENV = 'TELOP_WHISPER_SOCKET'
+BACKEND_ENV = 'TELOP_WHISPER_BACKEND'
+BACKENDS = ('whisper', 'stub')
+DEFAULT_MODEL = 'base'
+DEFAULT_IDLE_TIMEOUT = 600.0  # ジョブがないまま経過したら終了する秒数
+STARTUP_TIMEOUT = 600.0  # 大きいモデルの読み込みを待つ上限
+
+
+def default_backend() -> str:
+    return os.environ.get(BACKEND_ENV) or 'whisper'
+
+
+def default_socket_path(model: str = DEFAULT_MODEL, backend: str = 'whisper') -> str:
+    """
+    ワーカーのソケットパス（SOCKET_ENV で変更可能。モデルごとに別のワーカーになる）
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    return str(Path(tempfile.gettempdir()) / f'telop-whisper-{os.getuid()}-{backend}-{model}.sock')
+
+
+def load_backend(backend: str, model: str) -> Callable[[str, str], Dict]:
+    """
+    文字起こし関数 transcribe(audio_path, language) -> verbose_json 形式の辞書 を作成
+
+    whisper はモデルをここで一度だけ読み込む。stub はモデルを使わず
+    whisper_stub_server.py と同じダミーの結果を返す（テスト用）。
+    """
+    if backend == 'stub':
+        from whisper_stub_server import fake_transcript
+
+        def transcribe_stub(audio_path: str, language: str) -> Dict:
+            with open(audio_path, 'rb') as f:
+                return fake_transcript(f.read(), language)
+
+        return transcribe_stub
+
+    if backend != 'whisper':
+        raise Exception(f"Unknown backend: {backend} (choose from {', '.join(BACKENDS)})")
+
+    try:
+        import whisper
+    except ImportError:
+        raise Exception("whisper package not installed. Install with: pip install openai-whisper")
+
+    print(f"Loading Whisper model: {model}", file=sys.stderr)
+    whisper_model = whisper.load_model(model)
+
+    def transcribe_whisper(audio_path: str, language: str) -> Dict:
+        result = whisper_model.transcribe(audio_path, language=language, word_timestamps=True)
+        # APIの verbose_json と同じく words をトップレベルにも置く
+        words = [word for segment in result.get('segments', []) for word in segment.get('words', [])]
+        if words:
+            result['words'] = words
+        return result
+
+    return transcribe_whisper
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    モデルを保持するソケットサーバー（文字起こしはロックで1件ずつ実行）
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, backend: str, model: str, transcribe: Callable[[str, str], Dict]):
+        self.backend = backend
+        self.model = model
+        self.transcribe = transcribe
+        self.jobs = 0
+        self.last_activity = time.monotonic()
+        self.lock = threading.Lock()
+        super().__init__(socket_path, WorkerHandler)
+
+    def handle_request_message(self, request: Dict) -> Dict:
+        op = request.get('op')
+        self.last_activity = time.monotonic()
+
+        if op == 'ping':
+            return {'ok': True, 'backend': self.backend, 'model': self.model, 'pid': os.getpid(), 'jobs': self.jobs}
+
+        if op == 'shutdown':
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {'ok': True}
+
+        if op == 'transcribe':
+            start = time.perf_counter()
+            with self.lock:
+                transcript = self.transcribe(request['audio_path'], request.get('language', 'ja'))
+                self.jobs += 1
+            self.last_activity = time.monotonic()
+            print(f"Transcribed {request['audio_path']} ({time.perf_counter() - start:.2f}s)", file=sys.stderr)
+            return {'ok': True, 'transcript': transcript}
+
+        return {'ok': False, 'error': f"Unknown op: {op}"}
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """
+    1接続で複数のリクエストを順に処理する
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.handle_request_message(json.loads(line))
+            except Exception as e:
+                response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            # whisper の結果には NumPy の数値が混ざることがある
+            self.wfile.write(json.dumps(response, ensure_ascii=False, default=float).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class WorkerClient:
+    """
+    常駐ワーカーへの接続
+    """
+
+    def __init__(self, socket_path: str, timeout: float = None):
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, payload: Dict) -> Dict:
+        self.file.write(json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise Exception(f"Whisper worker closed the connection: {self.socket_path}")
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise Exception(f"Whisper worker error: {response.get('error')}")
+        return response
+
+    def ping(self) -> Dict:
+        return self.request({'op': 'ping'})
+
+    def transcribe(self, audio_path: str, language: str = 'ja') -> Dict:
+        # ワーカーは別のカレントディレクトリで動いているので絶対パスで渡す
+        audio_path = str(Path(audio_path).resolve())
+        with tracing.span('whisper-local', cat='asr', audio=audio_path):
+            return self.request({'op': 'transcribe', 'audio_path': audio_path, 'language': language})['transcript']
+
+    def shutdown(self) -> None:
+        self.request({'op': 'shutdown'})
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def try_connect(socket_path: str) -> WorkerClient:
+    """
+    起動済みのワーカーに接続（応答がなければ None）
+    """
+    try:
+        client = WorkerClient(socket_path, timeout=5.0)
+    except OSError:
+        return None
+    try:
+        client.ping()
+    except Exception:
+        client.close()
+        return None
+    client.sock.settimeout(None)
+    return client
+
+
+def connect_worker(model: str = DEFAULT_MODEL, backend: str = None, socket_path: str = None,
+                   idle_timeout: float = DEFAULT_IDLE_TIMEOUT) -> WorkerClient:
+    """
+    ワーカーに接続し、起動していなければバックグラウンドで起動してモデルの読み込みを待つ
+
+    複数のプロセスから同時に呼ばれても、ロックファイルによりワーカーは1つだけ起動される。
+    """
+    backend = backend or default_backend()
+    socket_path = socket_path or default_socket_path(model, backend)
+
+    client = try_connect(socket_path)
+    if client is not None:
+        return client
+
+    with open(socket_path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        # ロック待ちの間に他のプロセスが起動した場合
+        client = try_connect(socket_path)
+        if client is not None:
+            return client
+
+        print(f"Starting local Whisper worker ({backend}, model {model})...", file=sys.stderr)
+        log_path = socket_path + '.log'
+        with open(log_path, 'ab') as log:
+            proc = subprocess.Popen(
+                [sys.executable, str(Path(__file__).resolve()), 'serve',
+                 '--model', model, '--backend', backend, '--socket', socket_path,
+                 '--idle-timeout', str(idle_timeout)],
+                stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                start_new_session=True
+            )
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise Exception(f"Whisper worker exited with code {proc.returncode} (see {log_path})")
+            client = try_connect(socket_path)
+            if client is not None:
+                print(f"✓ Whisper worker ready (pid {proc.pid})", file=sys.stderr)
+                return client
+            time.sleep(0.1)
+
+    raise Exception(f"Whisper worker did not start within {STARTUP_TIMEOUT:.0f}s (see {log_path})")
+
+
+def serve(socket_path: str, backend: str, model: str, idle_timeout: float = DEFAULT_IDLE_TIMEOUT) -> None:
+    """
+    モデルを読み込んでソケットで待ち受ける（idle_timeout 秒ジョブがなければ終了）
+    """
+    if Path(socket_path).exists():
+        client = try_connect(socket_path)
+        if client is not None:
+            client.close()
+            raise Exception(f"A worker is already listening on {socket_path}")
+        # 異常終了したワーカーが残したソケット
+        Path(socket_path).unlink()
+
+    transcribe = load_backend(backend, model)
+    server = WorkerServer(socket_path, backend, model, transcribe)
+    print(f"Whisper worker listening on {socket_path} (pid {os.getpid()})", file=sys.stderr)
+
+    def watch_idle():
+        while True:
+            time.sleep(min(idle_timeout, 5.0))
+            if time.monotonic() - server.last_activity > idle_timeout and not server.lock.locked():
+                print(f"Idle for {idle_timeout:.0f}s, shutting down", file=sys.stderr)
+                server.shutdown()
+                return
+
+    if idle_timeout > 0:
+        threading.Thread(target=watch_idle, daemon=True).start()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if Path(socket_path).exists():
+            Path(socket_path).unlink()
+        print(f"Whisper worker stopped after {server.jobs} job(s)", file=sys.stderr)
+
+
+def main():
+    commands = ('serve', 'transcribe', 'status', 'stop')
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print("Usage: python whisper_worker.py <serve|transcribe|status|stop> [options]", file=sys.stderr)
+        print("\nCommands:", file=sys.stderr)
+        print("  serve                Load the model and accept jobs on the socket", file=sys.stderr)
+        print("  transcribe WAV...    Transcribe files with the worker (started if needed), JSON to stdout", file=sys.stderr)
+        print("  status               Show the running worker", file=sys.stderr)
+        print("  stop                 Stop the running worker", file=sys.stderr)
+        print("\nOptions:", file=sys.stderr)
+        print(f"  --model NAME         Whisper model (default: {DEFAULT_MODEL})", file=sys.stderr)
+        print(f"  --backend NAME       {' or '.join(BACKENDS)} (default: ${BACKEND_ENV} or whisper)", file=sys.stderr)
+        print(f"  --socket PATH        Socket path (default: ${SOCKET_ENV} or a per-model path in the temp dir)", file=sys.stderr)
+        print("  --language CODE      Language of the audio (default: ja)", file=sys.stderr)
+        print(f"  --idle-timeout S     Stop the worker after S idle seconds, 0 to never stop (default: {DEFAULT_IDLE_TIMEOUT:.0f})", file=sys.stderr)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    model = DEFAULT_MODEL
+    backend = default_backend()
+    socket_path = None
+    language = 'ja'
+    idle_timeout = DEFAULT_IDLE_TIMEOUT
+    files = []
+
+    # 引数パース
+    i = 2
+    while i < len(sys.argv):
+        if sys.argv[i] == '--model' and i + 1 < len(sys.argv):
+            model = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--backend' and i + 1 < len(sys.argv):
+            backend = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--socket' and i + 1 < len(sys.argv):
+            socket_path = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--language' and i + 1 < len(sys.argv):
+            language = sys.argv[i + 1]
+            i += 2
+        elif sys.argv[i] == '--idle-timeout' and i + 1 < len(sys.argv):
+            idle_timeout = float(sys.argv[i + 1])
+            i += 2
+        else:
+            files.append(sys.argv[i])
+            i += 1
+
+    if backend not in BACKENDS:
+        print(f"Error: Unknown backend: {backend} (choose from {', '.join(BACKENDS)})", file=sys.stderr)
+        sys.exit(1)
+
+    socket_path = socket_path or default_socket_path(model, backend)
+
+    try:
+        if command == 'serve':
+            serve(socket_path, backend, model, idle_timeout)
+
+        elif command == 'transcribe':
+            with connect_worker(model, backend, socket_path, idle_timeout) as client:
+                for path in files:
+                    transcript = client.transcribe(path, language)
+                    print(json.dumps({'audio_path': path, **transcript}, ensure_ascii=False, default=float))
+
+        elif command == 'status':
+            client = try_connect(socket_path)
+            if client is None:
+                print(f"No worker on {socket_path}", file=sys.stderr)
+                sys.exit(1)
+            with client:
+                info = client.ping()
+            print(f"Worker pid {info['pid']} ({info['backend']}, model {info['model']}), "
+                  f"{info['jobs']} job(s) on {socket_path}", file=sys.stderr)
+
+        elif command == 'stop':
+            client = try_connect(socket_path)
+            if client is None:
+                print(f"No worker on {socket_path}", file=sys.stderr)
+                return
+            with client:
+                client.shutdown()
+            print("Stopped worker", file=sys.stderr)
+
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
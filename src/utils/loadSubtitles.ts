@@ -19,11 +19,15 @@ export function loadSubtitlesFromJson(jsonData: any): SubtitleEntry[] {
 }
 
 /**
- * SRT形式の字幕データをパースする
+ * SRT形式の字幕データをパースする（CRLF・BOM・キューの間の余分な空行にも対応）
  */
 export function parseSrtSubtitles(srtContent: string): SubtitleEntry[] {
   const subtitles: SubtitleEntry[] = [];
-  const blocks = srtContent.trim().split('\n\n');
+  const blocks = srtContent
+    .replace(/^\uFEFF/, '')
+    .replace(/\r\n?/g, '\n')
+    .trim()
+    .split(/\n[ \t]*\n\s*/);
 
   for (const block of blocks) {
     const lines = block.split('\n');